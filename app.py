@@ -3,9 +3,8 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
 from fastapi.openapi.utils import get_openapi
 from pydantic import BaseModel, Field
-from core.search_bm25 import BM25Search
 from typing import List,Dict
-from core.kb_manager import KnowledgeBase
+from core.kb_manager import KnowledgeBase, parse_pool, ingest_metrics
 import asyncio
 import os
 import shutil
@@ -16,6 +15,8 @@ import time
 from logging.handlers import RotatingFileHandler
 import aiofiles
 import json
+import weakref
+from contextlib import nullcontext
 from dotenv import load_dotenv
 
 # 尽早加载 .env，确保后续导入的模块能读到环境变量（与工作目录无关）
@@ -23,16 +24,23 @@ _env_path = os.getenv("DOTENV_PATH") or os.path.join(os.path.dirname(os.path.abs
 load_dotenv(_env_path)
 
 from core.engine import (
-    run_llm_Knowlege_baes_file_QA,
-    run_llm_MulitDocQA,
+    arun_llm_Knowlege_baes_file_QA,
+    arun_llm_MulitDocQA,
     view_history,
     generate_guiding_questions,
     stream_type,
-    kb_state,
-    only_llm,
-    get_embeddings
+    kb_pool,
+    rerank_cache,
+    rerank_scheduler_stats,
+    embedding_cache_stats,
+    retrieval_cache,
+    answer_cache,
+    llm_clients,
+    chunk_embedding_store,
+    aonly_llm,
 )
-from core.engine import get_top_documents, create_final_response
+from core.engine import get_cached_top_documents, create_final_response
+from core.model_registry import model_registry
 # Configure logging (console + rotating file)
 LOG_DIR = os.path.join(os.getcwd(), "logs")
 os.makedirs(LOG_DIR, exist_ok=True)
@@ -74,6 +82,8 @@ app.add_middleware(
     allow_credentials=False,  # 避免浏览器在有凭据时拒绝 * 的 CORS 响应
     allow_methods=["GET", "POST", "OPTIONS"],
     allow_headers=["*"],
+    # 跨域页面需要读取回传的请求 id（/final_response 携带以复用检索结果）
+    expose_headers=["X-Request-ID"],
 )
 
 # Simple request logging middleware
@@ -89,6 +99,8 @@ async def log_requests(request: Request, call_next):
     request.state.req_id = req_id
     try:
         response = await call_next(request)
+        # 回传请求 id，客户端可在 /final_response 中携带以复用该轮的检索结果
+        response.headers["X-Request-ID"] = req_id
         duration_ms = (time.time() - start) * 1000
         logger.info(f"[req:{req_id}] {method} {path} -> {response.status_code} in {duration_ms:.1f}ms")
         return response
@@ -133,6 +145,35 @@ class FinalResponseRequest(BaseModel):
     show_source: bool
     derivation: bool
     query: str
+    kb_name: str = Field(default=None)
+    req_id: str = Field(default=None)
+
+class PinnedStreamingResponse(StreamingResponse):
+    """
+    持有知识库钉住的流式响应
+
+    响应体通过 kb_pool.locked(state, unpin=release) 拿到读锁时解除钉住；响应结束（包括客户端在响应体
+    开始前断开、发送出错）或响应对象未被执行就被回收时，同一个 release 兜底解除，条目不会一直无法淘汰。
+    """
+
+    def __init__(self, content, release=None, **kwargs):
+        super().__init__(content, **kwargs)
+        self._release = release or (lambda: None)
+        if release is not None:
+            weakref.finalize(self, release)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # 关闭 LLM 共享连接池
+    await llm_clients.aclose()
+    # 结束解析进程池
+    parse_pool.shutdown()
 
 # @app.on_event("startup")
 # async def startup_event():
@@ -175,7 +216,11 @@ async def delete_kb(kb_name: str = Form(...)):
 
     if os.path.exists(kb_dir):
         try:
-            shutil.rmtree(kb_dir)
+            # 等待该知识库上进行中的问答/更新结束后再移出资源池并删除目录
+            state = kb_pool.peek(kb_name)
+            async with (state.lock.write() if state is not None else nullcontext()):
+                kb_pool.invalidate(kb_name)
+                await asyncio.to_thread(shutil.rmtree, kb_dir)
             logger.info(f"✓ KB deleted: {kb_name}")
             return JSONResponse(status_code=200, content={"code": 200, "message": f"Knowledge base '{kb_name}' deleted successfully"})
         except Exception as e:
@@ -203,27 +248,14 @@ async def update_vectordb_api(kb_name: str = Form(...), files: List[UploadFile]
     upload_directory = os.path.join(kb_dir, "uploads")
     os.makedirs(upload_directory, exist_ok=True)
 
-    kb = None
-    # 使用全局 kb_state，避免 FastAPI/Pydantic 对默认参数进行深拷贝导致 _thread.lock 错误
-    state = kb_state
-
-    # 检查知识库是否存在
-    if not os.path.exists(kb_dir):
-        try:
-            os.makedirs(kb_dir, exist_ok=True)
-            kb = KnowledgeBase(kb_name, get_embeddings())
-            state.current_kb_name = kb_name
-        except Exception as e:
-            error_message = str(e)
-            logger.error(f"Error occurred while creating knowledge base '{kb_name}': {error_message}")
-            return JSONResponse(status_code=500, content={"code": 500, "message": error_message})
-    else:
-        try:
-            kb = KnowledgeBase(kb_name, get_embeddings())
-        except Exception as e:
-            error_message = str(e)
-            logger.error(f"Error occurred while loading knowledge base '{kb_name}': {error_message}")
-            return JSONResponse(status_code=500, content={"code": 500, "message": error_message})
+    # 从资源池获取知识库（不存在时创建目录并加载空知识库）
+    try:
+        state = await kb_pool.get(kb_name)
+        kb = state.kb
+    except Exception as e:
+        error_message = str(e)
+        logger.error(f"Error occurred while loading knowledge base '{kb_name}': {error_message}")
+        return JSONResponse(status_code=500, content={"code": 500, "message": error_message})
 
     # 保存上传的文件，并保留副本到 doc_directory
     try:
@@ -254,21 +286,22 @@ async def update_vectordb_api(kb_name: str = Form(...), files: List[UploadFile]
         # 更新向量库
         print("# 更新向量库\n\n")
         logger.info(f"Start updating vector DB for KB '{kb_name}' with {len(files)} file(s)")
-        result = await kb.update_vectordb(files)
-        
-        # 重新加载向量库
-        state.kb_vectordb = await kb.load_vectordb()
-        print('# 重新加载向量库\n\n')
-        
-        # 更新全局状态
-        await update_global_state(kb_name, kb, state)
-        print('# 更新全局状态\n\n')
+        # 写锁：等待该知识库上进行中的问答结束，更新期间新的问答请求排队
+        # 保存文件期间该知识库可能已被淘汰，重新取出并钉住，直到拿到写锁
+        async with kb_pool.locked(await kb_pool.get(kb_name, pin=True), write=True) as state:
+            # 按文件清单的内容哈希只处理新增与内容变化的文件，本次上传的文件名用于旧知识库首次建立清单
+            result = await state.kb.update_vectordb(files, fresh_names={os.path.basename(path) for path in saved_paths})
+
+            # 刷新资源池中的向量库、BM25 与元数据目录
+            await kb_pool.refresh(state)
+            print('# 重新加载向量库\n\n')
 
         # 可选择：保留 uploads 目录中的文件。此处不再清空，便于用户确认上传成功
         # 如需节省空间，可改为移动到 doc_directory 后清空。
         logger.info(f"Knowledge base '{kb_name}' vector DB updated; uploads retained for verification.")
 
-        logger.info(f"✓ KB updated: {kb_name}")
+        logger.info(f"✓ KB updated: {kb_name} (added={len(result['added'])}, replaced={len(result['replaced'])}, "
+                    f"skipped={len(result['skipped'])}, failed={len(result['failed'])})")
         
         return JSONResponse(status_code=200, content={"code": 200, "message": f"Knowledge base '{kb_name}' updated successfully and select", "result": result})
 
@@ -277,6 +310,38 @@ async def update_vectordb_api(kb_name: str = Form(...), files: List[UploadFile]
         logger.error(f"Error occurred while updating knowledge base '{kb_name}': {error_message}")
         return JSONResponse(status_code=500, content={"code": 500, "message": error_message})
 
+@app.get("/kb_pool_stats")
+async def kb_pool_stats_api():
+    """
+    查看多知识库资源池状态（已常驻的知识库、内存占用与预算）
+
+    Returns:
+        JSONResponse: 资源池统计信息
+    """
+    return JSONResponse(status_code=200, content={"code": 200, "data": kb_pool.stats()})
+
+@app.get("/stats")
+async def stats_api():
+    """
+    查看运行时统计信息（资源池、重排得分缓存命中率、嵌入模型常驻内存、LLM 连接复用等）
+
+    Returns:
+        JSONResponse: 统计信息
+    """
+    return JSONResponse(status_code=200, content={"code": 200, "data": {
+        "kb_pool": kb_pool.stats(),
+        "rerank_cache": rerank_cache.stats() if rerank_cache is not None else None,
+        "rerank_scheduler": rerank_scheduler_stats(),
+        "query_embedding_cache": embedding_cache_stats(),
+        "chunk_embedding_cache": chunk_embedding_store.stats() if chunk_embedding_store is not None else None,
+        "retrieval_cache": retrieval_cache.stats(),
+        "answer_cache": answer_cache.stats() if answer_cache is not None else None,
+        "embedding_models": model_registry.stats(),
+        "llm_clients": llm_clients.stats(),
+        "parse_pool": parse_pool.stats(),
+        "ingest": ingest_metrics.stats(),
+    }})
+
 @app.get("/logs")
 async def get_logs(lines: int = 200):
     """
@@ -300,30 +365,6 @@ async def get_logs(lines: int = 200):
         logger.error(f"Error reading logs: {error_message}")
         return JSONResponse(status_code=500, content={"code": 500, "message": error_message})
 
-async def update_global_state(kb_name, kb, state):
-    """
-    更新全局状态，包括知识库实例、向量数据库、BM25搜索器等
-    
-    Args:
-        kb_name (str): 知识库名称
-        kb (KnowledgeBase): 知识库实例
-        state: 全局状态对象
-    """
-    state.kb = kb
-    state.kb_vectordb = await state.kb.load_vectordb()
-    state.history = []
-    # 防御性处理：向量库可能尚未创建或为空
-    if state.kb_vectordb is not None:
-        state.unfilter_context = [doc for doc_id, doc in state.kb_vectordb.docstore._dict.items()]
-        logger.info("正在初始化 BM25 索引...")
-        state.searcher_from_target_doc = BM25Search(state.unfilter_context)
-    else:
-        state.unfilter_context = []
-        state.searcher_from_target_doc = None
-    state.current_kb_name = kb_name
-    print("重新选择向量库完成")
-    logger.debug(f"KB selected: {kb_name}")
-    
 # @app.post("/update_vectordb")
 # async def update_vectordb_api(kb_name: str = Form(...), files: List[UploadFile] = File(...), state=kb_state):
 #     KB_DIR = config['paths']['kb_dir']
@@ -420,49 +461,13 @@ async def view_guiding_questions_api(request: Request):
         request_body = await request.json()
         kb_name = request_body.get('kb_name')
 
-        #add 数据库加载
-        KB_DIR = config['paths']['kb_dir']
-        
-        # global kb_state  # 确保使用全局的kb_state实例
-        # 检查是否需要重新加载知识库
-        if kb_state.current_kb_name == kb_name:
-            logger.debug(f"KB {kb_name} cached")
-        else:
-            kb_dir = os.path.join(KB_DIR, kb_name)
-            if os.path.exists(kb_dir):
-                try:
-                    kb_state.kb = KnowledgeBase(kb_name, get_embeddings())
-                    kb_state.kb_vectordb = await kb_state.kb.load_vectordb()
-                    kb_state.history = []
-                    # 防御：向量库可能尚未创建
-                    if kb_state.kb_vectordb is not None:
-                        kb_state.unfilter_context = [doc for doc_id, doc in kb_state.kb_vectordb.docstore._dict.items()]
-                        kb_state.searcher_from_target_doc = BM25Search(kb_state.unfilter_context)
-                    else:
-                        kb_state.unfilter_context = []
-                        kb_state.searcher_from_target_doc = None
-                    kb_state.current_kb_name = kb_name  # 更新当前知识库名称
-                    logger.debug(f"KB selected: {kb_name}")
-                    #yield JSONResponse(status_code=200, content={"code": 200, "message": f"Knowledge base '{kb_name}' selected successfully"})
-                except Exception as e:
-                    error_message = str(e)
-                    logger.error(f"Error occurred while selecting knowledge base '{kb_name}': {error_message}")
-                    return JSONResponse(status_code=500, content={"code": 500, "message": error_message})
-            else:
-                try:
-                    os.makedirs(kb_dir, exist_ok=True)
-                    kb_state.kb = KnowledgeBase(kb_name, get_embeddings())
-                    kb_state.kb_vectordb = None
-                    kb_state.history = []
-                    kb_state.unfilter_context = []
-                    kb_state.searcher_from_target_doc = None
-                    kb_state.current_kb_name = kb_name  # 更新当前知识库名称
-                    logger.info(f"✓ KB created: {kb_name}")
-                    #return JSONResponse(status_code=200, content={"code": 200, "message": f"Knowledge base '{kb_name}' created successfully"})
-                except Exception as e:
-                    error_message = str(e)
-                    logger.error(f"Error occurred while creating knowledge base '{kb_name}': {error_message}")
-                    return JSONResponse(status_code=500, content={"code": 500, "message": error_message})
+        try:
+            state = await kb_pool.get(kb_name, pin=True)
+            logger.debug(f"KB selected: {kb_name}")
+        except Exception as e:
+            error_message = str(e)
+            logger.error(f"Error occurred while selecting knowledge base '{kb_name}': {error_message}")
+            return JSONResponse(status_code=500, content={"code": 500, "message": error_message})
     except Exception as e:
         error_message = str(e)
         logger.error(f"An unexpected error occurred: {error_message}")
@@ -470,11 +475,12 @@ async def view_guiding_questions_api(request: Request):
 ###############################################################
     try:
         # 若尚未构建向量库，直接返回空的引导问题以避免 500
-        if kb_state.kb_vectordb is None:
-            logger.warning(f"Vector DB not available for knowledge base '{kb_state.current_kb_name}'. Returning empty guiding questions.")
-            return JSONResponse(status_code=200, content={"code": 200, "guiding_questions": []})
+        async with kb_pool.locked(state):
+            if state.kb_vectordb is None:
+                logger.warning(f"Vector DB not available for knowledge base '{kb_name}'. Returning empty guiding questions.")
+                return JSONResponse(status_code=200, content={"code": 200, "guiding_questions": []})
 
-        guiding_questions = generate_guiding_questions()
+            guiding_questions = await asyncio.to_thread(generate_guiding_questions, state=state)
         logger.info("Guiding questions generated successfully")
         return JSONResponse(status_code=200, content={"code": 200, "guiding_questions": guiding_questions})
     except Exception as e:
@@ -502,8 +508,10 @@ async def remove_file_api(kb_name: str = Form(...), file_name: str = Form(...)):
         raise HTTPException(status_code=500, detail={"code": 500,"message": f"Knowledge base '{kb_name}' does not exist"})
     
     try:
-        kb = KnowledgeBase(kb_name, get_embeddings())
-        result = await kb.remove_file(file_name)
+        state = await kb_pool.get(kb_name, pin=True)
+        async with kb_pool.locked(state, write=True):
+            result = await state.kb.remove_file(file_name)
+            await kb_pool.refresh(state)
         logger.info(f"File '{file_name}' removed successfully from knowledge base '{kb_name}'")
         return JSONResponse(status_code=200, content={"code": 200, "message": result})
     except HTTPException as e:
@@ -525,6 +533,8 @@ async def run_llm_mulitdoc_qa_api(request: Request):
     Returns:
         StreamingResponse 或 JSONResponse: 流式响应或JSON响应
     """
+    # 钉住知识库后、响应开始前出错时由 except 解除钉住
+    release = None
     try:
         request_data = await request.json()
         prompt_request = PromptRequest(**request_data)
@@ -556,85 +566,47 @@ async def run_llm_mulitdoc_qa_api(request: Request):
             temperature = config['settings'].get('temperature_default', 0.5)
         logger.info(f"[req:{_req}] flags only_chatKBQA={only_chatKBQA} multiple_dialogue={multiple_dialogue} derivation={derivation} show_source={show_source} stream={getattr(prompt_request,'stream',True)}")
 
+        state = None
         if kb_name != None:
-            #add 数据库加载
-            KB_DIR = config['paths']['kb_dir']
-            
-            # global kb_state  # 确保使用全局的kb_state实例
-            # 检查是否需要重新加载知识库
-            if kb_state.current_kb_name == kb_name:
-                logger.debug(f"[req:{_req}] KB {kb_name} cached")
-    
-            else:
-                kb_dir = os.path.join(KB_DIR, kb_name)
-        
-                if os.path.exists(kb_dir):
-                    try:
-                        kb_state.current_kb_name = kb_name
-                        kb_state.kb = KnowledgeBase(kb_name, get_embeddings())
-                        kb_state.kb_vectordb = await kb_state.kb.load_vectordb()
-                        kb_state.history = []
-                        # 防御：向量库可能尚未创建
-                        if kb_state.kb_vectordb is not None:
-                            kb_state.unfilter_context = [doc for doc_id, doc in kb_state.kb_vectordb.docstore._dict.items()]
-                            kb_state.searcher_from_target_doc = BM25Search(kb_state.unfilter_context)
-                        else:
-                            kb_state.unfilter_context = []
-                            kb_state.searcher_from_target_doc = None
-                            logger.warning(f"Vector DB not available for knowledge base '{kb_name}'. Proceeding without KB context.")
-                        
-                        logger.debug(f"[req:{_req}] KB selected: {kb_name}")
-                        #yield JSONResponse(status_code=200, content={"code": 200, "message": f"Knowledge base '{kb_name}' selected successfully"})
-                    except Exception as e:
-                        error_message = str(e)
-                        logger.error(f"Error occurred while selecting knowledge base '{kb_name}': {error_message}")
-                        #yield 
-                        return JSONResponse(status_code=500, content={"code": 500, "message": error_message})
-                else:
-                    try:
-                        kb_state.current_kb_name = kb_name  # 更新当前知识库名称
-                        os.makedirs(kb_dir, exist_ok=True)
-                        kb_state.kb = KnowledgeBase(kb_name, get_embeddings())
-                        kb_state.kb_vectordb = None
-                        kb_state.history = []
-                        kb_state.unfilter_context = []
-                        kb_state.searcher_from_target_doc = None
-                        
-                        logger.info(f"[req:{_req}] ✓ KB created: {kb_name}")
-                        #return JSONResponse(status_code=200, content={"code": 200, "message": f"Knowledge base '{kb_name}' created successfully"})
-                    except Exception as e:
-                        error_message = str(e)
-                        logger.error(f"Error occurred while creating knowledge base '{kb_name}': {error_message}")
-                        return JSONResponse(status_code=500, content={"code": 500, "message": error_message})
-            
+            # 按请求解析知识库：已常驻则直接复用，否则由资源池加载（不影响其他知识库上的请求）
+            try:
+                # 钉住该知识库，直到回答开始时拿到读锁，期间不会被其他请求的加载淘汰
+                state = await kb_pool.get(kb_name, pin=True)
+                release = kb_pool.pin_releaser(state)
+                logger.debug(f"[req:{_req}] KB selected: {kb_name}")
+            except Exception as e:
+                error_message = str(e)
+                logger.error(f"Error occurred while selecting knowledge base '{kb_name}': {error_message}")
+                return JSONResponse(status_code=500, content={"code": 500, "message": error_message})
+
             # 当向量库不可用时，回退为仅LLM对话，避免 500
-            if kb_state.kb_vectordb is None:
+            if state.kb_vectordb is None:
                 logger.warning(f"[req:{_req}] KB '{kb_name}' has no vector DB; answering without KB context.")
-                result_generator = only_llm(query, prompt_template_from_user, temperature, multiple_dialogue)
+                result_generator = aonly_llm(query, prompt_template_from_user, temperature, multiple_dialogue)
             else:
                 logger.info(f"[req:{_req}] using KB '{kb_name}' for QA")
-                result_generator = run_llm_MulitDocQA(query, only_chatKBQA, prompt_template_from_user, temperature, multiple_dialogue, derivation, show_source, req_id=_req)
+                result_generator = arun_llm_MulitDocQA(query, only_chatKBQA, prompt_template_from_user, temperature, multiple_dialogue, derivation, show_source, req_id=_req, state=state)
         else:
             logger.info(f"[req:{_req}] no kb specified; using only LLM")
-            result_generator = only_llm(query, prompt_template_from_user, temperature, multiple_dialogue)
+            result_generator = aonly_llm(query, prompt_template_from_user, temperature, multiple_dialogue)
 
         # 如果客户端支持流式（SSE），按流式返回；否则聚合为一次性 JSON 返回
+        # 异步生成器：检索在线程池中执行、LLM 使用 astream，等待期间不阻塞其他请求
+        # 生成器消费期间持有知识库读锁，防止更新/删除在回答过程中替换向量库
         stream = getattr(prompt_request, "stream", True)
         if stream:
             async def output_generator():
-                yield stream_type(None)
-                response_text = ""
-                for chunk in result_generator:
-                    decoded_chunk = chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
-                    response_text += decoded_chunk
-                    yield chunk
-                    await asyncio.sleep(0)
-                yield "data: [DONE]\n\n"
+                async with (kb_pool.locked(state, unpin=release) if state is not None else nullcontext()):
+                    yield stream_type(None)
+                    async for chunk in result_generator:
+                        yield chunk
+                    yield "data: [DONE]\n\n"
 
             logger.info(f"[req:{_req}] Request processed successfully")
             # 添加禁用缓冲的响应头，确保反向代理和浏览器即时刷新 SSE 内容
-            return StreamingResponse(
+            return PinnedStreamingResponse(
                 output_generator(),
+                release,
                 media_type="text/event-stream",
                 headers={
                     "Cache-Control": "no-cache",
@@ -645,23 +617,24 @@ async def run_llm_mulitdoc_qa_api(request: Request):
             # 非流式聚合：解析 SSE payload 提取文本
             aggregated_text = ""
             sources = []
-            for chunk in result_generator:
-                decoded_chunk = chunk.decode('utf-8') if isinstance(chunk, bytes) else str(chunk)
-                if not decoded_chunk.startswith("data: "):
-                    continue
-                payload = decoded_chunk[len("data: "):].strip()
-                try:
-                    obj = json.loads(payload)
-                    delta = obj.get("choices", [{}])[0].get("delta", {})
-                    content = delta.get("content")
-                    if content:
-                        aggregated_text += content
-                    file_url = delta.get("file_url")
-                    if show_source and file_url:
-                        sources.append(file_url)
-                except Exception:
-                    # 跳过异常的 SSE 片段
-                    continue
+            async with (kb_pool.locked(state, unpin=release) if state is not None else nullcontext()):
+                async for chunk in result_generator:
+                    decoded_chunk = chunk.decode('utf-8') if isinstance(chunk, bytes) else str(chunk)
+                    if not decoded_chunk.startswith("data: "):
+                        continue
+                    payload = decoded_chunk[len("data: "):].strip()
+                    try:
+                        obj = json.loads(payload)
+                        delta = obj.get("choices", [{}])[0].get("delta", {})
+                        content = delta.get("content")
+                        if content:
+                            aggregated_text += content
+                        file_url = delta.get("file_url")
+                        if show_source and file_url:
+                            sources.append(file_url)
+                    except Exception:
+                        # 跳过异常的 SSE 片段
+                        continue
 
             logger.info(f"[req:{_req}] Request processed successfully (non-stream)")
             return JSONResponse(status_code=200, content={
@@ -674,6 +647,8 @@ async def run_llm_mulitdoc_qa_api(request: Request):
             })
 
     except Exception as e:
+        if release is not None:
+            release()
         error_message = str(e)
         logger.error(f"An unexpected error occurred: {error_message}")
         raise HTTPException(status_code=500, detail={"code": 500, "message":f"An unexpected error occurred: {error_message}"})
@@ -689,9 +664,20 @@ async def get_final_response(request: FinalResponseRequest):
     Returns:
         JSONResponse: 包含完整响应信息的JSON响应
     """
-    top_documents_with_score = get_top_documents(request.query)
+    # 检索结果必须来自产生该回答的知识库：优先用请求中的 kb_name，否则按 req_id 从检索结果缓存中找回
+    kb_name = request.kb_name or retrieval_cache.kb_name_for(request.req_id)
+    if not kb_name:
+        return JSONResponse(status_code=400, content={"code": 400, "message": "kb_name is required (or a req_id returned by /mulitdoc_qa)"})
+    state = await kb_pool.get(kb_name, pin=True)
+    async with kb_pool.locked(state):
+        if state.kb_vectordb is None:
+            return JSONResponse(status_code=400, content={"code": 400, "message": f"Knowledge base '{kb_name}' has no vector DB"})
+        # 优先复用 /mulitdoc_qa 刚缓存的检索结果（按 req_id 或 知识库+问题+版本），未命中时才重新检索
+        top_documents_with_score = await asyncio.to_thread(get_cached_top_documents, request.query, req_id=request.req_id, state=state)
     
-    final_response = create_final_response(
+    # 派生问题需要一次 LLM 调用，放到线程池中避免阻塞事件循环
+    final_response = await asyncio.to_thread(
+        create_final_response,
         request.current_dialog, 
         request.show_source, 
         top_documents_with_score, 
@@ -758,25 +744,32 @@ async def run_llm_Knowlege_baes_file_QA_api(request: Request):
     Returns:
         StreamingResponse: 流式响应
     """
+    # 钉住知识库后、响应开始前出错时由 except 解除钉住
+    release = None
     try:
         request_data = await request.json()
         prompt_request = PromptRequest(**request_data)
         messages = prompt_request.messages
         query = messages[0].content
         keep_history = prompt_request.keep_history
+        kb_name = prompt_request.kb_name
+        state = await kb_pool.get(kb_name, pin=True) if kb_name else kb_pool.current(pin=True)
+        release = kb_pool.pin_releaser(state)
 
-        result_generator = run_llm_Knowlege_baes_file_QA(query, keep_history)
+        result_generator = arun_llm_Knowlege_baes_file_QA(query, keep_history, state=state)
 
         async def output_generator():
-            yield stream_type(None)
-            for chunk in result_generator:
-                yield stream_type(chunk)
-                await asyncio.sleep(0)
-            yield "data: [DONE]\n\n"
+            async with kb_pool.locked(state, unpin=release):
+                yield stream_type(None)
+                async for chunk in result_generator:
+                    yield stream_type(chunk)
+                yield "data: [DONE]\n\n"
 
-        return StreamingResponse(output_generator(), media_type="text/event-stream")
+        return PinnedStreamingResponse(output_generator(), release, media_type="text/event-stream")
 
     except Exception as e:
+        if release is not None:
+            release()
         error_message = str(e)
         if "Content Exists Risk" in error_message:
             print("====")
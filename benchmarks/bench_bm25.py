@@ -0,0 +1,104 @@
+"""
+BM25 基准测试：rank_bm25.BM25Okapi 与 core.search_bm25.BM25Index 对比
+
+使用合成的已分词语料（Zipf 分布词表），分别统计构建耗时、单次查询耗时，
+并校验两者在 search(query, threshold) 语义下返回的文档顺序是否一致。
+
+用法（在项目根目录执行）:
+    python benchmarks/bench_bm25.py --sizes 10000,100000,1000000
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')))
+
+from core.search_bm25 import BM25Index
+
+
+def make_corpus(num_docs, vocab_size, avg_len, seed=0):
+    rng = np.random.default_rng(seed)
+    lens = rng.poisson(avg_len, size=num_docs).clip(min=1)
+    term_ids = rng.zipf(1.2, size=int(lens.sum())) % vocab_size
+    vocab = [f"w{i}" for i in range(vocab_size)]
+    corpus = []
+    pos = 0
+    for n in lens:
+        corpus.append([vocab[t] for t in term_ids[pos:pos + n]])
+        pos += n
+    return corpus
+
+
+def make_queries(corpus, num_queries, seed=1):
+    rng = np.random.default_rng(seed)
+    queries = []
+    for i in rng.integers(0, len(corpus), size=num_queries):
+        doc = corpus[i]
+        k = min(len(doc), 6)
+        queries.append([doc[j] for j in rng.choice(len(doc), size=k, replace=False)])
+    return queries
+
+
+def baseline_search(bm25, query, threshold, top_k):
+    scores = bm25.get_scores(query)
+    hits = [{'corpus_id': idx, 'score': score} for idx, score in enumerate(scores) if score >= threshold]
+    hits = sorted(hits, key=lambda x: x['score'], reverse=True)
+    return [hit['corpus_id'] for hit in hits][:top_k]
+
+
+def run(size, args):
+    print(f"\n== {size} chunks ==")
+    corpus = make_corpus(size, args.vocab, args.avg_len)
+    queries = make_queries(corpus, args.queries)
+
+    start = time.perf_counter()
+    index = BM25Index.from_tokenized(corpus)
+    print(f"BM25Index  build: {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    new_results = [BM25Index.select(index.get_scores(q), args.threshold, args.top_k).tolist() for q in queries]
+    new_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    print(f"BM25Index  query: {new_ms:.2f} ms/query")
+
+    if size > args.baseline_max:
+        print(f"BM25Okapi  skipped (size > --baseline-max {args.baseline_max})")
+        return
+
+    try:
+        from rank_bm25 import BM25Okapi
+    except ImportError:
+        print("BM25Okapi  skipped (rank_bm25 not installed)")
+        return
+
+    start = time.perf_counter()
+    okapi = BM25Okapi(corpus)
+    print(f"BM25Okapi  build: {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    old_results = [baseline_search(okapi, q, args.threshold, args.top_k) for q in queries]
+    old_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    print(f"BM25Okapi  query: {old_ms:.2f} ms/query  (speedup x{old_ms / max(new_ms, 1e-9):.1f})")
+
+    mismatches = sum(1 for a, b in zip(old_results, new_results) if a != b)
+    print(f"result mismatches: {mismatches}/{len(queries)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default="10000,100000,1000000", help="逗号分隔的语料规模")
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--vocab', type=int, default=200000)
+    parser.add_argument('--avg-len', type=int, default=60)
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--top-k', type=int, default=8)
+    parser.add_argument('--baseline-max', type=int, default=1000000,
+                        help="超过该规模时跳过 BM25Okapi（其构建在百万级语料上需数分钟）")
+    args = parser.parse_args()
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        run(size, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+FAISS 索引类型基准：Flat / IVF-Flat / IVF-PQ / HNSW 的召回率与查询延迟
+
+以 Flat 精确检索结果为基准，统计各索引类型的 recall@k、单条查询（与线上一次检索一致）的 p50 / p99 延迟、
+构建（含训练）耗时与估算内存。向量可以来自已有知识库的 faiss_index，也可以合成带聚类结构的数据。
+
+用法（在项目根目录执行）:
+    python benchmarks/bench_faiss_index.py --num 200000 --dim 1024
+    python benchmarks/bench_faiss_index.py --kb my_kb --k 8 --nprobe 32 --ef-search 128
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import yaml
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+
+from core.faiss_index import IndexSpec, INDEX_TYPES, build_index, current_dir, reconstruct_all, index_memory_bytes
+
+
+def synthetic_vectors(num, dim, num_queries, seed=0, clusters=2000):
+    # 带聚类结构的归一化向量，更接近真实嵌入的分布（纯随机高斯向量会让 IVF 显得过差）
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    assign = rng.integers(0, clusters, size=num + num_queries)
+    data = centers[assign] + 0.6 * rng.standard_normal((num + num_queries, dim)).astype(np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    return data[:num], data[num:]
+
+
+def kb_vectors(kb_name, num_queries, seed=0):
+    import faiss
+
+    with open(os.path.join(ROOT, "config.yaml"), "r", encoding="utf-8") as config_file:
+        config = yaml.safe_load(config_file)
+    path = os.path.join(current_dir(os.path.join(config['paths']['kb_dir'], kb_name, "faiss_index")), "index.faiss")
+    vectors = reconstruct_all(faiss.read_index(path))
+    # 查询取库内向量加少量扰动（没有真实查询日志时的近似）
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), size=num_queries, replace=False)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+    return vectors, queries
+
+
+def measure(index, queries, k):
+    latencies = []
+    results = np.zeros((len(queries), k), dtype=np.int64)
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results[i] = ids[0]
+    return results, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+def recall_at_k(results, truth):
+    return float(np.mean([len(set(r) & set(t)) / len(t) for r, t in zip(results, truth)]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--kb', default=None, help="使用该知识库 faiss_index 中的向量；不指定时使用合成数据")
+    parser.add_argument('--num', type=int, default=200000)
+    parser.add_argument('--dim', type=int, default=1024)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--types', default=",".join(INDEX_TYPES))
+    parser.add_argument('--nlist', type=int, default=1024)
+    parser.add_argument('--nprobe', type=int, default=16)
+    parser.add_argument('--pq-m', type=int, default=64)
+    parser.add_argument('--hnsw-m', type=int, default=32)
+    parser.add_argument('--ef-construction', type=int, default=200)
+    parser.add_argument('--ef-search', type=int, default=64)
+    parser.add_argument('--threads', type=int, default=1, help="faiss OpenMP 线程数（线上单条查询通常为 1）")
+    args = parser.parse_args()
+
+    import faiss
+    faiss.omp_set_num_threads(args.threads)
+
+    if args.kb:
+        vectors, queries = kb_vectors(args.kb, args.queries)
+    else:
+        vectors, queries = synthetic_vectors(args.num, args.dim, args.queries)
+    spec = IndexSpec(nlist=args.nlist, nprobe=args.nprobe, pq_m=args.pq_m, hnsw_m=args.hnsw_m,
+                     ef_construction=args.ef_construction, ef_search=args.ef_search, min_vectors=0)
+    print(f"vectors: {len(vectors)} x {vectors.shape[1]}  queries: {len(queries)}  k={args.k}  threads={args.threads}")
+
+    truth = None
+    print(f"{'type':<10}{'build s':>10}{'recall@k':>10}{'p50 ms':>10}{'p99 ms':>10}{'mem MB':>10}")
+    for kind in ["flat"] + [t for t in args.types.split(",") if t != "flat"]:
+        start = time.perf_counter()
+        index = build_index(vectors, kind, spec)
+        build_s = time.perf_counter() - start
+        results, p50, p99 = measure(index, queries, args.k)
+        if truth is None:
+            truth = results
+        print(f"{kind:<10}{build_s:>10.1f}{recall_at_k(results, truth):>10.3f}{p50:>10.2f}{p99:>10.2f}"
+              f"{index_memory_bytes(index) / 1024 / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+入库流水线基准：先全部解析再分批向量化（旧实现） 与 解析 -> 向量化 -> 写索引流水线
+
+文件来自 --dir，或在临时目录中合成 --files 个 Markdown / TXT / HTML 文件（见 bench_parse_pool.py）。
+编码器用固定耗时的随机向量代替，每个分块耗时 1 / --encoder-throughput 秒（在线程中等待，与真实编码器一样不占事件循环），
+"peak MB" 为 tracemalloc 统计的主进程 Python 内存峰值（分块、向量与索引），不含解析子进程。
+
+用法（在项目根目录执行）:
+    python benchmarks/bench_ingest_pipeline.py --files 60 --workers 4
+    python benchmarks/bench_ingest_pipeline.py --dir ./samples --encoder-throughput 200 --dim 1024
+"""
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class _TimedEmbeddings(Embeddings):
+    def __init__(self, dim, throughput):
+        self.dim = dim
+        self.throughput = throughput
+
+    def embed_query(self, text):
+        return np.random.default_rng(abs(hash(text)) % (2 ** 32)).random(self.dim, dtype=np.float32).tolist()
+
+    def embed_documents(self, texts):
+        time.sleep(len(texts) / self.throughput)
+        return [self.embed_query(text) for text in texts]
+
+
+async def sequential(files, embeddings, pool, image_dir, markdown_dir, batch_size):
+    # 旧实现：parse_files 收齐全部分块后，按批 FAISS.afrom_documents 再 merge_from
+    from langchain_community.vectorstores import FAISS
+    from core.kb_manager import parse_files
+
+    documents = await parse_files(files, image_dir, markdown_dir, pool)
+    vectordb = None
+    for i in range(0, len(documents), batch_size):
+        batch_vectordb = await FAISS.afrom_documents(documents[i:i + batch_size], embeddings)
+        if vectordb is None:
+            vectordb = batch_vectordb
+        else:
+            vectordb.merge_from(batch_vectordb)
+    return vectordb
+
+
+async def pipelined(files, embeddings, pool, image_dir, markdown_dir, batch_size, queue_size):
+    from core.kb_manager import parse_file, ordered_parse_jobs
+    from core.ingest_pipeline import IngestPipeline
+
+    pipeline = IngestPipeline(
+        parse=lambda ext, file: parse_file(ext, file, image_dir, markdown_dir, pool),
+        embeddings=embeddings,
+        batch_size=batch_size,
+        queue_size=queue_size,
+        parse_window=pool.max_workers + pool.io_concurrency,
+    )
+    vectordb = await pipeline.run(ordered_parse_jobs(files))
+    return vectordb, pipeline.stats()
+
+
+async def run(mode, files, args, work_dir):
+    from core.parse_pool import ParsePool
+
+    pool = ParsePool(max_workers=args.workers)
+    image_dir = os.path.join(work_dir, f"images_{mode}")
+    markdown_dir = os.path.join(work_dir, f"markdown_{mode}")
+    os.makedirs(image_dir, exist_ok=True)
+    os.makedirs(markdown_dir, exist_ok=True)
+    embeddings = _TimedEmbeddings(args.dim, args.encoder_throughput)
+    stats = None
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        if mode == "sequential":
+            vectordb = await sequential(files, embeddings, pool, image_dir, markdown_dir, args.batch_size)
+        else:
+            vectordb, stats = await pipelined(files, embeddings, pool, image_dir, markdown_dir,
+                                              args.batch_size, args.queue_size)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        pool.shutdown()
+    return elapsed, peak / 1024 / 1024, vectordb.index.ntotal if vectordb is not None else 0, stats
+
+
+def main():
+    from bench_parse_pool import synthetic_files
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', default=None, help="待入库文件所在目录；不指定时合成 Markdown/TXT/HTML 文件")
+    parser.add_argument('--files', type=int, default=60)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--dim', type=int, default=1024)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--queue-size', type=int, default=4)
+    parser.add_argument('--encoder-throughput', type=float, default=2000.0,
+                        help="编码器每秒可编码的分块数")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="docqa_ingest_")
+    try:
+        if args.dir:
+            files = sorted(os.path.join(args.dir, name) for name in os.listdir(args.dir))
+        else:
+            source_dir = os.path.join(work_dir, "source")
+            os.makedirs(source_dir)
+            files = synthetic_files(source_dir, args.files)
+        print(f"files={len(files)} workers={args.workers} cpus={os.cpu_count()} dim={args.dim} "
+              f"encoder={args.encoder_throughput:.0f} chunks/s")
+        print(f"{'mode':<12}{'wall s':>9}{'peak MB':>10}{'chunks':>9}")
+        for mode in ("sequential", "pipeline"):
+            elapsed, peak_mb, chunks, stats = asyncio.run(run(mode, files, args, work_dir))
+            print(f"{mode:<12}{elapsed:>9.2f}{peak_mb:>10.1f}{chunks:>9}")
+            if stats is not None:
+                for stage, counter in stats["stages"].items():
+                    print(f"  {stage:<8}busy {counter['busy_seconds']:>7.2f}s  {counter['chunks_per_second']:>8.1f} chunks/s")
+                print(f"  queue high watermark {stats['queue_high_watermark']}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+知识库打开耗时与常驻内存基准：LangChain index.pkl 整体加载 与 内存映射 + SQLite 分块存储
+
+合成 --chunks 个分块（随机向量 + 中文文本），分别以两种格式保存到临时目录，
+在独立子进程中统计打开耗时、RSS 增量以及打开后首次检索（含读取分块内容）的耗时。
+
+用法（在项目根目录执行）:
+    python benchmarks/bench_kb_load.py --chunks 200000 --dim 1024
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+
+
+class _RandomEmbeddings(Embeddings):
+    def __init__(self, dim):
+        self.dim = dim
+
+    def embed_query(self, text):
+        return np.random.default_rng(abs(hash(text)) % (2 ** 32)).random(self.dim, dtype=np.float32).tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+def _rss_bytes():
+    with open("/proc/self/statm", "r") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def build(path, chunks, dim, docstore_format):
+    import faiss
+    from langchain_core.documents import Document
+    from langchain_community.vectorstores import FAISS
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from core.faiss_index import save_local
+
+    rng = np.random.default_rng(0)
+    index = faiss.IndexFlatL2(dim)
+    for start in range(0, chunks, 50000):
+        index.add(rng.random((min(50000, chunks - start), dim), dtype=np.float32))
+    ids = [f"id{i}" for i in range(chunks)]
+    docstore = InMemoryDocstore({doc_id: Document(page_content=f"第{i}个分块 " + "知识库内容示例 " * 40,
+                                                  metadata={"file_path": f"docs/file{i // 200}.pdf", "source": f"file{i // 200}"})
+                                 for i, doc_id in enumerate(ids)})
+    vectordb = FAISS(_RandomEmbeddings(dim), index, docstore, dict(enumerate(ids)))
+    save_local(vectordb, path, docstore_format=docstore_format)
+
+
+def measure(path, dim, mmap):
+    # 子进程中执行，避免两种格式共享已加载的数据
+    import faiss  # noqa: F401  提前导入，计时只包含打开知识库本身
+    from langchain_community.vectorstores import FAISS  # noqa: F401
+    from langchain_community.docstore.in_memory import InMemoryDocstore  # noqa: F401
+    from core.faiss_index import load_local
+    from core.kb_catalog import KBCatalog
+    import core.docstore  # noqa: F401
+
+    rss_before = _rss_bytes()
+    start = time.perf_counter()
+    vectordb, _ = load_local(path, _RandomEmbeddings(dim), mmap=mmap, migrate=False)
+    KBCatalog.from_vectordb(vectordb)
+    open_s = time.perf_counter() - start
+    rss_open = _rss_bytes() - rss_before
+    start = time.perf_counter()
+    hits = vectordb.similarity_search("示例问题", k=8)
+    search_ms = (time.perf_counter() - start) * 1000
+    print(json.dumps({"open_s": open_s, "rss_mb": rss_open / 1024 / 1024, "search_ms": search_ms, "hits": len(hits)}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=200000)
+    parser.add_argument('--dim', type=int, default=1024)
+    parser.add_argument('--measure', nargs=2, metavar=("PATH", "MMAP"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure[0], args.dim, args.measure[1] == "1")
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="docqa_kb_load_")
+    try:
+        cases = [("pickle", "pickle", "0"), ("sqlite", "sqlite", "0"), ("sqlite+mmap", "sqlite", "1")]
+        print(f"chunks={args.chunks} dim={args.dim}")
+        for docstore_format in ("pickle", "sqlite"):
+            start = time.perf_counter()
+            build(os.path.join(work_dir, docstore_format), args.chunks, args.dim, docstore_format)
+            print(f"saved {docstore_format:<7} in {time.perf_counter() - start:.1f}s")
+        print(f"{'mode':<14}{'open s':>10}{'RSS MB':>10}{'search ms':>12}")
+        for name, docstore_format, mmap in cases:
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--dim', str(args.dim),
+                                     '--measure', os.path.join(work_dir, docstore_format), mmap],
+                                    capture_output=True, text=True, check=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{name:<14}{result['open_s']:>10.2f}{result['rss_mb']:>10.1f}{result['search_ms']:>12.1f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
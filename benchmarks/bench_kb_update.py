@@ -0,0 +1,139 @@
+"""
+文件重新上传（替换）耗时基准：全量重建 与 按 id 删除 + 增量追加
+
+合成 --chunks 个分块（每个文件 --chunks-per-file 个）的知识库，替换其中一个文件：
+- rebuild：旧实现，对其余全部分块调用 FAISS.from_documents 重新向量化，再追加新文件分块
+- replace：现实现，delete_vectors 删除该文件的向量 id，只向量化新文件分块并 merge_vectordb 追加
+
+嵌入模型用计数的随机向量代替，表中 "embedded" 为需要送入编码器的分块数，
+"encoder s" 按 --encoder-throughput（bge-large 每秒可编码的分块数）折算编码器耗时，
+"other s" 为实测的除编码外的耗时（索引增删、目录维护、索引类型转换）。
+
+用法（在项目根目录执行）:
+    python benchmarks/bench_kb_update.py --chunks 50000 --dim 1024
+    python benchmarks/bench_kb_update.py --chunks 50000 --index-type ivf_flat --min-vectors 10000
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+
+
+class _CountingEmbeddings(Embeddings):
+    def __init__(self, dim):
+        self.dim = dim
+        self.embedded = 0
+        self.seconds = 0.0
+
+    def embed_query(self, text):
+        return np.random.default_rng(abs(hash(text)) % (2 ** 32)).random(self.dim, dtype=np.float32).tolist()
+
+    def embed_documents(self, texts):
+        start = time.perf_counter()
+        vectors = [self.embed_query(text) for text in texts]
+        self.embedded += len(texts)
+        self.seconds += time.perf_counter() - start
+        return vectors
+
+
+def build(chunks, chunks_per_file, dim, spec):
+    import faiss
+    from langchain_core.documents import Document
+    from langchain_community.vectorstores import FAISS
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from core.faiss_index import ensure_index
+    from core.kb_catalog import KBCatalog
+
+    rng = np.random.default_rng(0)
+    index = faiss.IndexFlatL2(dim)
+    for start in range(0, chunks, 50000):
+        index.add(rng.random((min(50000, chunks - start), dim), dtype=np.float32))
+    ids = [f"id{i}" for i in range(chunks)]
+    docstore = InMemoryDocstore({doc_id: Document(page_content=f"第{i}个分块 " + "知识库内容示例 " * 40,
+                                                  metadata={"file_path": f"docs/file{i // chunks_per_file}.pdf"})
+                                 for i, doc_id in enumerate(ids)})
+    embeddings = _CountingEmbeddings(dim)
+    vectordb = FAISS(embeddings, index, docstore, dict(enumerate(ids)))
+    ensure_index(vectordb, spec)
+    return vectordb, KBCatalog.from_vectordb(vectordb), embeddings
+
+
+def new_file_documents(file_name, count):
+    from langchain_core.documents import Document
+
+    return [Document(page_content=f"{file_name} 新版本第{i}个分块 " + "更新后的内容 " * 40,
+                     metadata={"file_path": f"docs/{file_name}"}) for i in range(count)]
+
+
+def replace_rebuild(vectordb, catalog, file_name, new_documents, spec):
+    # 旧实现：其余分块全部重新向量化
+    from langchain_community.vectorstores import FAISS
+    from core.faiss_index import ensure_index, merge_vectordb
+    from core.kb_catalog import KBCatalog
+
+    removed = set(catalog.chunk_ids(file_name))
+    remaining = [doc_id for doc_id in vectordb.docstore._dict if doc_id not in removed]
+    vectordb = FAISS.from_documents([vectordb.docstore._dict[doc_id] for doc_id in remaining],
+                                    vectordb.embeddings, ids=remaining)
+    merge_vectordb(vectordb, FAISS.from_documents(new_documents, vectordb.embeddings))
+    KBCatalog.from_vectordb(vectordb)
+    ensure_index(vectordb, spec)
+    return vectordb
+
+
+def replace_in_place(vectordb, catalog, file_name, new_documents, spec):
+    # 现实现：与 KnowledgeBase.update_vectordb 一致
+    from langchain_community.vectorstores import FAISS
+    from core.faiss_index import ensure_index, merge_vectordb, delete_vectors
+
+    removed_ids = catalog.chunk_ids(file_name)
+    removed = set(removed_ids)
+    removed_positions = [pos for pos, doc_id in vectordb.index_to_docstore_id.items() if doc_id in removed]
+    delete_vectors(vectordb, removed_ids, spec)
+    catalog.remove_ids(removed_ids, removed_positions)
+    new_vectordb = FAISS.from_documents(new_documents, vectordb.embeddings)
+    start_pos = len(vectordb.index_to_docstore_id)
+    merge_vectordb(vectordb, new_vectordb)
+    catalog.add((start_pos + pos, doc_id, new_vectordb.docstore._dict[doc_id])
+                for pos, doc_id in sorted(new_vectordb.index_to_docstore_id.items()))
+    ensure_index(vectordb, spec)
+    return vectordb
+
+
+def main():
+    from core.faiss_index import IndexSpec, INDEX_TYPES, index_kind
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=50000)
+    parser.add_argument('--chunks-per-file', type=int, default=200)
+    parser.add_argument('--dim', type=int, default=1024)
+    parser.add_argument('--index-type', default="flat", choices=INDEX_TYPES)
+    parser.add_argument('--min-vectors', type=int, default=10000)
+    parser.add_argument('--nlist', type=int, default=256)
+    parser.add_argument('--encoder-throughput', type=float, default=200.0,
+                        help="编码器每秒可编码的分块数，用于折算编码耗时")
+    args = parser.parse_args()
+
+    spec = IndexSpec(index_type=args.index_type, nlist=args.nlist, min_vectors=args.min_vectors)
+    file_name = "file0.pdf"
+    print(f"chunks={args.chunks} chunks/file={args.chunks_per_file} dim={args.dim} index={args.index_type}")
+    print(f"{'mode':<10}{'embedded':>10}{'encoder s':>11}{'other s':>9}{'total s':>9}{'ntotal':>9}{'index':>10}")
+    for name, replace in (("rebuild", replace_rebuild), ("replace", replace_in_place)):
+        vectordb, catalog, embeddings = build(args.chunks, args.chunks_per_file, args.dim, spec)
+        new_documents = new_file_documents(file_name, args.chunks_per_file)
+        start = time.perf_counter()
+        vectordb = replace(vectordb, catalog, file_name, new_documents, spec)
+        elapsed = time.perf_counter() - start
+        encoder_s = embeddings.embedded / args.encoder_throughput
+        other_s = elapsed - embeddings.seconds
+        print(f"{name:<10}{embeddings.embedded:>10}{encoder_s:>11.1f}{other_s:>9.2f}{encoder_s + other_s:>9.1f}"
+              f"{vectordb.index.ntotal:>9}{index_kind(vectordb.index):>10}")
+
+
+if __name__ == "__main__":
+    main()
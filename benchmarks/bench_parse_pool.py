@@ -0,0 +1,85 @@
+"""
+文档解析并行度基准：按不同解析进程数解析同一批文件，统计耗时与相对单进程的加速比
+
+文件来自 --dir（真实的 PDF/Word/PPT/HTML 等混合上传），或在临时目录中合成 --files 个
+Markdown / TXT / HTML 文件。OCR 与 LlamaParse 依赖外部服务，合成数据中不包含图片与 Excel。
+
+用法（在项目根目录执行）:
+    python benchmarks/bench_parse_pool.py --dir ./samples --workers 1,2,4,8
+    python benchmarks/bench_parse_pool.py --files 100 --workers 1,2,4
+"""
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+
+
+def synthetic_files(directory, count, paragraphs=400):
+    files = []
+    for i in range(count):
+        body = "\n\n".join(f"第{p}段：知识库解析基准测试内容，包含若干中文句子与数字 {i * p}。" * 4 for p in range(paragraphs))
+        kind = ("md", "txt", "html")[i % 3]
+        path = os.path.join(directory, f"doc{i:03d}.{kind}")
+        with open(path, "w", encoding="utf-8") as f:
+            if kind == "md":
+                f.write(f"# 文档 {i}\n\n## 第一节\n\n{body}\n")
+            elif kind == "html":
+                f.write(f"<html><body><h1>文档 {i}</h1>" + "".join(f"<p>{p}</p>" for p in body.split("\n\n")) + "</body></html>")
+            else:
+                f.write(body)
+        files.append(path)
+    return files
+
+
+async def run(files, workers, work_dir):
+    from core.kb_manager import parse_files
+    from core.parse_pool import ParsePool
+
+    pool = ParsePool(max_workers=workers)
+    image_dir = os.path.join(work_dir, f"images_{workers}")
+    markdown_dir = os.path.join(work_dir, f"markdown_{workers}")
+    os.makedirs(image_dir, exist_ok=True)
+    os.makedirs(markdown_dir, exist_ok=True)
+    try:
+        start = time.perf_counter()
+        docs = await parse_files(files, image_dir, markdown_dir, pool)
+        return time.perf_counter() - start, len(docs), pool.stats()
+    finally:
+        pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', default=None, help="待解析文件所在目录；不指定时合成 Markdown/TXT/HTML 文件")
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--workers', default="1,2,4,8")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="docqa_parse_")
+    try:
+        if args.dir:
+            files = sorted(os.path.join(args.dir, name) for name in os.listdir(args.dir))
+        else:
+            source_dir = os.path.join(work_dir, "source")
+            os.makedirs(source_dir)
+            files = synthetic_files(source_dir, args.files)
+        print(f"files={len(files)} cpus={os.cpu_count()}")
+        print(f"{'workers':>8}{'wall s':>10}{'files/s':>10}{'speedup':>9}{'chunks':>9}{'failed':>8}")
+        baseline = None
+        for workers in [int(w) for w in args.workers.split(",")]:
+            elapsed, chunks, stats = asyncio.run(run(files, workers, work_dir))
+            baseline = baseline or elapsed
+            print(f"{workers:>8}{elapsed:>10.2f}{len(files) / elapsed:>10.1f}{baseline / elapsed:>9.2f}"
+                  f"{chunks:>9}{stats['failed']:>8}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
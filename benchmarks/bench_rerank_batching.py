@@ -0,0 +1,127 @@
+"""
+重排动态批处理基准：逐请求直接调用 compute_score 与经 RerankScheduler 合批的吞吐对比
+
+默认使用 --model-dir 指定的 FlagReranker（通常为 config.yaml 中的 reranker_model_dir）；
+未安装 FlagEmbedding 或加 --synthetic 时，使用一个模拟"固定调用开销 + 按最长文本 padding 的矩阵运算"
+的合成模型，便于在没有模型文件的环境中观察批处理效果。
+
+用法（在项目根目录执行）:
+    python benchmarks/bench_rerank_batching.py --clients 1,8,32
+    python benchmarks/bench_rerank_batching.py --synthetic
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')))
+
+from core.rerank_scheduler import RerankScheduler
+
+
+class SyntheticReranker:
+    """
+    合成重排模型：每次调用有固定开销（分词、张量准备、框架调度），计算量与 批大小 x 最长文本长度 成正比；
+    与真实模型一样，同一实例上的并发调用互相排队（推理本身已占满 CPU 线程）
+    """
+
+    def __init__(self, call_overhead_ms=8.0, hidden=128, seed=0):
+        self.call_overhead = call_overhead_ms / 1000.0
+        self.weights = np.random.default_rng(seed).standard_normal((hidden, hidden)).astype(np.float32) / np.sqrt(hidden)
+        self._lock = threading.Lock()
+
+    def compute_score(self, sentence_pairs, normalize=True, batch_size=256, **kwargs):
+        with self._lock:
+            return self._compute(sentence_pairs, normalize, batch_size)
+
+    def _compute(self, sentence_pairs, normalize, batch_size):
+        time.sleep(self.call_overhead)
+        scores = []
+        for start in range(0, len(sentence_pairs), batch_size):
+            chunk = sentence_pairs[start:start + batch_size]
+            max_len = max(len(q) + len(p) for q, p in chunk)
+            x = np.ones((len(chunk) * max(1, max_len // 32), self.weights.shape[0]), dtype=np.float32)
+            for _ in range(4):
+                x = np.tanh(x @ self.weights)
+            logits = x.reshape(len(chunk), -1).mean(axis=1)
+            scores.extend((1 / (1 + np.exp(-logits))).tolist() if normalize else logits.tolist())
+        return scores
+
+
+def make_requests(num_requests, pairs_per_request, seed=0):
+    rng = np.random.default_rng(seed)
+    requests = []
+    for i in range(num_requests):
+        query = "问题" * int(rng.integers(4, 16))
+        requests.append([(query, "文档内容" * int(rng.integers(20, 120))) for _ in range(pairs_per_request)])
+    return requests
+
+
+def run_clients(scorer, requests, clients):
+    latencies = []
+    lock = threading.Lock()
+    cursor = iter(range(len(requests)))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(cursor, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            scorer.compute_score(requests[i], normalize=True)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    lat = np.array(latencies) * 1000
+    return len(requests) / elapsed, np.percentile(lat, 50), np.percentile(lat, 95)
+
+
+def load_model(args):
+    if not args.synthetic:
+        try:
+            from FlagEmbedding import FlagReranker
+            return FlagReranker(args.model_dir, use_fp16=False), "FlagReranker"
+        except Exception as e:
+            print(f"FlagReranker unavailable ({e}); falling back to synthetic model")
+    return SyntheticReranker(), "synthetic"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', default="1,8,32", help="逗号分隔的并发客户端数")
+    parser.add_argument('--requests', type=int, default=128, help="每轮的请求总数")
+    parser.add_argument('--pairs', type=int, default=8, help="每个请求的 (查询, 文档) 对数")
+    parser.add_argument('--max-wait-ms', type=float, default=5)
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--model-dir', default="./model/bge-reranker-large/quietnight/bge-reranker-large")
+    parser.add_argument('--synthetic', action='store_true', help="使用合成模型")
+    args = parser.parse_args()
+
+    model, name = load_model(args)
+    scheduler = RerankScheduler(model, max_wait_ms=args.max_wait_ms, max_batch=args.max_batch, deadline_ms=600000)
+    requests = make_requests(args.requests, args.pairs)
+    print(f"model={name} requests={args.requests} pairs/request={args.pairs} "
+          f"max_wait_ms={args.max_wait_ms} max_batch={args.max_batch}")
+
+    for clients in [int(c) for c in args.clients.split(",") if c.strip()]:
+        direct = run_clients(model, requests, clients)
+        batched = run_clients(scheduler, requests, clients)
+        print(f"\n== {clients} client(s) ==")
+        print(f"direct   : {direct[0]:8.1f} req/s  p50 {direct[1]:7.1f} ms  p95 {direct[2]:7.1f} ms")
+        print(f"batched  : {batched[0]:8.1f} req/s  p50 {batched[1]:7.1f} ms  p95 {batched[2]:7.1f} ms  "
+              f"(x{batched[0] / max(direct[0], 1e-9):.2f})")
+    print(f"\nscheduler stats: {scheduler.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+重排模型延迟基准：PyTorch FlagReranker 与 ONNX（fp32 / int8）后端
+
+模拟一次问答请求的重排负载（1 个查询 x --pairs 个候选段落），统计每个后端的 p50 / p95 延迟。
+
+用法（在项目根目录执行）:
+    python benchmarks/bench_reranker_latency.py --pairs 8 --runs 30
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import numpy as np
+import yaml
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+
+from core.onnx_models import OnnxReranker
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "parity_fixture.json")
+
+
+def make_pairs(num_pairs):
+    with open(FIXTURE, "r", encoding="utf-8") as f:
+        fixture = json.load(f)
+    query = fixture[0]["query"]
+    passages = [passage for item in fixture for passage in item["passages"]]
+    return [(query, passages[i % len(passages)]) for i in range(num_pairs)]
+
+
+def measure(name, model, pairs, runs, warmup=3):
+    for _ in range(warmup):
+        model.compute_score(pairs, normalize=True)
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model.compute_score(pairs, normalize=True)
+        latencies.append((time.perf_counter() - start) * 1000)
+    p50, p95 = np.percentile(latencies, 50), np.percentile(latencies, 95)
+    print(f"{name:<12} p50 {p50:8.1f} ms   p95 {p95:8.1f} ms")
+    return p50
+
+
+def main():
+    with open(os.path.join(ROOT, "config.yaml"), "r", encoding="utf-8") as config_file:
+        config = yaml.safe_load(config_file)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-dir', default=config['paths']['reranker_model_dir'])
+    parser.add_argument('--onnx-dir', default=config['paths'].get('reranker_onnx_dir', './model/onnx/bge-reranker-large'))
+    parser.add_argument('--pairs', type=int, default=8)
+    parser.add_argument('--runs', type=int, default=30)
+    parser.add_argument('--threads', type=int, default=config['settings'].get('onnx_intra_op_threads', 0))
+    parser.add_argument('--skip-torch', action='store_true')
+    args = parser.parse_args()
+
+    pairs = make_pairs(args.pairs)
+    print(f"pairs/request={args.pairs} runs={args.runs} intra_op_threads={args.threads or 'auto'}")
+    results = {}
+    if not args.skip_torch:
+        from FlagEmbedding import FlagReranker
+        results["torch fp32"] = measure("torch fp32", FlagReranker(args.model_dir, use_fp16=False), pairs, args.runs)
+    results["onnx fp32"] = measure("onnx fp32", OnnxReranker(args.model_dir, args.onnx_dir, int8=False,
+                                                             intra_op_threads=args.threads), pairs, args.runs)
+    results["onnx int8"] = measure("onnx int8", OnnxReranker(args.model_dir, args.onnx_dir, int8=True,
+                                                             intra_op_threads=args.threads), pairs, args.runs)
+    if "torch fp32" in results:
+        base = results["torch fp32"]
+        print("speedup vs torch: " + ", ".join(f"{name} x{base / p50:.2f}" for name, p50 in results.items() if name != "torch fp32"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+嵌入模型一致性检查：ONNX（fp32 / int8）与当前 PyTorch 嵌入模型（HuggingFaceBgeEmbeddings）的向量对比
+
+使用 benchmarks/data/parity_fixture.json 中的查询与段落作为语料，统计：
+  - 段落向量（embed_documents）与查询向量（embed_query，含 bge 检索指令）的余弦相似度最小值/平均值；
+  - 每个查询在全部段落上的检索第一名是否一致。
+最小余弦低于 --threshold 或任一查询第一名不一致时以非零状态码退出，便于在切换 embedding_backend 前做检查。
+
+用法（在项目根目录执行）:
+    python benchmarks/check_embedding_parity.py
+    python benchmarks/check_embedding_parity.py --fp32 --threshold 0.9999
+"""
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import yaml
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+
+from core.onnx_models import OnnxEncoder
+from core.model_registry import EncoderEmbeddings, bge_query_instruction
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "parity_fixture.json")
+
+
+def cosine_rows(a, b):
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    return np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+
+
+def main():
+    with open(os.path.join(ROOT, "config.yaml"), "r", encoding="utf-8") as config_file:
+        config = yaml.safe_load(config_file)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-dir', default=config['paths']['model_dir'])
+    parser.add_argument('--onnx-dir', default=config['paths'].get('embedding_onnx_dir', './model/onnx/bge-large-zh-v1.5'))
+    parser.add_argument('--fixture', default=FIXTURE)
+    parser.add_argument('--fp32', action='store_true', help="检查未量化的 fp32 ONNX 模型")
+    parser.add_argument('--threshold', type=float, default=0.99, help="允许的最小余弦相似度（int8 建议 0.99，fp32 建议 0.9999）")
+    args = parser.parse_args()
+
+    from langchain_community.embeddings import HuggingFaceBgeEmbeddings
+
+    with open(args.fixture, "r", encoding="utf-8") as f:
+        fixture = json.load(f)
+    queries = [item["query"] for item in fixture]
+    passages = [passage for item in fixture for passage in item["passages"]]
+
+    normalize = config['settings'].get('normalize_embeddings', True)
+    reference = HuggingFaceBgeEmbeddings(model_name=args.model_dir, model_kwargs={'device': 'cpu'},
+                                         encode_kwargs={'normalize_embeddings': normalize})
+    encoder = OnnxEncoder(args.model_dir, onnx_dir=args.onnx_dir, int8=not args.fp32)
+    candidate = EncoderEmbeddings(encoder, normalize=normalize, query_instruction=bge_query_instruction(args.model_dir))
+    print(f"reference: HuggingFaceBgeEmbeddings({args.model_dir})")
+    print(f"candidate: {encoder.onnx_file}")
+
+    ref_docs = np.asarray(reference.embed_documents(passages))
+    got_docs = np.asarray(candidate.embed_documents(passages))
+    ref_queries = np.asarray([reference.embed_query(q) for q in queries])
+    got_queries = np.asarray([candidate.embed_query(q) for q in queries])
+    doc_cos = cosine_rows(ref_docs, got_docs)
+    query_cos = cosine_rows(ref_queries, got_queries)
+
+    top1_mismatch = 0
+    for i, query in enumerate(queries):
+        ref_top = int(np.argmax(ref_docs @ ref_queries[i]))
+        got_top = int(np.argmax(got_docs @ got_queries[i]))
+        if ref_top != got_top:
+            top1_mismatch += 1
+            print(f"top-1 mismatch: {query}  ref={ref_top}  onnx={got_top}")
+
+    min_cos = float(min(doc_cos.min(), query_cos.min()))
+    print(f"passages: {len(passages)}  queries: {len(queries)}")
+    print(f"passage cosine: min {doc_cos.min():.5f}  mean {doc_cos.mean():.5f}")
+    print(f"query cosine:   min {query_cos.min():.5f}  mean {query_cos.mean():.5f}")
+    print(f"top-1 mismatches: {top1_mismatch}/{len(queries)}")
+    ok = top1_mismatch == 0 and min_cos >= args.threshold
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+重排模型一致性检查：ONNX（fp32 / int8）与 PyTorch FlagReranker 在同一批 (查询, 段落) 对上的得分对比
+
+使用 benchmarks/data/parity_fixture.json 中的查询与候选段落，统计：
+  - 归一化得分的最大/平均绝对误差；
+  - 每个查询内候选排序的 Spearman 相关系数与第一名是否一致。
+任一查询第一名不一致或最大误差超过 --tolerance 时以非零状态码退出，便于在切换后端前做检查。
+
+用法（在项目根目录执行）:
+    python benchmarks/check_reranker_parity.py
+    python benchmarks/check_reranker_parity.py --fp32 --tolerance 0.001
+"""
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import yaml
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+
+from core.onnx_models import OnnxReranker
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "parity_fixture.json")
+
+
+def load_fixture(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def spearman(a, b):
+    ra = np.argsort(np.argsort(a))
+    rb = np.argsort(np.argsort(b))
+    if len(a) < 2:
+        return 1.0
+    return float(np.corrcoef(ra, rb)[0, 1])
+
+
+def main():
+    with open(os.path.join(ROOT, "config.yaml"), "r", encoding="utf-8") as config_file:
+        config = yaml.safe_load(config_file)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-dir', default=config['paths']['reranker_model_dir'])
+    parser.add_argument('--onnx-dir', default=config['paths'].get('reranker_onnx_dir', './model/onnx/bge-reranker-large'))
+    parser.add_argument('--fixture', default=FIXTURE)
+    parser.add_argument('--fp32', action='store_true', help="检查未量化的 fp32 ONNX 模型")
+    parser.add_argument('--tolerance', type=float, default=0.05, help="允许的最大绝对误差（int8 建议 0.05，fp32 建议 0.001）")
+    args = parser.parse_args()
+
+    from FlagEmbedding import FlagReranker
+
+    fixture = load_fixture(args.fixture)
+    reference = FlagReranker(args.model_dir, use_fp16=False)
+    candidate = OnnxReranker(args.model_dir, onnx_dir=args.onnx_dir, int8=not args.fp32)
+    print(f"reference: FlagReranker({args.model_dir})")
+    print(f"candidate: {candidate.onnx_file}")
+
+    errors, correlations, top1_mismatch = [], [], 0
+    for item in fixture:
+        pairs = [(item["query"], passage) for passage in item["passages"]]
+        ref = np.asarray(reference.compute_score(pairs, normalize=True), dtype=np.float64).reshape(-1)
+        got = np.asarray(candidate.compute_score(pairs, normalize=True), dtype=np.float64).reshape(-1)
+        errors.extend(np.abs(ref - got).tolist())
+        correlations.append(spearman(ref, got))
+        if int(np.argmax(ref)) != int(np.argmax(got)):
+            top1_mismatch += 1
+            print(f"top-1 mismatch: {item['query']}  ref={np.round(ref, 4)}  onnx={np.round(got, 4)}")
+
+    max_err = max(errors)
+    print(f"pairs: {len(errors)}  queries: {len(fixture)}")
+    print(f"abs error: max {max_err:.5f}  mean {np.mean(errors):.5f}")
+    print(f"spearman: min {min(correlations):.4f}  mean {np.mean(correlations):.4f}")
+    print(f"top-1 mismatches: {top1_mismatch}/{len(fixture)}")
+    ok = top1_mismatch == 0 and max_err <= args.tolerance
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
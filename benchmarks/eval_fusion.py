@@ -0,0 +1,172 @@
+"""
+检索融合离线评测：原始"拼接 + 去重 + 固定重排 8 个"与"融合 + 自适应重排预算"对比
+
+数据为 JSONL，每行一个查询，记录两路检索的有序结果及分数、交叉编码器对每个候选的得分，
+以及人工标注（或合成）的相关分块：
+    {"query": "q0001", "relevant": ["d12"],
+     "vector": [["d12", -0.41], ...],   # 分数越大越相关（L2 距离取负）
+     "bm25":   [["d3", 7.2], ...],
+     "rerank": {"d12": 0.93, "d3": 0.12, ...}}
+默认使用仓库自带的 benchmarks/data/fusion_eval_sample.jsonl（合成数据，由 --generate 生成）；
+也可以用 --data 指定从线上日志导出的同格式数据。
+
+统计 recall@3（最终返回的 3 个上下文中包含相关分块的比例）、MRR@3 与平均每次查询的重排对数。
+
+用法（在项目根目录执行）:
+    python benchmarks/eval_fusion.py
+    python benchmarks/eval_fusion.py --generate 300   # 重新生成合成样例数据
+"""
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')))
+
+from core.fusion import fuse, rerank_budget, doc_key
+
+DEFAULT_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "fusion_eval_sample.jsonl")
+TOP_N = 3
+
+
+class EvalDoc:
+    """
+    评测用的轻量分块对象（与 LangChain Document 的 page_content / metadata 接口一致）
+    """
+
+    def __init__(self, doc_id):
+        self.doc_id = doc_id
+        self.page_content = f"{doc_id} " + "评测分块内容 " * 10
+        self.metadata = {"file_path": f"{doc_id.split('_')[0]}.pdf"}
+
+
+def generate(num_queries, seed=0, num_docs=2000, vector_k=6, bm25_k=8):
+    """
+    生成合成评测数据：两路检索各自以一定概率把相关分块排在前面，交叉编码器对相关分块打高分，
+    并混入少量"难负例"（与问题字面相近但不相关，重排分也偏高）
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for q in range(num_queries):
+        relevant = f"f{rng.integers(0, num_docs // 10)}_c{rng.integers(0, 10)}"
+        pool = set()
+        while len(pool) < 40:
+            doc = f"f{rng.integers(0, num_docs // 10)}_c{rng.integers(0, 10)}"
+            if doc != relevant:
+                pool.add(doc)
+        pool = sorted(pool)
+        rng.shuffle(pool)
+        hard = set(pool[:3])
+
+        def ranked(k, p_top, p_found, hi, lo):
+            docs = list(rng.choice(pool, size=k, replace=False))
+            r = rng.random()
+            if r < p_top:
+                docs[0] = relevant
+            elif r < p_found:
+                docs[int(rng.integers(1, k))] = relevant
+            scores = sorted(rng.uniform(lo, hi, size=k), reverse=True)
+            # 相关分块排第一时通常领先更多
+            if docs[0] == relevant:
+                scores[0] += (hi - lo) * rng.uniform(0.1, 0.5)
+            return [[d, round(float(s), 4)] for d, s in zip(docs, scores)]
+
+        difficulty = rng.random()
+        vector = ranked(vector_k, 0.75 - 0.4 * difficulty, 0.95 - 0.2 * difficulty, -0.3, -0.9)
+        bm25 = ranked(bm25_k, 0.65 - 0.4 * difficulty, 0.9 - 0.3 * difficulty, 12.0, 1.0)
+        rerank = {}
+        for doc, _ in vector + bm25:
+            if doc == relevant:
+                rerank[doc] = round(float(rng.uniform(0.55, 0.98)), 4)
+            elif doc in hard:
+                rerank[doc] = round(float(rng.uniform(0.35, 0.75)), 4)
+            else:
+                rerank[doc] = round(float(rng.uniform(0.0, 0.4)), 4)
+        rows.append({"query": f"q{q:04d}", "relevant": [relevant], "vector": vector, "bm25": bm25, "rerank": rerank})
+    return rows
+
+
+def to_hits(ranked, docs):
+    return [(docs.setdefault(doc_id, EvalDoc(doc_id)), score) for doc_id, score in ranked]
+
+
+def baseline(row, docs):
+    # 原流程：向量 top4 + BM25 top8 拼接，按分块去重，前 8 个送入重排，取前 3
+    merged = [doc for doc, _ in to_hits(row["vector"][:4], docs) + to_hits(row["bm25"][:8], docs)]
+    unique = {}
+    for doc in merged:
+        unique.setdefault(doc_key(doc), doc)
+    candidates = list(unique.values())[:8]
+    scored = sorted(((doc, row["rerank"][doc.doc_id]) for doc in candidates), key=lambda x: x[1], reverse=True)
+    return [doc.doc_id for doc, _ in scored[:TOP_N]], len(candidates)
+
+
+def fused_pipeline(row, docs, args):
+    hits = {"vector": to_hits(row["vector"][:args.vector_k], docs), "bm25": to_hits(row["bm25"][:args.bm25_k], docs)}
+    fused = fuse(hits, rrf_k=args.rrf_k, alpha=args.alpha)
+    budget, decision = rerank_budget(fused, num_lists=sum(1 for h in hits.values() if h),
+                                     default=args.default, agree=args.agree, widen=args.widen,
+                                     margin=args.margin)
+    reranked = sorted(((cand.doc, row["rerank"][cand.doc.doc_id]) for cand in fused[:budget]),
+                      key=lambda x: x[1], reverse=True)[:TOP_N]
+    # 与 get_top_documents 一致：重排数量不足 3 个时按融合顺序补齐
+    result = [doc.doc_id for doc, _ in reranked]
+    for cand in fused[budget:budget + TOP_N - len(result)]:
+        result.append(cand.doc.doc_id)
+    return result, budget, decision
+
+
+def metrics(results, rows):
+    recall, mrr = [], []
+    for result, row in zip(results, rows):
+        relevant = set(row["relevant"])
+        ranks = [i for i, doc_id in enumerate(result[:TOP_N]) if doc_id in relevant]
+        recall.append(1.0 if ranks else 0.0)
+        mrr.append(1.0 / (ranks[0] + 1) if ranks else 0.0)
+    return np.mean(recall), np.mean(mrr)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', default=DEFAULT_DATA)
+    parser.add_argument('--generate', type=int, default=0, help="重新生成 N 条合成数据写入 --data 后评测")
+    parser.add_argument('--vector-k', type=int, default=6)
+    parser.add_argument('--bm25-k', type=int, default=8)
+    parser.add_argument('--rrf-k', type=int, default=60)
+    parser.add_argument('--alpha', type=float, default=0.5)
+    parser.add_argument('--default', type=int, default=6)
+    parser.add_argument('--agree', type=int, default=1)
+    parser.add_argument('--widen', type=int, default=12)
+    parser.add_argument('--margin', type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.generate:
+        os.makedirs(os.path.dirname(os.path.abspath(args.data)), exist_ok=True)
+        with open(args.data, "w", encoding="utf-8") as f:
+            for row in generate(args.generate):
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    with open(args.data, "r", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+
+    docs = {}
+    base = [baseline(row, docs) for row in rows]
+    fused = [fused_pipeline(row, docs, args) for row in rows]
+
+    base_recall, base_mrr = metrics([r for r, _ in base], rows)
+    fused_recall, fused_mrr = metrics([r for r, _, _ in fused], rows)
+    base_pairs = np.mean([n for _, n in base])
+    fused_pairs = np.mean([n for _, n, _ in fused])
+    decisions = {}
+    for _, _, decision in fused:
+        decisions[decision] = decisions.get(decision, 0) + 1
+
+    print(f"queries: {len(rows)}  data: {args.data}")
+    print(f"baseline : recall@3 {base_recall:.3f}  MRR@3 {base_mrr:.3f}  rerank pairs/query {base_pairs:.2f}")
+    print(f"fusion   : recall@3 {fused_recall:.3f}  MRR@3 {fused_mrr:.3f}  rerank pairs/query {fused_pairs:.2f}  "
+          f"({(1 - fused_pairs / base_pairs) * 100:.1f}% fewer)")
+    print(f"decisions: {decisions}")
+
+
+if __name__ == "__main__":
+    main()
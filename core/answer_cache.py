@@ -0,0 +1,154 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    语义答案缓存
+
+    FAQ 类流量中同一问题的不同问法会各自触发一次完整检索与流式生成。本缓存按
+    (知识库, 知识库版本, 提示词模板/回答模式/模型/temperature 的哈希) 分区，区内以归一化的查询向量做余弦相似度匹配，
+    不低于阈值即命中，回放已生成的答案片段与检索来源。
+    知识库更新后版本号变化，旧答案不会再被命中；update_vectordb / remove_file 后还会
+    调用 invalidate() 立即释放该知识库的条目。整体按 LRU + TTL 淘汰。
+    """
+
+    def __init__(self, max_entries=2048, ttl_seconds=3600, similarity=0.95):
+        """
+        Args:
+            max_entries (int): 所有知识库合计最多缓存的答案数
+            ttl_seconds (float): 答案的有效期（秒）
+            similarity (float): 命中所需的查询向量余弦相似度下限
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.similarity = similarity
+        # entry_id -> (scope, expires, vector, query, deltas, sources)
+        self._entries = OrderedDict()
+        # scope -> {"ids": [entry_id], "matrix": np.ndarray 或 None（条目变化后惰性重建）}
+        self._scopes = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def template_hash(*parts):
+        """
+        提示词模板、回答模式、模型与 temperature 的哈希（任一请求参数不同的答案互不复用）
+        """
+        return hashlib.sha1(json.dumps(parts, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id):
+        # 调用方已持有 self._lock
+        scope = self._entries.pop(entry_id)[0]
+        bucket = self._scopes.get(scope)
+        if bucket is not None:
+            bucket["ids"].remove(entry_id)
+            bucket["matrix"] = None
+            if not bucket["ids"]:
+                del self._scopes[scope]
+
+    def get(self, kb_name, version, template_hash, query_vector):
+        """
+        查找语义相近问题的已缓存答案
+
+        Returns:
+            dict 或 None: {"query", "deltas", "sources", "similarity"}
+        """
+        scope = (kb_name, version, template_hash)
+        vector = self._normalize(query_vector)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._scopes.get(scope)
+            if bucket is not None:
+                # 先淘汰本作用域内已过期的条目，避免过期的最相似条目挡住其他仍有效的命中
+                for entry_id in [entry_id for entry_id in bucket["ids"] if self._entries[entry_id][1] < now]:
+                    self._remove(entry_id)
+                bucket = self._scopes.get(scope)
+            if bucket is None:
+                self.misses += 1
+                return None
+            if bucket["matrix"] is None:
+                bucket["matrix"] = np.stack([self._entries[entry_id][2] for entry_id in bucket["ids"]])
+            sims = bucket["matrix"] @ vector
+            best = int(np.argmax(sims))
+            entry_id = bucket["ids"][best]
+            _, _, _, query, deltas, sources = self._entries[entry_id]
+            if float(sims[best]) < self.similarity:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return {"query": query, "deltas": list(deltas), "sources": list(sources), "similarity": float(sims[best])}
+
+    def put(self, kb_name, version, template_hash, query_vector, query, deltas, sources):
+        """
+        写入一次完整回答
+
+        Args:
+            query (str): 原始问题（诊断用）
+            deltas (list): SSE 片段中 choices[0].delta 的列表，按输出顺序
+            sources (list): 本次回答使用的检索结果 [(Document, score)]
+        """
+        scope = (kb_name, version, template_hash)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (scope, time.monotonic() + self.ttl, self._normalize(query_vector),
+                                       query, list(deltas), list(sources))
+            bucket = self._scopes.setdefault(scope, {"ids": [], "matrix": None})
+            bucket["ids"].append(entry_id)
+            bucket["matrix"] = None
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, kb_name):
+        """
+        丢弃某个知识库的全部缓存答案（知识库内容变化或被删除时调用）
+        """
+        with self._lock:
+            for entry_id in [entry_id for entry_id, entry in self._entries.items() if entry[0][0] == kb_name]:
+                self._remove(entry_id)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "scopes": len(self._scopes),
+            "ttl_seconds": self.ttl,
+            "similarity": self.similarity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def sse_deltas(chunks):
+    """
+    从 SSE 片段中取出 choices[0].delta，相邻的纯文本片段合并为一段，便于回放
+    """
+    deltas = []
+    for chunk in chunks:
+        text = chunk.decode("utf-8") if isinstance(chunk, bytes) else str(chunk)
+        if not text.startswith("data: "):
+            continue
+        try:
+            delta = json.loads(text[len("data: "):].strip())["choices"][0]["delta"]
+        except (ValueError, KeyError, IndexError):
+            continue
+        if deltas and set(delta) == {"content"} and set(deltas[-1]) == {"content"}:
+            deltas[-1] = {"content": (deltas[-1]["content"] or "") + (delta["content"] or "")}
+        else:
+            deltas.append(dict(delta))
+    return deltas
@@ -0,0 +1,204 @@
+"""
+分块向量持久化缓存：(模型指纹, 归一化分块哈希) -> 向量
+
+重建知识库、切换 FAISS 索引类型、重新上传大部分未改动的文档、把同一份手册导入多个知识库时，
+大量分块文本此前已经编码过。入库时先按分块内容查本缓存，只把未命中的分块交给编码器，
+编码结果写回 SQLite（WAL，多进程/多连接可同时读写），服务重启后仍然有效。
+"""
+import os
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger("docqa.embedding")
+
+# SQLite 单条语句的参数个数上限较小（旧版本为 999），IN 查询分批进行
+_QUERY_BATCH = 500
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunk_embeddings (
+    model TEXT NOT NULL,
+    chunk_hash TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (model, chunk_hash)
+) WITHOUT ROWID
+"""
+
+
+def chunk_hash(text):
+    """
+    分块文本的归一化哈希
+
+    bge 等 BERT 类模型的分词器把任意空白（含换行）视为分隔符，连续空白与首尾空白不影响分词结果，
+    因此只折叠空白后再哈希：空白不同的同一段文本共用一条向量，其余任何差异都会得到不同的键。
+    """
+    return hashlib.sha1(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+class ChunkEmbeddingStore:
+    """
+    SQLite 分块向量库（进程内按路径共享一个实例）
+    """
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path, max_entries=2000000):
+        """
+        Args:
+            path (str): SQLite 文件路径
+            max_entries (int): 最多保留的向量条数，超出时按写入时间淘汰最早的一批
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM chunk_embeddings").fetchone()[0]
+        logger.info(f"Chunk embedding cache: {path} ({self._count} entries)")
+
+    @classmethod
+    def shared(cls, path, max_entries=2000000):
+        """
+        按路径获取进程内共享的实例（FAISS 入库与 Excel 索引构建共用一个连接）
+        """
+        key = os.path.normcase(os.path.abspath(path))
+        with cls._shared_lock:
+            store = cls._shared.get(key)
+            if store is None:
+                store = cls._shared[key] = cls(path, max_entries=max_entries)
+            return store
+
+    def get_many(self, model, hashes):
+        """
+        批量读取向量
+
+        Returns:
+            dict: chunk_hash -> np.ndarray(float32)，未命中的键不出现
+        """
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for start in range(0, len(unique), _QUERY_BATCH):
+                batch = unique[start:start + _QUERY_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT chunk_hash, vector FROM chunk_embeddings WHERE model = ? "
+                    f"AND chunk_hash IN ({','.join('?' * len(batch))})", [model, *batch]).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, model, items):
+        """
+        批量写入向量
+
+        Args:
+            items (iterable): (chunk_hash, 向量)
+        """
+        now = time.time()
+        rows = [(model, key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items]
+        if not rows:
+            return
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO chunk_embeddings VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+            self._count += self._conn.total_changes - before
+            if self._count > self.max_entries * 1.2:
+                self._prune()
+
+    def _prune(self):
+        # 调用方已持有 self._lock
+        excess = self._count - self.max_entries
+        # WITHOUT ROWID 表按主键（行值）删除
+        self._conn.execute("DELETE FROM chunk_embeddings WHERE (model, chunk_hash) IN (SELECT model, chunk_hash "
+                           "FROM chunk_embeddings ORDER BY created LIMIT ?)", (excess,))
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM chunk_embeddings").fetchone()[0]
+
+    def stats(self):
+        return {"path": self.path, "entries": self._count, "max_entries": self.max_entries}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ChunkEmbeddingJob:
+    """
+    一次入库任务的分块向量查询：命中的分块直接取缓存，未命中的交给编码器并写回；
+    每个任务单独统计命中率
+    """
+
+    def __init__(self, store, model):
+        """
+        Args:
+            store (ChunkEmbeddingStore): 分块向量库
+            model (str): 模型指纹（见 ModelRegistry.fingerprint），换模型或编码参数后旧向量不会被命中
+        """
+        self.store = store
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+        self.seconds_encoding = 0.0
+
+    def embed(self, texts, encode):
+        """
+        Args:
+            texts (list): 分块文本
+            encode: 编码函数 encode(texts) -> 向量列表，只对未命中的文本调用
+
+        Returns:
+            list: 与 texts 一一对应的向量（list[float]）
+        """
+        keys = [chunk_hash(text) for text in texts]
+        cached = self.store.get_many(self.model, keys)
+        missing = {}
+        for i, key in enumerate(keys):
+            if key not in cached and key not in missing:
+                missing[key] = i
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            start = time.perf_counter()
+            vectors = encode([texts[i] for i in missing.values()])
+            self.seconds_encoding += time.perf_counter() - start
+            encoded = dict(zip(missing.keys(), vectors))
+            self.store.put_many(self.model, encoded.items())
+            cached.update((key, np.asarray(vector, dtype=np.float32)) for key, vector in encoded.items())
+        return [cached[key].tolist() for key in keys]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "chunks": total,
+            "hits": self.hits,
+            "encoded": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "encode_seconds": round(self.seconds_encoding, 2),
+        }
+
+
+class ChunkCachedEmbeddings(Embeddings):
+    """
+    入库用的 LangChain Embeddings：embed_documents 经 ChunkEmbeddingJob 查缓存，embed_query 直接透传
+    """
+
+    def __init__(self, embeddings, job):
+        self.embeddings = embeddings
+        self.job = job
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.job.embed(list(texts), self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
@@ -0,0 +1,226 @@
+"""
+SQLite 分块存储：替代 LangChain FAISS 的 index.pkl（整文件反序列化的 InMemoryDocstore）
+
+faiss_index/docstore.sqlite 中保存分块内容、元数据以及 FAISS 下标到 docstore id 的映射。
+打开知识库时只建立只读连接，分块在检索命中时按需读取（带 LRU），因此加载耗时与分块数基本无关；
+文件以 immutable 只读方式打开，多个工作进程共享操作系统页缓存。
+每次保存都写入 faiss_index 下新的代目录（见 core/faiss_index.save_local），已写出的文件不再修改，
+已打开的连接继续读取旧代的文件，不会读到半写状态。
+"""
+import os
+import json
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+from langchain_core.documents import Document
+from langchain_community.docstore.base import Docstore
+
+logger = logging.getLogger("docqa.kb")
+
+DOCSTORE_FILE = "docstore.sqlite"
+DOCSTORE_FORMAT_VERSION = 1
+
+
+def _readonly_uri(path):
+    # immutable=1：文件写出后不再修改，不需要 SQLite 的文件锁与变更检测
+    return Path(path).resolve().as_uri() + "?mode=ro&immutable=1"
+
+
+class SQLiteDocstore(Docstore):
+    """
+    只读的 SQLite 分块存储，满足 LangChain Docstore 的 search 接口
+
+    写操作（上传/删除文件）前，KnowledgeBase 会把知识库重新加载为可写的内存副本，
+    保存时再由 write_docstore() 整体写出新文件。
+    """
+
+    def __init__(self, path, cache_size=2048):
+        """
+        Args:
+            path (str): docstore.sqlite 路径
+            cache_size (int): 已解码 Document 的 LRU 缓存条数
+        """
+        self.path = path
+        self._conn = sqlite3.connect(_readonly_uri(path), uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._dict = _DocstoreView(self)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _iter_docs(self, columns, batch_size=4096):
+        # 按 seq 分批读取（键集分页），避免一次性把大知识库的全部行读入内存
+        last_seq = 0
+        while True:
+            rows = self._query(f"SELECT seq, {columns} FROM docs WHERE seq > ? ORDER BY seq LIMIT ?",
+                               (last_seq, batch_size))
+            if not rows:
+                return
+            for row in rows:
+                yield row[1:]
+            last_seq = rows[-1][0]
+
+    def search(self, search):
+        doc = self.get(search)
+        return doc if doc is not None else f"ID {search} not found."
+
+    def get(self, doc_id):
+        """
+        按 docstore id 读取分块，不存在时返回 None
+        """
+        with self._lock:
+            doc = self._cache.get(doc_id)
+            if doc is not None:
+                self._cache.move_to_end(doc_id)
+                return doc
+            row = self._conn.execute("SELECT page_content, metadata FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()
+            if row is None:
+                return None
+            doc = Document(page_content=row[0], metadata=json.loads(row[1]))
+            self._cache[doc_id] = doc
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+            return doc
+
+    def doc_ids(self):
+        """
+        全部 docstore id（与原 InMemoryDocstore 的插入顺序一致）
+        """
+        return [row[0] for row in self._query("SELECT doc_id FROM docs ORDER BY seq")]
+
+    def index_to_docstore_id(self):
+        return dict(self._query("SELECT pos, doc_id FROM index_map"))
+
+    def catalog_rows(self):
+        """
+        (FAISS 下标, docstore id, file_path) 三元组，构建元数据目录时无需解码分块内容
+        """
+        return self._query("SELECT m.pos, m.doc_id, d.file_path FROM index_map m JOIN docs d ON d.doc_id = m.doc_id "
+                           "ORDER BY m.pos")
+
+    def documents(self, doc_ids):
+        """
+        按需读取的文档序列（供 BM25 检索器使用，命中时才读取分块内容）
+        """
+        return LazyDocuments(self, doc_ids)
+
+    def __len__(self):
+        return self._query("SELECT COUNT(*) FROM docs")[0][0]
+
+    def memory_bytes(self):
+        # 分块内容留在页缓存中，常驻内存只计算 LRU 中已解码的分块
+        with self._lock:
+            return sum(len(doc.page_content) * 2 for doc in self._cache.values())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _DocstoreView(Mapping):
+    """
+    兼容 vectordb.docstore._dict 的只读映射视图（按插入顺序迭代）
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getitem__(self, doc_id):
+        doc = self._store.get(doc_id)
+        if doc is None:
+            raise KeyError(doc_id)
+        return doc
+
+    def __contains__(self, doc_id):
+        return bool(self._store._query("SELECT 1 FROM docs WHERE doc_id = ?", (doc_id,)))
+
+    def __iter__(self):
+        for row in self._store._iter_docs("doc_id"):
+            yield row[0]
+
+    def __len__(self):
+        return len(self._store)
+
+    def keys(self):
+        return self._store.doc_ids()
+
+    def items(self):
+        for doc_id, content, metadata in self._store._iter_docs("doc_id, page_content, metadata"):
+            yield doc_id, Document(page_content=content, metadata=json.loads(metadata))
+
+    def values(self):
+        for _, doc in self.items():
+            yield doc
+
+
+class LazyDocuments(Sequence):
+    """
+    按 docstore id 顺序按需读取的文档序列
+    """
+
+    # BM25Search 据此保留序列本身而不是复制为列表
+    lazy = True
+
+    def __init__(self, store, doc_ids):
+        self._store = store
+        self._doc_ids = list(doc_ids)
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [self._store.get(doc_id) for doc_id in self._doc_ids[pos]]
+        return self._store.get(self._doc_ids[pos])
+
+    def __len__(self):
+        return len(self._doc_ids)
+
+
+def write_docstore(path, docstore_items, index_to_docstore_id):
+    """
+    写出 docstore.sqlite（先写临时文件再原子替换）
+
+    Args:
+        path (str): 目标文件路径
+        docstore_items (iterable): (docstore id, Document)，按插入顺序
+        index_to_docstore_id (dict): FAISS 下标 -> docstore id
+    """
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("CREATE TABLE docs (seq INTEGER PRIMARY KEY, doc_id TEXT UNIQUE NOT NULL, file_path TEXT, "
+                     "page_content TEXT, metadata TEXT)")
+        conn.execute("CREATE TABLE index_map (pos INTEGER PRIMARY KEY, doc_id TEXT NOT NULL)")
+        conn.executemany("INSERT INTO docs (doc_id, file_path, page_content, metadata) VALUES (?, ?, ?, ?)",
+                         ((doc_id, doc.metadata.get('file_path', ''), doc.page_content,
+                           json.dumps(doc.metadata, ensure_ascii=False, default=str))
+                          for doc_id, doc in docstore_items))
+        conn.executemany("INSERT INTO index_map (pos, doc_id) VALUES (?, ?)",
+                         ((int(pos), doc_id) for pos, doc_id in index_to_docstore_id.items()))
+        conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                         [("format_version", str(DOCSTORE_FORMAT_VERSION)),
+                          ("ntotal", str(len(index_to_docstore_id)))])
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+
+
+def read_meta(path):
+    """
+    读取 docstore.sqlite 的 meta 表（加载时与 FAISS 索引的向量数做一致性校验）
+    """
+    conn = sqlite3.connect(_readonly_uri(path), uri=True)
+    try:
+        return dict(conn.execute("SELECT key, value FROM meta").fetchall())
+    finally:
+        conn.close()
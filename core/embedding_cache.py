@@ -0,0 +1,140 @@
+import os
+import time
+import atexit
+import shelve
+import logging
+import threading
+from collections import OrderedDict
+from typing import List
+from langchain_core.embeddings import Embeddings
+from core.reranker import normalize_query
+
+logger = logging.getLogger("docqa.embedding")
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    查询向量缓存
+
+    包装 get_embeddings() 返回的嵌入模型：embed_query 按归一化后的查询文本做 LRU 缓存，
+    可选写入磁盘 shelve，服务重启后无需重新编码常见问题；embed_documents 直接透传。
+    """
+
+    def __init__(self, embeddings, model_key, max_size=4096, disk_path=None, disk_max_entries=100000):
+        """
+        Args:
+            embeddings: 被包装的 LangChain Embeddings 实例
+            model_key (str): 模型标识（模型路径 + 编码参数），磁盘缓存键的前缀，换模型后旧向量自然失效
+            max_size (int): 内存中缓存的查询数量
+            disk_path (str): shelve 文件路径，为空时不落盘
+            disk_max_entries (int): 磁盘缓存的最大条数，超出时淘汰最早写入的一批
+        """
+        self.embeddings = embeddings
+        self.model_key = model_key
+        self.max_size = max_size
+        self.disk_max_entries = disk_max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._shelf = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+                self._shelf = shelve.open(disk_path)
+                self._prune_disk()
+                atexit.register(self.close)
+                logger.info(f"Query embedding cache on disk: {disk_path} ({len(self._shelf)} entries)")
+            except Exception as e:
+                logger.warning(f"查询向量磁盘缓存不可用，仅使用内存缓存: {e}")
+                self._shelf = None
+
+    def __getattr__(self, name):
+        # 其余属性（model_name、encode_kwargs 等）转发给被包装的模型
+        embeddings = self.__dict__.get("embeddings")
+        if embeddings is None:
+            raise AttributeError(name)
+        return getattr(embeddings, name)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = normalize_query(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(vector)
+            vector = self._disk_get(key)
+            if vector is not None:
+                self.disk_hits += 1
+                self._remember(key, vector)
+                return list(vector)
+            self.misses += 1
+
+        vector = self.embeddings.embed_query(text)
+        with self._lock:
+            self._remember(key, vector)
+            self._disk_put(key, vector)
+        return list(vector)
+
+    def _remember(self, key, vector):
+        self._entries[key] = tuple(vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _disk_key(self, key):
+        return f"{self.model_key}\x00{key}"
+
+    def _disk_get(self, key):
+        if self._shelf is None:
+            return None
+        try:
+            record = self._shelf.get(self._disk_key(key))
+        except Exception:
+            return None
+        return record[1] if record else None
+
+    def _disk_put(self, key, vector):
+        if self._shelf is None:
+            return
+        try:
+            self._shelf[self._disk_key(key)] = (time.time(), list(vector))
+            if len(self._shelf) > self.disk_max_entries * 1.2:
+                self._prune_disk()
+        except Exception as e:
+            logger.warning(f"写入查询向量磁盘缓存失败: {e}")
+
+    def _prune_disk(self):
+        """
+        磁盘缓存超出上限时按写入时间淘汰最早的条数
+        """
+        excess = len(self._shelf) - self.disk_max_entries
+        if excess <= 0:
+            return
+        stamps = sorted((record[0], key) for key, record in self._shelf.items())
+        for _, key in stamps[:excess]:
+            del self._shelf[key]
+        self._shelf.sync()
+
+    def close(self):
+        with self._lock:
+            if self._shelf is not None:
+                self._shelf.close()
+                self._shelf = None
+
+    def stats(self):
+        total = self.hits + self.disk_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / total, 4) if total else 0.0,
+            "disk_entries": len(self._shelf) if self._shelf is not None else None,
+        }
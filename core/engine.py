@@ -1,5 +1,6 @@
 import os
 import json
+import asyncio
 import shutil
 import logging
 import random
@@ -9,19 +10,28 @@ from collections import OrderedDict
 import aiofiles
 import tiktoken
 import yaml
+import numpy as np
 from typing import List
 from dotenv import load_dotenv
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.documents import Document
 from core.kb_manager import KnowledgeBase
-from langchain_community.embeddings import HuggingFaceBgeEmbeddings
 from FlagEmbedding import FlagReranker
 from openai import OpenAI
 from langchain_core.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
+from core.llm_clients import LLMClientPool
 from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
-from core.reranker import DocumentReranker
+from core.reranker import DocumentReranker, RerankScoreCache, normalize_query
+from core.rerank_scheduler import RerankScheduler, RerankDeadlineExceeded
+from core.embedding_cache import CachedEmbeddings
+from core.chunk_embedding_store import ChunkEmbeddingStore
+from core.retrieval_cache import RetrievalCache
+from core.answer_cache import SemanticAnswerCache, sse_deltas
+from core.fusion import doc_key, fuse, rerank_budget
+from core.onnx_models import OnnxReranker, OnnxEncoder
+from core.model_registry import model_registry
 from core.search_bm25 import BM25Search
+from core.kb_pool import KBPool, KBState
 import time
 import random
 from concurrent.futures import ThreadPoolExecutor
@@ -57,6 +67,20 @@ if _api_key:
 if _base_url:
     config["paths"]["openai_api_base"] = _base_url
 
+# LLM 客户端池：按 (模型, temperature, streaming) 复用 ChatOpenAI，共享 httpx 连接池
+llm_clients = LLMClientPool(
+    api_key=config['paths']['openai_api_keys'],
+    base_url=config['paths']['openai_api_base'],
+    model=config['models']['llm_model'],
+    max_connections=config['settings'].get('llm_max_connections', 100),
+    max_keepalive=config['settings'].get('llm_max_keepalive', 20),
+    keepalive_expiry=config['settings'].get('llm_keepalive_expiry', 60),
+    timeout=config['settings'].get('llm_timeout', 120),
+    connect_timeout=config['settings'].get('llm_connect_timeout', 10),
+    http2=config['settings'].get('llm_http2', True),
+    max_clients=config['settings'].get('llm_client_cache_size', 32),
+)
+
 # Configure logging
 logger = logging.getLogger("docqa")
 logger.setLevel(logging.INFO)
@@ -125,7 +149,6 @@ def _render_prompt_safe(prompt, **kwargs):
     except Exception:
         return str(safe)
 
-model_kwargs = {"device": config['settings']['device']}
 encode_kwargs = {
     "batch_size": config['settings']['batch_size'],
     "normalize_embeddings": config['settings']['normalize_embeddings']
@@ -133,60 +156,199 @@ encode_kwargs = {
 _embeddings = None
 _reranker_model = None
 
+def _embedding_model_key():
+    # ONNX / int8 的向量与 PyTorch 略有差异，磁盘缓存按后端区分
+    key = f"{config['paths']['model_dir']}|{encode_kwargs['normalize_embeddings']}"
+    if isinstance(getattr(_embeddings, 'encoder', None), OnnxEncoder):
+        key += "|onnx-int8" if config['settings'].get('onnx_int8', True) else "|onnx"
+    return key
+
 def get_embeddings():
     global _embeddings
     if _embeddings is None:
         logger.info("正在初始化嵌入模型（BGE）...")
-        _embeddings = HuggingFaceBgeEmbeddings(
-            model_name=config['paths']['model_dir'],
-            model_kwargs=model_kwargs,
-            encode_kwargs=encode_kwargs,
+        # 编码器由 model_registry 统一持有，Excel 的 LlamaIndex 索引复用同一份权重
+        _embeddings = model_registry.langchain_embeddings(
+            config['paths']['model_dir'],
+            config['settings'],
+            onnx_dir=config['paths'].get('embedding_onnx_dir'),
         )
+        # 查询向量缓存：重复问题与 /final_response 的二次检索不再重新编码
+        _cache_size = int(config['settings'].get('query_embedding_cache_size', 4096))
+        if _cache_size > 0:
+            _embeddings = CachedEmbeddings(
+                _embeddings,
+                model_key=_embedding_model_key(),
+                max_size=_cache_size,
+                disk_path=config['settings'].get('query_embedding_cache_path') or None,
+                disk_max_entries=int(config['settings'].get('query_embedding_cache_disk_max', 100000)),
+            )
     return _embeddings
 
+# 分块向量缓存：入库时按 (模型指纹, 分块哈希) 复用已编码的向量，路径留空则关闭
+_chunk_cache_path = config['settings'].get('chunk_embedding_cache_path') or None
+chunk_embedding_store = ChunkEmbeddingStore.shared(
+    _chunk_cache_path,
+    max_entries=int(config['settings'].get('chunk_embedding_cache_max', 2000000)),
+) if _chunk_cache_path else None
+
+def _chunk_embedding_fingerprint():
+    if chunk_embedding_store is None:
+        return None
+    return model_registry.fingerprint(
+        config['paths']['model_dir'],
+        config['settings'],
+        onnx_dir=config['paths'].get('embedding_onnx_dir'),
+        normalize=encode_kwargs['normalize_embeddings'],
+    )
+
+def embedding_cache_stats():
+    # 嵌入模型尚未加载或未启用缓存时返回 None
+    return _embeddings.stats() if isinstance(_embeddings, CachedEmbeddings) else None
+
+def _load_reranker_backend():
+    """
+    按 settings.reranker_backend 加载重排模型："torch"（FlagReranker）或 "onnx"（onnxruntime，可选 int8）
+    """
+    settings = config['settings']
+    if settings.get('reranker_backend', 'torch') == 'onnx':
+        try:
+            return OnnxReranker(
+                config['paths']['reranker_model_dir'],
+                onnx_dir=config['paths'].get('reranker_onnx_dir', './model/onnx/bge-reranker-large'),
+                int8=settings.get('onnx_int8', True),
+                intra_op_threads=settings.get('onnx_intra_op_threads', 0),
+            )
+        except Exception as e:
+            logger.exception(f"ONNX 重排模型加载失败，回退到 PyTorch FlagReranker: {e}")
+    return FlagReranker(
+        config['paths']['reranker_model_dir'],
+        use_fp16=settings.get('use_fp16', True),
+    )
+
 def get_reranker_model():
     global _reranker_model
     if _reranker_model is None:
         try:
-            _reranker_model = FlagReranker(
-                config['paths']['reranker_model_dir'],
-                use_fp16=config['settings'].get('use_fp16', True),
-            )
+            _reranker_model = _load_reranker_backend()
+            # 跨请求动态批处理：并发请求的文档对合并为一个按长度排序的批次
+            if config['settings'].get('rerank_batching', True):
+                _reranker_model = RerankScheduler(
+                    _reranker_model,
+                    max_wait_ms=config['settings'].get('rerank_max_wait_ms', 5),
+                    max_batch=config['settings'].get('rerank_max_batch', 64),
+                    deadline_ms=config['settings'].get('rerank_deadline_ms', 0),
+                )
         except Exception as e:
             # Windows 上常见：OSError 1455（页面文件太小/虚拟内存不足）导致模型无法加载
             logger.exception(f"重排模型加载失败，将禁用重排并降级到非重排检索: {e}")
             _reranker_model = False  # sentinel：表示已尝试但失败
     return _reranker_model
 
+def rerank_scheduler_stats():
+    # 仅在重排模型已加载且启用了批处理时返回调度器统计，避免为查看统计而加载模型
+    return _reranker_model.stats() if isinstance(_reranker_model, RerankScheduler) else None
+
+
+async def _load_kb_state(kb_name):
+    """
+    资源池加载器：加载单个知识库的向量库、BM25、元数据目录与重排器句柄
+    """
+    state = KBState(kb_name)
+    kb_dir = os.path.join(config['paths']['kb_dir'], kb_name)
+    os.makedirs(kb_dir, exist_ok=True)
+    state.kb = KnowledgeBase(kb_name, get_embeddings(), chunk_embedding_store=chunk_embedding_store,
+                             embedding_fingerprint=_chunk_embedding_fingerprint())
+    state.kb_vectordb = await state.kb.load_vectordb()
+    if state.kb_vectordb is not None:
+        state.searcher_from_target_doc = await state.kb.load_bm25(state.kb_vectordb)
+        state.catalog = state.kb.catalog
+        state.qa_index = await state.kb.load_qa_index(state.kb_vectordb)
+    else:
+        logger.warning(f"Vector DB not available for knowledge base '{kb_name}'.")
+    _rm = get_reranker_model()
+    state.reranker = DocumentReranker(_rm, cache=rerank_cache, kb_name=kb_name) if _rm else None
+    return state
+
+# 重排得分缓存：所有知识库共用一个 LRU，键中包含知识库名，rerank_cache_size 为 0 时关闭
+_rerank_cache_size = int(config['settings'].get('rerank_cache_size', 20000))
+rerank_cache = RerankScoreCache(_rerank_cache_size) if _rerank_cache_size > 0 else None
 
-class KBState:
-    def __init__(self):
-        # 当前知识库对象（封装加载/更新向量库等）
-        self.kb = None
-        # FAISS 向量库句柄（为空表示尚未构建或加载失败）
-        self.kb_vectordb = None
-        # 当前选中的知识库名称
-        self.current_kb_name = None
-        # 简易对话历史（用于拼接到提示词或检索改写）
-        self.history = []
-        # 未过滤的上下文集合（用于 BM25 检索器构建）
-        self.unfilter_context = []
-        # 基于未过滤上下文的 BM25 检索器
-        self.searcher_from_target_doc = None
-
-kb_state = KBState()
+# 检索结果缓存：流式问答写入，/final_response 读取，避免同一轮对话重复检索与重排
+retrieval_cache = RetrievalCache(
+    ttl_seconds=config['settings'].get('retrieval_cache_ttl', 300),
+    max_entries=config['settings'].get('retrieval_cache_size', 1024),
+)
+
+# 语义答案缓存：同一知识库版本下语义相近的问题直接回放已生成的答案，answer_cache_size 为 0 时关闭
+_answer_cache_size = int(config['settings'].get('answer_cache_size', 2048))
+answer_cache = SemanticAnswerCache(
+    max_entries=_answer_cache_size,
+    ttl_seconds=config['settings'].get('answer_cache_ttl', 3600),
+    similarity=config['settings'].get('answer_cache_similarity', 0.95),
+) if _answer_cache_size > 0 else None
+
+# 多知识库常驻资源池：按 kb_name 解析每个请求的知识库状态
+kb_pool = KBPool(
+    _load_kb_state,
+    memory_budget_mb=config['system'].get('kb_pool_memory_mb', 2048),
+    max_kbs=config['system'].get('kb_pool_max_kbs', 8),
+    # 上传/删除文件或删除知识库后立即丢弃该知识库的缓存答案（版本号变化后它们也不会再被命中）
+    on_change=answer_cache.invalidate if answer_cache is not None else None,
+)
     
-def get_top_documents(query: str, req_id=None):
+def _vector_search_with_scores(vectordb, query, k):
+    """
+    向量检索并返回 [(Document, score)]，score 统一为越大越相关
+    （FAISS 默认 L2 距离越小越相关，内积度量则越大越相关）
+    """
+    hits = vectordb.similarity_search_with_score(query, k=k)
+    sign = 1.0 if 'INNER_PRODUCT' in str(getattr(vectordb, 'distance_strategy', '')).upper() else -1.0
+    return [(doc, sign * float(score)) for doc, score in hits]
+
+def get_cached_top_documents(query: str, req_id=None, state=None):
+    """
+    读取流式问答缓存的检索结果，未命中时执行完整检索并写回缓存
+
+    Args:
+        query (str): 用户问题
+        req_id (str): 产生该结果的问答请求 id（可选）
+        state (KBState): 知识库状态，默认使用最近请求的知识库
+
+    Returns:
+        list: [(Document, score)]
+    """
+    state = state or kb_pool.current()
+    cached = retrieval_cache.get(req_id=req_id, kb_name=state.current_kb_name, query=query, version=state.version)
+    if cached is not None:
+        logger.info(f"[req:{req_id}] retrieval cache hit" if req_id else "retrieval cache hit")
+        return cached
+    top_documents_with_score = get_top_documents(query, req_id=req_id, state=state)
+    retrieval_cache.put(top_documents_with_score, kb_name=state.current_kb_name, query=query, version=state.version)
+    return top_documents_with_score
+
+def get_top_documents(query: str, req_id=None, state=None):
     # 融合检索入口：并行执行向量检索 + BM25，去重后使用重排模型计算相关分，返回 [(Document, score)]
-    # 注意：需要先确保 kb_state.kb_vectordb / searcher_from_target_doc 可用
+    # 注意：需要先确保 state.kb_vectordb / searcher_from_target_doc 可用；未指定 state 时使用最近请求的知识库
+    return _retrieve(query, req_id=req_id, state=state)[0]
+
+def _retrieve(query, req_id=None, state=None):
+    """
+    get_top_documents 的完整结果，供推测检索在改写后复用
+
+    Returns:
+        tuple: ([(Document, score)], 各路检索结果 {路名: [(Document, score)]}, 已算出的重排分 {doc_key: score})；
+               走 LlamaIndex 查询时后两项为 None
+    """
+    state = state or kb_pool.current()
     _pref = f"[req:{req_id}] " if req_id else ""
-    logger.debug(f"{_pref}KB: {kb_state.current_kb_name}")
+    logger.debug(f"{_pref}KB: {state.current_kb_name}")
     
     # 特殊处理：根据配置决定Excel文档的查询策略
-    if kb_state.kb_vectordb and hasattr(kb_state.kb_vectordb, 'docstore'):
-        excel_docs = [doc for doc_id, doc in kb_state.kb_vectordb.docstore._dict.items() 
-                     if doc.metadata.get('file_path', '').endswith(('.xlsx', '.xls', '.xlsm', '.csv'))]
-        total_docs = len(kb_state.kb_vectordb.docstore._dict)
+    catalog = state.catalog
+    if state.kb_vectordb and catalog is not None:
+        excel_count = catalog.excel_chunks
+        total_docs = catalog.total_chunks
         
         # 读取配置中的Excel查询策略
         excel_strategy = config.get('settings', {}).get('excel_query_strategy', 'auto')
@@ -195,20 +357,20 @@ def get_top_documents(query: str, req_id=None):
         use_llamaindex = False
         if excel_strategy == 'llamaindex':
             # 强制使用LlamaIndex（只要有Excel文档）
-            use_llamaindex = len(excel_docs) > 0
+            use_llamaindex = catalog.has_excel
             if use_llamaindex:
-                logger.info(f"{_pref}配置为强制使用LlamaIndex查询（检测到 {len(excel_docs)} 个Excel文档）")
+                logger.info(f"{_pref}配置为强制使用LlamaIndex查询（检测到 {excel_count} 个Excel文档）")
         elif excel_strategy == 'faiss':
             # 强制使用FAISS（常规检索）
             use_llamaindex = False
             logger.info(f"{_pref}配置为使用FAISS查询（常规检索+重排）")
         elif excel_strategy == 'auto':
             # 自动检测：如果所有文档都是Excel，使用LlamaIndex；否则使用FAISS
-            use_llamaindex = (total_docs > 0 and len(excel_docs) == total_docs)
+            use_llamaindex = catalog.all_excel
             if use_llamaindex:
                 logger.info(f"{_pref}自动检测：知识库只包含Excel文档（{total_docs}个），使用LlamaIndex查询引擎（不走重排逻辑）")
             else:
-                logger.info(f"{_pref}自动检测：知识库包含混合文档（Excel: {len(excel_docs)}/{total_docs}），使用FAISS查询（常规检索+重排）")
+                logger.info(f"{_pref}自动检测：知识库包含混合文档（Excel: {excel_count}/{total_docs}），使用FAISS查询（常规检索+重排）")
         
         # 如果决定使用LlamaIndex查询
         if use_llamaindex:
@@ -220,13 +382,13 @@ def get_top_documents(query: str, req_id=None):
                 with open("config.yaml", "r", encoding="utf-8") as config_file:
                     local_cfg = yaml.safe_load(config_file)
                 KB_DIR = local_cfg['paths']['kb_dir']
-                kb_dir = os.path.join(KB_DIR, kb_state.current_kb_name)
+                kb_dir = os.path.join(KB_DIR, state.current_kb_name)
                 
                 # 使用LlamaIndex查询
-                excel_results = query_excel_with_llamaindex(query, kb_state.current_kb_name, kb_dir, req_id=req_id)
+                excel_results = query_excel_with_llamaindex(query, state.current_kb_name, kb_dir, req_id=req_id)
                 if excel_results:
                     logger.info(f"{_pref}LlamaIndex查询成功，返回 {len(excel_results)} 个结果")
-                    return excel_results
+                    return excel_results, None, None
                 else:
                     logger.warning(f"{_pref}LlamaIndex查询未返回结果，回退到常规检索")
             except Exception as e:
@@ -234,116 +396,128 @@ def get_top_documents(query: str, req_id=None):
                 import traceback
                 logger.debug(traceback.format_exc())
     
-    if not kb_state.kb_vectordb or not kb_state.searcher_from_target_doc:
+    if not state.kb_vectordb or not state.searcher_from_target_doc:
         raise ValueError("Knowledge base not loaded.")
 
-    # 调试：检查向量库中的文档数量和内容
-    if kb_state.kb_vectordb and hasattr(kb_state.kb_vectordb, 'docstore'):
-        total_docs = len(kb_state.kb_vectordb.docstore._dict)
-        logger.info(f"{_pref}向量库中共有 {total_docs} 个文档块")
-        # 检查是否有Excel相关的文档
-        excel_docs = [doc for doc_id, doc in kb_state.kb_vectordb.docstore._dict.items() 
-                     if doc.metadata.get('file_path', '').endswith(('.xlsx', '.xls', '.xlsm', '.csv'))]
-        logger.info(f"{_pref}其中Excel相关文档: {len(excel_docs)} 个")
-        if excel_docs:
-            for i, doc in enumerate(excel_docs[:3]):
-                content_preview = doc.page_content[:200] if doc.page_content else "空"
-                logger.info(f"{_pref}Excel文档 {i}: file_path={os.path.basename(doc.metadata.get('file_path', ''))}, "
-                          f"content_len={len(doc.page_content) if doc.page_content else 0}, "
-                          f"preview={content_preview}")
-    
-    # 调试：检查BM25索引中的文档
-    if kb_state.searcher_from_target_doc and hasattr(kb_state.searcher_from_target_doc, 'docs'):
-        bm25_docs_count = len(kb_state.searcher_from_target_doc.docs)
-        logger.info(f"{_pref}BM25索引中共有 {bm25_docs_count} 个文档")
-        excel_bm25 = [doc for doc in kb_state.searcher_from_target_doc.docs 
-                     if doc.metadata.get('file_path', '').endswith(('.xlsx', '.xls', '.xlsm', '.csv'))]
-        logger.info(f"{_pref}BM25中Excel相关文档: {len(excel_bm25)} 个")
-
-    # 适度降低向量检索返回数量，减少后续重排负载
+    # 调试：知识库规模统计（来自元数据目录与 BM25 计数，不扫描 docstore）
+    if catalog is not None:
+        logger.info(f"{_pref}向量库统计: {catalog.summary()}")
+    logger.info(f"{_pref}BM25索引中共有 {len(state.searcher_from_target_doc)} 个文档")
+
+    ranked_lists = _search_hits(query, state, _pref)
+    top_documents_with_scores, scored = _rerank_fused(query, ranked_lists, state, _pref)
+    return top_documents_with_scores, ranked_lists, scored
+
+def _search_hits(query, state, _pref=""):
+    # 两路检索都保留分数，交给融合阶段；实际送入重排的数量由自适应预算决定
     logger.debug(f"{_pref}Performing vector and BM25 search...")
-    # 限制向量检索返回数量，降低后续重排负载
-    retriever = kb_state.kb_vectordb.as_retriever(search_kwargs={"k": 4})
-    # 并行执行向量检索与 BM25 检索以降低总体等待时间
+    settings = config['settings']
+    vector_k = settings.get('fusion_vector_k', 6)
+    bm25_k = settings.get('fusion_bm25_k', 8)
     # 并行执行两路检索，缩短端到端等待时间（BGE 向量检索 + BM25）
     with ThreadPoolExecutor(max_workers=2) as ex:
-        fut_bge = ex.submit(retriever.invoke, query)
+        fut_bge = ex.submit(_vector_search_with_scores, state.kb_vectordb, query, vector_k)
         logger.debug(f"{_pref}BM25 search started")
-        fut_bm25 = ex.submit(kb_state.searcher_from_target_doc.search, query, 0.2)
-        bge_context = fut_bge.result()
-        bm25_context = fut_bm25.result()
+        # BM25 直接在检索阶段做 top-k，避免对全部命中排序
+        fut_bm25 = ex.submit(state.searcher_from_target_doc.search_with_scores, query, 0.2, bm25_k)
+        bge_hits = fut_bge.result()
+        bm25_hits = fut_bm25.result()
     try:
-        logger.info(f"{_pref}retrieval bge={len(bge_context)} bm25={len(bm25_context)}")
+        logger.info(f"{_pref}retrieval bge={len(bge_hits)} bm25={len(bm25_hits)}")
         # 调试：显示检索到的文档内容预览
-        if bge_context:
-            logger.info(f"{_pref}BGE检索到的文档预览: {[os.path.basename(d.metadata.get('file_path', '')) for d in bge_context[:3]]}")
-        if bm25_context:
-            logger.info(f"{_pref}BM25检索到的文档预览: {[os.path.basename(d.metadata.get('file_path', '')) for d in bm25_context[:3]]}")
+        if bge_hits:
+            logger.info(f"{_pref}BGE检索到的文档预览: {[os.path.basename(d.metadata.get('file_path', '')) for d, _ in bge_hits[:3]]}")
+        if bm25_hits:
+            logger.info(f"{_pref}BM25检索到的文档预览: {[os.path.basename(d.metadata.get('file_path', '')) for d, _ in bm25_hits[:3]]}")
     except Exception:
         pass
-    # BM25 已经按得分排序，限制候选数量避免过多文档进入重排
-    # BM25 已按得分排序；控制候选上限，避免过多文档进入重排
-    if len(bm25_context) > 8:
-        bm25_context = bm25_context[:8]
+    return {"vector": bge_hits, "bm25": bm25_hits}
 
-    logger.debug(f"{_pref}Fusing search results...")
-    # 融合两路检索结果；后续去重
-    merged_res = bge_context + bm25_context
+def _rerank_scores(reranker, query, docs, scored):
+    # 已有重排分的分块（推测检索阶段已打分）直接复用，只把其余分块作为一个批次送入重排模型；scored 原地更新
+    missing = [doc for doc in docs if doc_key(doc) not in scored]
+    if missing:
+        for doc, score in zip(missing, reranker.compute_scores(query, missing)):
+            scored[doc_key(doc)] = score
+    return sorted(((doc, scored[doc_key(doc)]) for doc in docs), key=lambda x: x[1], reverse=True)
+
+def _rerank_fused(query, ranked_lists, state, _pref="", scored=None):
+    """
+    融合多路检索结果并重排
+
+    Args:
+        query (str): 重排使用的查询
+        ranked_lists (dict): 路名 -> [(Document, score)]；"vector@speculative" 这类路名按 @ 前的部分取融合权重
+        scored (dict): 已算出的重排分 {doc_key: score}，这些分块不再送入重排模型且总是参与排序
 
-    if len(merged_res) == 0:
+    Returns:
+        tuple: ([(Document, score)], 更新后的 scored)
+    """
+    settings = config['settings']
+    scored = {} if scored is None else scored
+    if not any(ranked_lists.values()):
         logger.info(f"{_pref}retrieval merged=0")
-        return []
-
-    # 基于内容去重，避免重复的文档块
-    # 使用 (file_path, content_hash) 作为唯一标识，这样同一文件的不同chunk都能保留
-    unique_docs_dict = {}
-    for doc in merged_res:
-        file_path = doc.metadata.get('file_path', '')
-        # 使用内容的前100字符作为简单hash（避免对完整内容做hash计算）
-        content_preview = doc.page_content[:100] if doc.page_content else ''
-        unique_key = (file_path, hash(content_preview))
-        # 如果这个key不存在，或者当前文档内容更长（保留更完整的内容）
-        if unique_key not in unique_docs_dict or len(doc.page_content) > len(unique_docs_dict[unique_key].page_content):
-            unique_docs_dict[unique_key] = doc
-    unique_docs = list(unique_docs_dict.values())
+        return [], scored
+
+    logger.debug(f"{_pref}Fusing search results...")
+    # 融合各路检索结果：按分块去重（重叠分块保留更长者），同时保留各路的名次与分数
+    fused = fuse(
+        ranked_lists,
+        weights={name: settings.get(f"fusion_{name.split('@')[0]}_weight", 1.0) for name in ranked_lists},
+        rrf_k=settings.get('fusion_rrf_k', 60),
+        alpha=settings.get('fusion_alpha', 0.5),
+    )
+    unique_docs = [cand.doc for cand in fused]
     try:
         logger.info(f"{_pref}unique_docs={len(unique_docs)}")
     except Exception:
         pass
 
+    # 重排器句柄随知识库常驻；模型加载失败时为 None
+    reranker = state.reranker
+    if reranker is None:
+        # 降级：不做重排，直接返回候选（保留原始顺序/相似度顺序）
+        # 这里给一个较低但非0的分，避免后续严格KB阈值直接判定“未命中”
+        return [(doc, 0.2) for doc in unique_docs[:3] if doc.metadata.get('file_path')], scored
+
     if len(unique_docs) == 1:
         # 单候选仍走重排获取真实分值，避免固定分导致误判相关
-        reranker = DocumentReranker(get_reranker_model())
         candidates = unique_docs[:1]
-        top_documents_with_scores = reranker.rerank_documents(query, candidates, top_n=1)
-        return [(doc, round(score, 2)) for doc, score in top_documents_with_scores if doc.metadata.get('file_path')]
+        try:
+            top_documents_with_scores = _rerank_scores(reranker, query, candidates, scored)
+        except RerankDeadlineExceeded as ex:
+            logger.warning(f"{_pref}重排超时，降级为不重排: {ex}")
+            return [(doc, 0.2) for doc in candidates if doc.metadata.get('file_path')], scored
+        return [(doc, round(score, 2)) for doc, score in top_documents_with_scores if doc.metadata.get('file_path')], scored
 
     logger.debug(f"{_pref}Reranking documents...")
-    # 使用重排模型对候选进行相关性打分，选出 Top-N
-    _rm = get_reranker_model()
-    if _rm is False:
-        # 降级：不做重排，直接返回候选（保留原始顺序/相似度顺序）
-        # 这里给一个较低但非0的分，避免后续严格KB阈值直接判定“未命中”
-        return [(doc, 0.2) for doc in candidates[:3] if doc.metadata.get('file_path')]
-    reranker = DocumentReranker(_rm)
-    # 控制进入重排的最大候选数量
-    candidates = unique_docs[:8]
-    
     # 过滤掉内容太短的文档（少于50字符的文档通常没有实际内容）
     min_content_length = 50
-    filtered_candidates = [doc for doc in candidates if doc.page_content and len(doc.page_content.strip()) >= min_content_length]
-    if len(filtered_candidates) < len(candidates):
-        removed_count = len(candidates) - len(filtered_candidates)
+    eligible = [cand for cand in fused if cand.doc.page_content and len(cand.doc.page_content.strip()) >= min_content_length]
+    if len(eligible) < len(fused):
+        removed_count = len(fused) - len(eligible)
         logger.info(f"{_pref}过滤掉 {removed_count} 个内容过短的文档（少于{min_content_length}字符）")
-        candidates = filtered_candidates
-    
-    if not candidates:
+
+    if not eligible:
         logger.warning(f"{_pref}所有候选文档都被过滤，无法进行重排")
-        return []
+        return [], scored
+
+    # 自适应重排预算：各路第一名一致且明显领先时只重排第一名，各路第一名互不命中时扩大重排范围
+    budget, decision = rerank_budget(
+        eligible,
+        num_lists=sum(1 for hits in ranked_lists.values() if hits),
+        default=settings.get('fusion_rerank_default', 6),
+        agree=settings.get('fusion_rerank_agree', 1),
+        widen=settings.get('fusion_rerank_widen', 12),
+        margin=settings.get('fusion_agree_margin', 0.2),
+    )
+    logger.info(f"{_pref}fusion decision={decision} rerank_budget={budget}/{len(eligible)}")
+    # 预算外但已有重排分的分块不占预算，一并参与排序
+    candidates = [cand.doc for i, cand in enumerate(eligible) if i < budget or doc_key(cand.doc) in scored]
     
     try:
         _cand_names = [os.path.basename(d.metadata.get('file_path', '')) for d in candidates if d.metadata.get('file_path')]
-        logger.info(f"{_pref}candidates={_cand_names} (共{len(candidates)}个)")
+        logger.info(f"{_pref}candidates={_cand_names} (共{len(candidates)}个, 已有重排分 {sum(1 for d in candidates if doc_key(d) in scored)} 个)")
         # 调试：显示候选文档的内容预览
         for i, doc in enumerate(candidates[:3]):
             content_preview = doc.page_content[:200] if doc.page_content else "空"
@@ -353,7 +527,20 @@ def get_top_documents(query: str, req_id=None):
     
     # 调试：显示查询内容
     logger.info(f"{_pref}重排查询: {query}")
-    top_documents_with_scores = reranker.rerank_documents(query, candidates, top_n=3)
+    try:
+        top_documents_with_scores = _rerank_scores(reranker, query, candidates, scored)[:3]
+    except RerankDeadlineExceeded as ex:
+        # 重排队列拥塞：与模型不可用时相同的降级方式
+        logger.warning(f"{_pref}重排超时，降级为不重排: {ex}")
+        return [(doc, 0.2) for doc in candidates[:3] if doc.metadata.get('file_path')], scored
+
+    if len(top_documents_with_scores) < 3 and len(eligible) > len(candidates) and top_documents_with_scores:
+        # 只重排了领先的候选：其余上下文按融合顺序补齐，分数按融合分相对第一名折算（不高于第一名的重排分）
+        lead_score, lead_fused = top_documents_with_scores[0][1], eligible[0].score or 1.0
+        chosen = {doc_key(doc) for doc in candidates}
+        rest = [cand for cand in eligible if doc_key(cand.doc) not in chosen]
+        for cand in rest[:3 - len(top_documents_with_scores)]:
+            top_documents_with_scores.append((cand.doc, lead_score * cand.score / lead_fused))
     
     # 调试：显示重排得分详情
     try:
@@ -369,47 +556,44 @@ def get_top_documents(query: str, req_id=None):
 
     # 返回 (Document, score) 且要求存在 file_path 元数据
     # 注意：这里保留原始得分（不四舍五入），让后续的阈值判断更准确
-    return [(doc, score) for doc, score in top_documents_with_scores if doc.metadata.get('file_path')]
+    return [(doc, score) for doc, score in top_documents_with_scores if doc.metadata.get('file_path')], scored
 
-def run_llm_Knowlege_baes_file_QA(query: str, keep_history: bool = True):
+def _file_list_chain(state):
     # 基于“已上传文件列表”的简单 KB QA（不做分段检索），用于文件级预览与说明
-    openai_api_key = config['paths']['openai_api_keys']
-    openai_api_base = config['paths']['openai_api_base']
-
-    llm = ChatOpenAI(
-        api_key=openai_api_key,
-        base_url=openai_api_base,
-        model=config['models']['llm_model'],
-        temperature=0.2,
-        streaming=True
-    )
+    llm = llm_clients.get(0.2)
     logger.debug(f"LLM model: {config['models']['llm_model']}")
 
     # 将历史拼接到提示词，提供上下文参考
-    history_str = "\n".join([str(item) for item in kb_state.history]) + "\n这是以上我和你的对话记录，请参考\n"
-    # use global kb_state.kb_vectordb; fall back to empty set if not available
-    if getattr(kb_state, 'kb_vectordb', None) is None:
+    history_str = "\n".join([str(item) for item in state.history]) + "\n这是以上我和你的对话记录，请参考\n"
+    # 向量库不可用时使用空的文件列表
+    if getattr(state, 'kb_vectordb', None) is None:
         uploaded_files = set()
     else:
-        uploaded_files = {os.path.basename(doc.metadata.get('file_path', '')) for doc in kb_state.kb_vectordb.docstore._dict.values()}
+        uploaded_files = get_uploaded_files(state)
     prompt_template = "以上是历史信息{history_str}，您是一位大型语言人工智能助手。您将被提供一个用户问题,根据知识库文档列表{uploaded_files},结合问题{query}，撰写一个清晰、简洁且准确的答案。回答："
     prompt = PromptTemplate(template=prompt_template, input_variables=["history_str", "uploaded_files", "query"])
-    rendered_safe = _render_prompt_safe(prompt, history_str=history_str, uploaded_files=uploaded_files, query=query)
-    _log_prompt(rendered_safe)
-    rag_chain = (
+    return (
         {"history_str": lambda x: history_str, "uploaded_files": lambda x: uploaded_files, "query": RunnablePassthrough()}
         | prompt
         | llm
         | StrOutputParser()
-    )
+    ), prompt, history_str, uploaded_files
+
+async def arun_llm_Knowlege_baes_file_QA(query: str, keep_history: bool = True, state=None):
+    """
+    知识库文件列表问答（astream），返回异步生成器
+    """
+    state = state or kb_pool.current()
+    rag_chain, prompt, history_str, uploaded_files = _file_list_chain(state)
+    _log_prompt(_render_prompt_safe(prompt, history_str=history_str, uploaded_files=uploaded_files, query=query))
 
     response_text = ""
-    for chunk in rag_chain.stream(query):
+    async for chunk in rag_chain.astream(query):
         response_text += chunk
         yield chunk
 
     if keep_history:
-        kb_state.history.append({"query": query, "response": response_text})
+        state.history.append({"query": query, "response": response_text})
 
 def find_image_links(documents):
     image_info = []
@@ -423,18 +607,12 @@ def find_image_links(documents):
 #使用 OpenAI API 来生成引导性问题。这个函数将遍历知识库中的每个文档，并生成一个与文档内容相关的引导性问题。
 
 
-def generate_guiding_questions(num_questions_total=3, num_questions_per_doc=2):
+def generate_guiding_questions(num_questions_total=3, num_questions_per_doc=2, state=None):
     # 遍历知识库文档，调用 LLM 生成若干条引导性问题以辅助用户发问
-    llm = ChatOpenAI(
-        api_key=config['paths']['openai_api_keys'],
-        base_url=config['paths']['openai_api_base'],
-        model=config['models']['llm_model'],
-        temperature=0.2,
-        streaming=True
-    )
+    llm = llm_clients.get(0.2)
     logger.debug(f"LLM model: {config['models']['llm_model']}")
-    # global kb_state
-    kb_vectordb = kb_state.kb_vectordb
+    state = state or kb_pool.current()
+    kb_vectordb = state.kb_vectordb
     doc_groups = {}
     for doc_id, doc in kb_vectordb.docstore._dict.items():
         source = doc.metadata.get('source', 'unknown')
@@ -498,13 +676,7 @@ def get_document_snippets(documents, max_length=800):
     return "\n".join(snippets)
 
 def document_question_relevance(question, documents):
-    llm = ChatOpenAI(
-        api_key=config['paths']['openai_api_keys'],
-        base_url=config['paths']['openai_api_base'],
-        model=config['models']['llm_model'],
-        temperature=0,
-        streaming=True
-    )
+    llm = llm_clients.get(0)
     logger.debug(f"LLM model: {config['models']['llm_model']}")
 
     prompt = PromptTemplate(
@@ -526,13 +698,7 @@ def document_question_relevance(question, documents):
 
 def question_generation_from_last_dialogual(last_dialog):
     """根据上一轮对话生成引导性问题"""
-    llm = ChatOpenAI(
-        api_key=config['paths']['openai_api_keys'],
-        base_url=config['paths']['openai_api_base'],
-        model=config['models']['llm_model'],
-        temperature=0,
-        streaming=True
-    )
+    llm = llm_clients.get(0)
     logger.debug(f"LLM model: {config['models']['llm_model']}")
 
     prompt = PromptTemplate(
@@ -557,30 +723,22 @@ def question_generation_from_last_dialogual(last_dialog):
     derived_questions = [question for question in derived_questions_str.strip().split("\n") if question]
     return derived_questions
 
-def run_llm_MulitDocQA(input_query: str, only_chatKBQA: bool, prompt_template_from_user: str, temperature: float, multiple_dialogue: bool, derivation: bool, show_source: bool, req_id=None):
-    # 多文档 KB QA 主流程：
-    # - 支持多轮对话：从 messages 中构造 history_str
-    # - 检索改写：将当前问题改写为适合检索的独立问句
-    # - 分支策略：
-    #   * only_chatKBQA=True 严格依据 KB 回答
-    #   * only_chatKBQA=False 检索优先，低相关时回退自由聊天
-    llm = ChatOpenAI(
-        api_key=config['paths']['openai_api_keys'],
-        base_url=config['paths']['openai_api_base'],
-        model=config['models']['llm_model'],
-        temperature=temperature,
-        streaming=True
-    )
-    _pref = f"[req:{req_id}] " if req_id else ""
-    logger.debug(f"{_pref}LLM model: {config['models']['llm_model']}")
-    # global kb_state
-    logger.debug(f"{_pref}Processing KB QA request")
-    logger.debug(f"{_pref}KB loaded: {kb_state.current_kb_name}")
-    
-    # 处理多轮对话：从 messages 列表中提取问题和历史
+# 直接答案逐段输出的间隔（秒），模拟流式效果
+DIRECT_ANSWER_CHUNK_DELAY = 0.2
+NO_CONTEXT_MESSAGE = '没有检索到与查询相关的上下文信息,对不起,知识库中没有找到可以回答此问题的相关信息。'
+DEFAULT_KB_TEMPLATE = "您是一位大型语言人工智能助手。请严格根据段落内容分点作答用户问题，请极大程度保留段落的格式与内容进行简要回答。如果涉及计算请按步骤进行计算，注意不要杜撰段落没有提及的要点，且不要重复。如果文档中出现代码相关的信息，可以将完整代码返回，如果给出的段落信息与原文无关"
+DEFAULT_CHAT_TEMPLATE = "你是一位友好、专业的中文对话助手。请用清晰、自然的中文直接回答用户问题；在没有提供文档时进行自由对话与创作；如需讲故事或科普，请自行组织内容；保持简洁准确，不要声明无法回答。"
+
+
+def _split_dialogue(input_query, multiple_dialogue):
+    """
+    从 messages 列表中拆出当前问题与历史对话字符串
+
+    Returns:
+        tuple: (query, history_str)
+    """
     if multiple_dialogue and len(input_query) > 1:
         query = input_query[-1].content
-        # 构建历史对话字符串
         history_items = []
         for msg in input_query[:-1]:
             role = getattr(msg, 'role', 'user')
@@ -593,291 +751,349 @@ def run_llm_MulitDocQA(input_query: str, only_chatKBQA: bool, prompt_template_fr
     else:
         query = input_query[-1].content if input_query else ""
         history_str = ""
-    
-    logger.info(f"{_pref}Query: {query[:100]}..." if len(str(query)) > 100 else f"{_pref}Query: {query}")
-    logger.debug(f"{_pref}Message count: {len(input_query)}, Multiple dialogue: {multiple_dialogue}")
-    
-    
-    def generate_prompt(template, input_variables):
-        return PromptTemplate(template=template, input_variables=input_variables)
-    
-    def create_chain(prompt):
-        return prompt | llm | StrOutputParser()
-    
-    if only_chatKBQA:
-        _retrieval_query = query
-        if multiple_dialogue:
-            try:
-                llm_rewrite = ChatOpenAI(
-                    api_key=config['paths']['openai_api_keys'],
-                    base_url=config['paths']['openai_api_base'],
-                    model=config['models']['llm_model'],
-                    temperature=0.2,
-                    streaming=False
-                )
-                rewrite_prompt = PromptTemplate(
-                    template="请根据历史对话将当前问题改写为一个独立、明确的检索查询：\n历史：{history}\n当前问题：{query}\n改写后的检索查询：",
-                    input_variables=["history", "query"]
-                )
-                # 检索改写：在多轮语境下生成更稳健的检索查询
-                _retrieval_query = (rewrite_prompt | llm_rewrite | StrOutputParser()).invoke({"history": history_str, "query": query}).strip()
-            except Exception:
-                _retrieval_query = query
-        top_documents_with_socre = get_top_documents(_retrieval_query, req_id=req_id)
-        top_documents = [doc for doc, score in top_documents_with_socre]
+    return query, history_str
+
+def _rewrite_chain():
+    # 检索改写：在多轮语境下将当前问题改写为独立、明确的检索查询
+    rewrite_prompt = PromptTemplate(
+        template="请根据历史对话将当前问题改写为一个独立、明确的检索查询：\n历史：{history}\n当前问题：{query}\n改写后的检索查询：",
+        input_variables=["history", "query"]
+    )
+    return rewrite_prompt | llm_clients.get(0.2, streaming=False) | StrOutputParser()
+
+def _query_similarity(query_a, query_b):
+    # 两个查询向量的余弦相似度；向量经查询向量缓存，随后检索改写后的查询时不再重复编码
+    if normalize_query(query_a) == normalize_query(query_b):
+        return 1.0
+    embeddings = get_embeddings()
+    a = np.asarray(embeddings.embed_query(query_a), dtype=np.float32)
+    b = np.asarray(embeddings.embed_query(query_b), dtype=np.float32)
+    return float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b) or 1.0))
+
+async def _aretrieve_with_rewrite(query, history_str, req_id=None, state=None):
+    """
+    多轮对话的检索改写与推测检索并行执行
+
+    改写（LLM 往返）进行的同时，以原始问题在线程池中先行检索：
+    - 改写超过 rewrite_deadline_ms 未返回或失败：放弃改写，直接使用推测检索的结果；
+    - 改写后的查询与原始问题的向量余弦相似度不低于 rewrite_reuse_similarity：复用推测结果；
+    - 否则为改写后的查询补做向量 + BM25 检索（查询向量已在相似度计算时写入缓存），与推测检索的候选融合，
+      推测阶段已重排的分块沿用其得分，只把新出现的分块按改写后的查询送入重排。
+
+    Returns:
+        tuple: ([(Document, score)], 实际用于检索的查询)
+    """
+    _pref = f"[req:{req_id}] " if req_id else ""
+    settings = config['settings']
+    rewrite = asyncio.ensure_future(_rewrite_chain().ainvoke({"history": history_str, "query": query}))
+    if not settings.get('rewrite_speculative', True):
         try:
-            _names = [os.path.basename(doc.metadata.get('file_path', '')) for doc, _ in top_documents_with_socre if doc.metadata.get('file_path')]
-            _scores = [score for _, score in top_documents_with_socre]
-            logger.info(f"{_pref}selected_docs={_names} scores={_scores}")
+            retrieval_query = (await rewrite).strip() or query
         except Exception:
-            pass
+            retrieval_query = query
+        return await asyncio.to_thread(get_top_documents, retrieval_query, req_id=req_id, state=state), retrieval_query
 
-        # 阈值：
-        # - rerank_direct_answer_threshold：直接使用文档内 QA 的最低分
-        # - rerank_min_relevance：认为"与文档相关"的最低分（严格 KB 模式）
-        thr = float(config['settings'].get('rerank_direct_answer_threshold', 0.8))
-        thr_any = float(config['settings'].get('rerank_min_relevance', 0.2))
-        score0 = (top_documents_with_socre[0][1] if top_documents_with_socre else 0.0)
-        
-        # 调试：显示得分和阈值
+    speculative = asyncio.ensure_future(asyncio.to_thread(_retrieve, query, req_id=req_id, state=state))
+    deadline = float(settings.get('rewrite_deadline_ms', 1500)) / 1000
+    try:
+        rewritten = (await asyncio.wait_for(rewrite, timeout=deadline)).strip()
+    except asyncio.TimeoutError:
+        logger.info(f"{_pref}rewrite decision=deadline ({deadline:.1f}s)，使用原始问题的检索结果")
+        return (await speculative)[0], query
+    except Exception as e:
+        logger.warning(f"{_pref}检索改写失败，使用原始问题的检索结果: {e}")
+        return (await speculative)[0], query
+    if not rewritten:
+        return (await speculative)[0], query
+
+    similarity = await asyncio.to_thread(_query_similarity, query, rewritten)
+    threshold = float(settings.get('rewrite_reuse_similarity', 0.92))
+    if similarity >= threshold:
+        logger.info(f"{_pref}rewrite decision=reuse similarity={similarity:.3f} rewritten={rewritten[:100]}")
+        return (await speculative)[0], query
+    logger.info(f"{_pref}rewrite decision=requery similarity={similarity:.3f} rewritten={rewritten[:100]}")
+    # 改写后的查询只补做两路检索，与仍在进行的推测检索并行
+    hits = asyncio.ensure_future(asyncio.to_thread(_search_hits, rewritten, state, _pref))
+    try:
+        _, speculative_lists, scored = await speculative
+    except BaseException:
+        hits.add_done_callback(lambda fut: fut.cancelled() or fut.exception())
+        raise
+    ranked_lists = await hits
+    if speculative_lists is None:
+        # 推测检索走了 LlamaIndex 查询，没有可融合的候选
+        return await asyncio.to_thread(get_top_documents, rewritten, req_id=req_id, state=state), rewritten
+    ranked_lists.update({f"{name}@speculative": lst for name, lst in speculative_lists.items()})
+    top_documents_with_scores, _ = await asyncio.to_thread(_rerank_fused, rewritten, ranked_lists, state, _pref, scored)
+    return top_documents_with_scores, rewritten
+
+def _answer_plan(top_documents_with_socre, only_chatKBQA, _pref=""):
+    """
+    根据重排得分决定回答方式
+
+    - direct：第一名是文档内 QA 且得分不低于 rerank_direct_answer_threshold，直接输出答案
+    - no_context：严格 KB 模式下得分低于 rerank_min_relevance
+    - chat：自由聊天模式下得分低于 rerank_min_relevance_chat，回退为纯 LLM 对话
+    - kb：依据检索到的段落由 LLM 作答
+
+    Returns:
+        tuple: (方式, top_documents)
+    """
+    top_documents = [doc for doc, score in top_documents_with_socre]
+    try:
+        _names = [os.path.basename(doc.metadata.get('file_path', '')) for doc, _ in top_documents_with_socre if doc.metadata.get('file_path')]
+        _scores = [score for _, score in top_documents_with_socre]
+        logger.info(f"{_pref}selected_docs={_names} scores={_scores}")
+    except Exception:
+        pass
+
+    # 阈值：
+    # - rerank_direct_answer_threshold：直接使用文档内 QA 的最低分
+    # - rerank_min_relevance：认为"与文档相关"的最低分（严格 KB 模式）
+    # - rerank_min_relevance_chat：自由聊天模式的回退阈值
+    thr = float(config['settings'].get('rerank_direct_answer_threshold', 0.8))
+    thr_any = float(config['settings'].get('rerank_min_relevance', 0.2))
+    thr_any_chat = float(config['settings'].get('rerank_min_relevance_chat', 0.5))
+    score0 = (top_documents_with_socre[0][1] if top_documents_with_socre else 0.0)
+
+    if only_chatKBQA:
         logger.info(f"{_pref}重排得分: {score0:.4f}, 阈值: {thr_any}")
-        
         # 特殊处理：对于Excel文档，如果检索到了但得分较低，可能是重排模型对表格格式理解不好
         # 检查是否所有文档都是Excel文件，如果是，可以适当降低阈值
-        all_excel = all(doc.metadata.get('file_path', '').endswith(('.xlsx', '.xls', '.xlsm', '.csv')) 
-                       for doc in top_documents if doc.metadata.get('file_path'))
+        all_excel = all(doc.metadata.get('file_path', '').endswith(('.xlsx', '.xls', '.xlsm', '.csv'))
+                        for doc in top_documents if doc.metadata.get('file_path'))
         if all_excel and score0 > 0 and score0 < thr_any:
             # Excel文档的重排得分可能偏低，使用更宽松的阈值
             excel_threshold = max(0.01, thr_any * 0.1)  # 降低到原来的10%，但至少0.01
             logger.info(f"{_pref}检测到Excel文档，使用更宽松的阈值: {excel_threshold}")
             if score0 >= excel_threshold:
                 logger.info(f"{_pref}Excel文档得分 {score0:.4f} 通过宽松阈值 {excel_threshold}")
-                # 继续处理，不返回"未检索到"
                 score0 = thr_any  # 临时提升得分，让它通过阈值检查
             else:
                 logger.warning(f"{_pref}Excel文档得分 {score0:.4f} 仍低于宽松阈值 {excel_threshold}")
-        
-        direct = bool(top_documents) and bool(top_documents[0].metadata.get("isQA")) and score0 >= thr
-
-        if direct:
-            answer = "\n".join(top_documents[0].page_content.split('\n')[1:])
-            logger.info(f"{_pref}direct_answer score={round(score0,2)}")
-            if top_documents[0].metadata.get("file_url") and top_documents[0].metadata["file_url"] != '-':
-                str_l = len(answer[:-1])
-                try:
-                    for i in range(str_l // 3):
-                        logger.debug(answer[:-1][i*3:(i+1)*3])
-                        yield stream_type(answer[:-1][i*3:(i+1)*3])
-                        time.sleep(0.2)
-                    yield stream_type(answer[:-1][(i+1)*3:(i+1)*3 + str_l%3])
-                    time.sleep(0.2)
-                    yield stream_type_url(answer[-1], top_documents[0].metadata["file_url"])
-                except:
-                    yield stream_type_url(answer, top_documents[0].metadata["file_url"])
-            else:
-                str_l = len(answer)
-                try:
-                    for i in range(str_l // 3):
-                        logger.debug(answer[i*3:(i+1)*3])
-                        yield stream_type(answer[i*3:(i+1)*3])
-                        time.sleep(0.2)
-                    yield stream_type(answer[(i+1)*3:(i+1)*3 + str_l%3])
-                except:
-                    yield stream_type(answer)
-        else:
-            if score0 < thr_any:
-                # 严格 KB 模式下未命中：提示未检索到相关上下文
-                yield f"data: {json.dumps(create_response_dict(content='没有检索到与查询相关的上下文信息,对不起,知识库中没有找到可以回答此问题的相关信息。', image_list=None, documents=None, sources=None), ensure_ascii=False)}\n\n".encode('utf-8')
-            else:
-                logger.info("文档和问题相关")
-                # 强化上下文控制：防止超长报错 (400)
-                max_total_chars = 12000
-                max_doc_chars = 4000
-                doc_texts = []
-                for doc in top_documents:
-                    content = _truncate_text(doc.page_content, max_doc_chars)
-                    doc_texts.append(f"文件来源: {os.path.basename(doc.metadata.get('file_path', ''))}\n内容: {content}")
-                
-                # 合并并再次限长
-                context_str = _truncate_text("\n\n---\n\n".join(doc_texts), max_total_chars)
-                
-                template = (prompt_template_from_user or "您是一位大型语言人工智能助手。请严格根据段落内容分点作答用户问题，请极大程度保留段落的格式与内容进行简要回答。如果涉及计算请按步骤进行计算，注意不要杜撰段落没有提及的要点，且不要重复。如果文档中出现代码相关的信息，可以将完整代码返回，如果给出的段落信息与原文无关") + \
-                            (f"\n以下是历史对话记录：{{history}},请参考历史对话记录。" if multiple_dialogue else "") + \
-                            "\n以下是相关段落:{top_documents},下面是用户问题：{query} 回答："
-                input_variables = ["query", "top_documents"]
-                if multiple_dialogue:
-                    input_variables.append("history")
-                # 构造带有历史与相关段落的提示词
-                prompt = generate_prompt(template, input_variables)
-                chain = create_chain(prompt)
-                inputs = {"query": query, "top_documents": context_str}
-                if multiple_dialogue:
-                    inputs["history"] = _truncate_text(history_str, 4000)
-                    
-                format_inputs = {k: inputs[k] for k in prompt.input_variables if k in inputs}
-                rendered_safe = _render_prompt_safe(prompt, **format_inputs)
-                _log_prompt(rendered_safe)
-                
-                # 记录核心提示词长度
-                logger.debug(f"[req:{req_id}] 最终发送 Prompt 大致长度: {len(rendered_safe)}")
-                
-                response_text = ""
-                for chunk in chain.stream(inputs):
-                    response_text += chunk
-                    yield stream_type(chunk)
-    else:
-        _retrieval_query = query
-        if multiple_dialogue:
-            try:
-                llm_rewrite = ChatOpenAI(
-                    api_key=config['paths']['openai_api_keys'],
-                    base_url=config['paths']['openai_api_base'],
-                    model=config['models']['llm_model'],
-                    temperature=0.2,
-                    streaming=False
-                )
-                rewrite_prompt = PromptTemplate(
-                    template="请根据历史对话将当前问题改写为一个独立、明确的检索查询：\n历史：{history}\n当前问题：{query}\n改写后的检索查询：",
-                    input_variables=["history", "query"]
-                )
-                # 检索改写：多轮对话下提炼独立问句
-                _retrieval_query = (rewrite_prompt | llm_rewrite | StrOutputParser()).invoke({"history": history_str, "query": query}).strip()
-            except Exception:
-                _retrieval_query = query
-        top_documents_with_socre = get_top_documents(_retrieval_query, req_id=req_id)
-        # 自由聊天模式的回退阈值（可通过 config.settings.rerank_min_relevance_chat 调整）
-        thr_any_chat = float(config['settings'].get('rerank_min_relevance_chat', 0.5))
-        top_documents = [doc for doc, score in top_documents_with_socre]
+
+    if bool(top_documents) and bool(top_documents[0].metadata.get("isQA")) and score0 >= thr:
+        logger.info(f"{_pref}direct_answer score={round(score0,2)}")
+        return "direct", top_documents
+    if only_chatKBQA and score0 < thr_any:
+        return "no_context", top_documents
+    if not only_chatKBQA and score0 < thr_any_chat:
+        logger.debug("No relevant documents found, falling back to only_llm")
+        return "chat", top_documents
+    logger.info("文档和问题相关")
+    return "kb", top_documents
+
+def _direct_answer_chunks(doc):
+    """
+    文档内 QA 的答案切成 3 字一段的 SSE 片段；存在 file_url 时最后一个字符携带链接
+    """
+    answer = "\n".join(doc.page_content.split('\n')[1:])
+    file_url = doc.metadata.get("file_url")
+    file_url = file_url if file_url and file_url != '-' else None
+    body = answer[:-1] if file_url else answer
+    n = len(body) // 3
+    if n == 0:
+        return [stream_type_url(answer, file_url) if file_url else stream_type(answer)]
+    chunks = [stream_type(body[i*3:(i+1)*3]) for i in range(n)] + [stream_type(body[n*3:])]
+    if file_url:
+        chunks.append(stream_type_url(answer[-1], file_url))
+    return chunks
+
+def _qa_fast_path(query, state, _pref=""):
+    """
+    在 QA 问题索引中查找与问题一致的条目（不做向量检索与 BM25）
+
+    归一化后完全一致时直接命中；近似重复只是候选，需由重排模型对 (问题, QA 分块) 打分，
+    不低于 rerank_direct_answer_threshold 才直接作答（会调用重排模型，异步流程中应放到线程池执行）
+
+    Returns:
+        tuple: (QA 分块, 得分) 或 None
+    """
+    if not config['settings'].get('qa_fast_path', True) or getattr(state, 'qa_index', None) is None:
+        return None
+    start = time.perf_counter()
+    hit = state.qa_index.lookup(query)
+    if hit is None:
+        return None
+    entry, kind, similarity = hit
+    doc = Document(page_content=entry["page_content"], metadata=entry["metadata"])
+    score = 1.0
+    if kind == "near":
+        if state.reranker is None:
+            return None
+        try:
+            score = state.reranker.compute_scores(query, [doc])[0]
+        except RerankDeadlineExceeded as ex:
+            logger.warning(f"{_pref}qa_fast_path 重排超时，改走检索: {ex}")
+            return None
         thr = float(config['settings'].get('rerank_direct_answer_threshold', 0.8))
-        thr_any = float(config['settings'].get('rerank_min_relevance', 0.2))
-        score0 = (top_documents_with_socre[0][1] if top_documents_with_socre else 0.0)
-        direct = bool(top_documents) and bool(top_documents[0].metadata.get("isQA")) and score0 >= thr
-
-        if direct:
-            answer = "\n".join(top_documents[0].page_content.split('\n')[1:])
-            logger.info(f"{_pref}direct_answer score={round(score0,2)}")
-            if top_documents[0].metadata.get("file_url") and top_documents[0].metadata["file_url"] != '-':
-                str_l = len(answer[:-1])
-                try:
-                    for i in range(str_l // 3):
-                        logger.debug(answer[:-1][i*3:(i+1)*3])
-                        yield stream_type(answer[:-1][i*3:(i+1)*3])
-                        time.sleep(0.2)
-                    yield stream_type(answer[:-1][(i+1)*3:(i+1)*3 + str_l%3])
-                    time.sleep(0.2)
-                    yield stream_type_url(answer[-1], top_documents[0].metadata["file_url"])
-                except:
-                    yield stream_type_url(answer, top_documents[0].metadata["file_url"])
-            else:
-                str_l = len(answer)
-                try:
-                    for i in range(str_l // 3):
-                        logger.debug(answer[i*3:(i+1)*3])
-                        yield stream_type(answer[i*3:(i+1)*3])
-                        time.sleep(0.2)
-                    yield stream_type(answer[(i+1)*3:(i+1)*3 + str_l%3])
-                except:
-                    yield stream_type(answer)
-        else:
-            if score0 < thr_any_chat:
-                logger.debug("No relevant documents found, falling back to only_llm")
-                for chunk in only_llm(input_query, prompt_template_from_user, temperature, multiple_dialogue):
-                    yield chunk
-            else:
-                logger.info("文档和问题相关")
-                # 强化上下文控制：防止超长报错 (400)
-                max_total_chars = 12000
-                max_doc_chars = 4000
-                doc_texts = []
-                for doc in top_documents:
-                    content = _truncate_text(doc.page_content, max_doc_chars)
-                    doc_texts.append(f"文件来源: {os.path.basename(doc.metadata.get('file_path', ''))}\n内容: {content}")
-                
-                context_str = _truncate_text("\n\n---\n\n".join(doc_texts), max_total_chars)
-                
-                template = (prompt_template_from_user or "您是一位大型语言人工智能助手。请严格根据段落内容分点作答用户问题，请极大程度保留段落的格式与内容进行简要回答。如果涉及计算请按步骤进行计算，注意不要杜撰段落没有提及的要点，且不要重复。如果文档中出现代码相关的信息，可以将完整代码返回，如果给出的段落信息与原文无关") + \
-                            (f"\n以下是历史对话记录：{{history}},请参考历史对话记录。" if multiple_dialogue else "") + \
-                            "\n以下是相关段落:{top_documents},下面是用户问题：{query} 回答："
-                input_variables = ["query", "top_documents"]
-                if multiple_dialogue:
-                    input_variables.append("history")
-                prompt = generate_prompt(template, input_variables)
-                chain = create_chain(prompt)
-                inputs = {"query": query, "top_documents": context_str}
-                if multiple_dialogue:
-                    inputs["history"] = _truncate_text(history_str, 4000)
-                format_inputs = {k: inputs[k] for k in prompt.input_variables if k in inputs}
-                rendered_safe = _render_prompt_safe(prompt, **format_inputs)
-                _log_prompt(rendered_safe)
-                
-                logger.debug(f"[req:{req_id}] 最终发送 Prompt 大致长度: {len(rendered_safe)}")
-                
-                response_text = ""
-                for chunk in chain.stream(inputs):
-                    response_text += chunk
-                    yield stream_type(chunk)
-
-
-def only_llm(input_query: str, prompt_template_from_user: str = "", temperature: float = 0.5, multiple_dialogue: bool = False):
-    # 纯 LLM 对话：不依赖知识库检索；支持多轮，将 messages 转为历史注入提示词
-    llm = ChatOpenAI(
-        api_key=config['paths']['openai_api_keys'],
-        base_url=config['paths']['openai_api_base'],
-        model=config['models']['llm_model'],
-        temperature=temperature,
-        streaming=True
-    )
-    logger.debug(f"LLM model: {config['models']['llm_model']}")
-    
-    # 处理多轮对话：从 messages 列表中提取问题和历史
-    if multiple_dialogue and len(input_query) > 1:
-        query = input_query[-1].content
-        # 构建历史对话字符串
-        history_items = []
-        for msg in input_query[:-1]:
-            role = getattr(msg, 'role', 'user')
-            content = getattr(msg, 'content', '')
-            if role == 'user':
-                history_items.append(f"用户：{content}")
-            elif role == 'assistant':
-                history_items.append(f"AI：{content}")
-        history_str = "\n".join(history_items) + "\n这是以上我和你的对话记录，请参考\n" if history_items else ""
-    else:
-        query = input_query[-1].content if input_query else ""
-        history_str = ""
-#    history_str = history_list_to_str(history)
-    logger.debug(f"Query: {query[:100]}..." if len(str(query)) > 100 else f"Query: {query}")
-    logger.debug(f"Message count: {len(input_query)}, Multiple dialogue: {multiple_dialogue}")
-    
-    
-    def generate_prompt(template, input_variables):
-        return PromptTemplate(template=template, input_variables=input_variables)
-    
-    def create_chain(prompt):
-        return prompt | llm | StrOutputParser()
-    
+        if score < thr:
+            logger.info(f"{_pref}qa_fast_path match=near similarity={similarity:.3f} rerank={score:.3f} < {thr}，改走检索")
+            return None
+    logger.info(f"{_pref}qa_fast_path match={kind} similarity={similarity:.3f} score={score:.3f} "
+                f"question={entry['question'][:50]} lookup_us={(time.perf_counter() - start) * 1e6:.0f}")
+    return doc, score
+
+def _no_context_chunk():
+    return f"data: {json.dumps(create_response_dict(content=NO_CONTEXT_MESSAGE, image_list=None, documents=None, sources=None), ensure_ascii=False)}\n\n".encode('utf-8')
+
+def _kb_answer_chain(llm, query, history_str, top_documents, prompt_template_from_user, multiple_dialogue, req_id=None):
+    """
+    构造基于检索段落作答的链与输入
+
+    Returns:
+        tuple: (chain, inputs)
+    """
+    # 强化上下文控制：防止超长报错 (400)
+    max_total_chars = 12000
+    max_doc_chars = 4000
+    doc_texts = []
+    for doc in top_documents:
+        content = _truncate_text(doc.page_content, max_doc_chars)
+        doc_texts.append(f"文件来源: {os.path.basename(doc.metadata.get('file_path', ''))}\n内容: {content}")
+    # 合并并再次限长
+    context_str = _truncate_text("\n\n---\n\n".join(doc_texts), max_total_chars)
+
+    template = (prompt_template_from_user or DEFAULT_KB_TEMPLATE) + \
+                (f"\n以下是历史对话记录：{{history}},请参考历史对话记录。" if multiple_dialogue else "") + \
+                "\n以下是相关段落:{top_documents},下面是用户问题：{query} 回答："
+    input_variables = ["query", "top_documents"]
+    if multiple_dialogue:
+        input_variables.append("history")
+    # 构造带有历史与相关段落的提示词
+    prompt = PromptTemplate(template=template, input_variables=input_variables)
+    inputs = {"query": query, "top_documents": context_str}
+    if multiple_dialogue:
+        inputs["history"] = _truncate_text(history_str, 4000)
+
+    format_inputs = {k: inputs[k] for k in prompt.input_variables if k in inputs}
+    rendered_safe = _render_prompt_safe(prompt, **format_inputs)
+    _log_prompt(rendered_safe)
+    logger.debug(f"[req:{req_id}] 最终发送 Prompt 大致长度: {len(rendered_safe)}")
+    return prompt | llm | StrOutputParser(), inputs
+
+def _chat_chain(llm, query, history_str, prompt_template_from_user, multiple_dialogue):
     # 通用对话提示词；如用户提供 system 提示，则以用户提示为准
-    template = (prompt_template_from_user or "你是一位友好、专业的中文对话助手。请用清晰、自然的中文直接回答用户问题；在没有提供文档时进行自由对话与创作；如需讲故事或科普，请自行组织内容；保持简洁准确，不要声明无法回答。") + \
+    template = (prompt_template_from_user or DEFAULT_CHAT_TEMPLATE) + \
                     (f"\n以下是历史对话记录：{{history}},请参考历史对话记录。" if multiple_dialogue else "") + \
                     "\n下面是用户问题：{query} 回答："
-                
     input_variables = ["query"]
     if multiple_dialogue:
         input_variables.append("history")
-                
-    prompt = generate_prompt(template, input_variables)
-    chain = create_chain(prompt)
-                
+    prompt = PromptTemplate(template=template, input_variables=input_variables)
     inputs = {"query": query}
     if multiple_dialogue:
         inputs["history"] = _truncate_text(history_str, 4000)
-    
+
     format_inputs = {k: inputs[k] for k in prompt.input_variables if k in inputs}
-    rendered_safe = _render_prompt_safe(prompt, **format_inputs)
-    _log_prompt(rendered_safe)
-    response_text = ""
-    for chunk in chain.stream(inputs):
-        response_text += chunk
+    _log_prompt(_render_prompt_safe(prompt, **format_inputs))
+    return prompt | llm | StrOutputParser(), inputs
+
+def _log_query(_pref, query, input_query, multiple_dialogue, level=logging.INFO):
+    logger.log(level, f"{_pref}Query: {query[:100]}..." if len(str(query)) > 100 else f"{_pref}Query: {query}")
+    logger.debug(f"{_pref}Message count: {len(input_query)}, Multiple dialogue: {multiple_dialogue}")
+
+def _answer_cache_probe(query, history_str, only_chatKBQA, prompt_template_from_user, temperature, state, _pref=""):
+    """
+    查询语义答案缓存（会计算查询向量，异步流程中应放到线程池执行）
+
+    Returns:
+        tuple: (缓存键 或 None（不参与缓存）, 命中的答案 或 None)
+    """
+    # 带历史的多轮问答答案依赖上下文，不参与缓存
+    if answer_cache is None or history_str:
+        return None, None
+    template_hash = answer_cache.template_hash(prompt_template_from_user, only_chatKBQA, config['models']['llm_model'], float(temperature))
+    key = (state.current_kb_name, state.version, template_hash, get_embeddings().embed_query(query))
+    hit = answer_cache.get(*key)
+    if hit is not None:
+        logger.info(f"{_pref}answer cache hit similarity={hit['similarity']:.3f} cached_query={hit['query'][:50]}")
+    return key, hit
+
+def _replay_answer(hit, query, req_id, state):
+    # 命中缓存：检索来源写回检索结果缓存供 /final_response 使用，答案按 stream_type 相同的格式重新编码
+    retrieval_cache.put(hit["sources"], req_id=req_id, kb_name=state.current_kb_name, query=query, version=state.version)
+    return [f"data: {json.dumps(create_response_dict(**delta), ensure_ascii=False)}\n\n".encode('utf-8') for delta in hit["deltas"]]
+
+async def _aanswer_stream(action, top_documents, llm, input_query, query, history_str, prompt_template_from_user, temperature, multiple_dialogue, req_id=None):
+    # 按 _answer_plan 的决定输出回答
+    if action == "direct":
+        for i, chunk in enumerate(_direct_answer_chunks(top_documents[0])):
+            if i:
+                await asyncio.sleep(DIRECT_ANSWER_CHUNK_DELAY)
+            yield chunk
+    elif action == "no_context":
+        yield _no_context_chunk()
+    elif action == "chat":
+        async for chunk in aonly_llm(input_query, prompt_template_from_user, temperature, multiple_dialogue):
+            yield chunk
+    else:
+        chain, inputs = _kb_answer_chain(llm, query, history_str, top_documents, prompt_template_from_user, multiple_dialogue, req_id)
+        async for chunk in chain.astream(inputs):
+            yield stream_type(chunk)
+
+async def arun_llm_MulitDocQA(input_query: str, only_chatKBQA: bool, prompt_template_from_user: str, temperature: float, multiple_dialogue: bool, derivation: bool, show_source: bool, req_id=None, state=None):
+    """
+    多文档 KB QA 主流程，返回异步生成器
+
+    - 支持多轮对话：从 messages 中构造 history_str，检索改写与原始问题的推测检索并行
+    - 分支策略：only_chatKBQA=True 严格依据 KB 回答；False 时检索优先，低相关时回退自由聊天
+
+    LLM 调用使用 ainvoke / astream，不占用事件循环；检索、BM25 与重排等 CPU 阶段
+    通过 asyncio.to_thread 在线程池中执行，单个 worker 可同时维持大量 SSE 流。
+    客户端断开时生成器被关闭，进行中的 LLM 流随之取消。
+    """
+    llm = llm_clients.get(temperature)
+    _pref = f"[req:{req_id}] " if req_id else ""
+    logger.debug(f"{_pref}LLM model: {config['models']['llm_model']}")
+    state = state or kb_pool.current()
+    logger.debug(f"{_pref}KB loaded: {state.current_kb_name}")
+    query, history_str = _split_dialogue(input_query, multiple_dialogue)
+    _log_query(_pref, query, input_query, multiple_dialogue)
+
+    qa_hit = await asyncio.to_thread(_qa_fast_path, query, state, _pref)
+    if qa_hit is not None:
+        qa_doc = qa_hit[0]
+        retrieval_cache.put([qa_hit], req_id=req_id, kb_name=state.current_kb_name, query=query, version=state.version)
+        for i, chunk in enumerate(_direct_answer_chunks(qa_doc)):
+            if i:
+                await asyncio.sleep(DIRECT_ANSWER_CHUNK_DELAY)
+            yield chunk
+        return
+
+    cache_key, hit = await asyncio.to_thread(_answer_cache_probe, query, history_str, only_chatKBQA, prompt_template_from_user, temperature, state, _pref)
+    if hit is not None:
+        for chunk in _replay_answer(hit, query, req_id, state):
+            yield chunk
+        return
+
+    if multiple_dialogue:
+        # 检索改写与原始问题的推测检索并行，改写慢或改写前后语义接近时不增加首字延迟
+        top_documents_with_socre, _ = await _aretrieve_with_rewrite(query, history_str, req_id=req_id, state=state)
+    else:
+        top_documents_with_socre = await asyncio.to_thread(get_top_documents, query, req_id=req_id, state=state)
+    retrieval_cache.put(top_documents_with_socre, req_id=req_id, kb_name=state.current_kb_name, query=query, version=state.version)
+
+    action, top_documents = _answer_plan(top_documents_with_socre, only_chatKBQA, _pref)
+    chunks = []
+    async for chunk in _aanswer_stream(action, top_documents, llm, input_query, query, history_str, prompt_template_from_user, temperature, multiple_dialogue, req_id):
+        chunks.append(chunk)
+        yield chunk
+    # 只缓存有知识库依据的回答：自由聊天回退与"无相关内容"的结果不应在相似问题上回放
+    if cache_key is not None and action in ("kb", "direct"):
+        answer_cache.put(*cache_key, query, sse_deltas(chunks), top_documents_with_socre)
+
+
+async def aonly_llm(input_query: str, prompt_template_from_user: str = "", temperature: float = 0.5, multiple_dialogue: bool = False):
+    """
+    纯 LLM 对话（astream），不依赖知识库检索；支持多轮，将 messages 转为历史注入提示词，返回异步生成器
+    """
+    llm = llm_clients.get(temperature)
+    logger.debug(f"LLM model: {config['models']['llm_model']}")
+    query, history_str = _split_dialogue(input_query, multiple_dialogue)
+    _log_query("", query, input_query, multiple_dialogue, level=logging.DEBUG)
+    chain, inputs = _chat_chain(llm, query, history_str, prompt_template_from_user, multiple_dialogue)
+    async for chunk in chain.astream(inputs):
         yield stream_type(chunk)
 
 def view_history(history):
@@ -891,11 +1107,14 @@ def view_history(history):
         total_tokens += len(enc.encode(query)) + len(enc.encode(response))
     return history_str, total_tokens
 
-def get_uploaded_files():
-    # Use kb_state.kb_vectordb (global state) instead of undefined kb_vectordb
-    if getattr(kb_state, 'kb_vectordb', None) is None:
+def get_uploaded_files(state=None):
+    # 优先使用知识库元数据目录；未指定 state 时使用最近请求的知识库
+    state = state or kb_pool.current()
+    if getattr(state, 'kb_vectordb', None) is None:
         return set()
-    return {os.path.basename(doc.metadata.get('file_path', '')) for doc in kb_state.kb_vectordb.docstore._dict.values()}
+    if state.catalog is not None:
+        return state.catalog.file_names()
+    return {os.path.basename(doc.metadata.get('file_path', '')) for doc in state.kb_vectordb.docstore._dict.values()}
 
 def stream_type(data, model=config['models']['llm_model']):
     # SSE 输出格式：兼容前端增量渲染（choices[0].delta.content）
@@ -0,0 +1,476 @@
+"""
+FAISS 索引类型管理：Flat / IVF-Flat / IVF-PQ / HNSW
+
+LangChain 的 FAISS.from_documents 总是生成 IndexFlatL2，查询耗时随分块数线性增长。
+这里在保存向量库前按知识库配置把 Flat 索引转换为目标类型（IVF 系列在样本上训练），
+并把构建参数写入 index_params.json；加载时按配置设置 nprobe / efSearch。
+转换与增删都保持 FAISS 下标与 index_to_docstore_id、KBCatalog 的下标一致（按原顺序写入，删除后前移）。
+load_local / save_local 负责 faiss_index 目录的读写（内存映射加载 + SQLite 分块存储，见 core/docstore.py）。
+与 bm25_index 相同，每次保存写入新的代目录并更新 CURRENT 指针，不覆盖正被映射或打开的旧文件；
+没有 CURRENT 的旧知识库直接读取 faiss_index 目录下的文件。
+"""
+import os
+import json
+import time
+import shutil
+import sqlite3
+import logging
+import numpy as np
+
+logger = logging.getLogger("docqa.faiss")
+
+PARAMS_FILE = "index_params.json"
+CURRENT_FILE = "CURRENT"
+# 旧版直接保存在 faiss_index 目录下的文件，迁移到代目录后尽力删除
+_LEGACY_FILES = ("index.faiss", "index.pkl", "docstore.sqlite", PARAMS_FILE)
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+
+class IndexSpec:
+    """
+    知识库的 FAISS 索引配置
+
+    默认值来自 config.yaml 的 settings.faiss_*，settings.faiss_index_per_kb 可按知识库覆盖。
+    """
+
+    def __init__(self, index_type="flat", nlist=1024, nprobe=16, pq_m=64, pq_nbits=8,
+                 hnsw_m=32, ef_construction=200, ef_search=64, train_size=100000, min_vectors=10000):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"不支持的 FAISS 索引类型: {index_type}，可选 {INDEX_TYPES}")
+        self.index_type = index_type
+        self.nlist = int(nlist)
+        self.nprobe = int(nprobe)
+        self.pq_m = int(pq_m)
+        self.pq_nbits = int(pq_nbits)
+        self.hnsw_m = int(hnsw_m)
+        self.ef_construction = int(ef_construction)
+        self.ef_search = int(ef_search)
+        self.train_size = int(train_size)
+        self.min_vectors = int(min_vectors)
+
+    @classmethod
+    def from_settings(cls, settings, kb_name=None):
+        """
+        Args:
+            settings (dict): config.yaml 中的 settings
+            kb_name (str): 知识库名称，用于查找 faiss_index_per_kb 中的覆盖项
+
+        Returns:
+            IndexSpec
+        """
+        merged = dict(settings)
+        merged.update((settings.get('faiss_index_per_kb') or {}).get(kb_name, {}) if kb_name else {})
+        return cls(
+            index_type=merged.get('faiss_index_type', 'flat'),
+            nlist=merged.get('faiss_nlist', 1024),
+            nprobe=merged.get('faiss_nprobe', 16),
+            pq_m=merged.get('faiss_pq_m', 64),
+            pq_nbits=merged.get('faiss_pq_nbits', 8),
+            hnsw_m=merged.get('faiss_hnsw_m', 32),
+            ef_construction=merged.get('faiss_ef_construction', 200),
+            ef_search=merged.get('faiss_ef_search', 64),
+            train_size=merged.get('faiss_train_size', 100000),
+            min_vectors=merged.get('faiss_min_vectors', 10000),
+        )
+
+    def effective_type(self, ntotal):
+        # 分块数较少时近似索引没有收益（IVF 也训练不出有效的聚类中心），保持 Flat
+        return self.index_type if ntotal >= self.min_vectors else "flat"
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+def index_kind(index):
+    """
+    判断 FAISS 索引类型
+
+    Returns:
+        str: "flat" / "ivf_flat" / "ivf_pq" / "hnsw"
+    """
+    import faiss
+
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def _pq_m(dim, m):
+    # PQ 子空间数必须整除向量维度，取不超过 m 的最大约数
+    m = max(1, min(m, dim))
+    while dim % m:
+        m -= 1
+    return m
+
+
+def create_index(dim, kind, spec, ntotal):
+    """
+    创建（未训练的）目标索引，度量与 LangChain FAISS 默认一致（L2）
+    """
+    import faiss
+
+    if kind == "flat":
+        return faiss.IndexFlatL2(dim)
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, spec.hnsw_m)
+        index.hnsw.efConstruction = spec.ef_construction
+        return index
+    # 每个聚类中心至少需要约 39 个训练样本
+    nlist = max(1, min(spec.nlist, ntotal // 39))
+    quantizer = faiss.IndexFlatL2(dim)
+    if kind == "ivf_pq":
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_m(dim, spec.pq_m), spec.pq_nbits)
+    return faiss.IndexIVFFlat(quantizer, dim, nlist)
+
+
+def apply_search_params(index, spec):
+    """
+    设置查询参数（nprobe / efSearch），不需要重建索引即可调整召回与延迟的权衡
+    """
+    import faiss
+
+    kind = index_kind(index)
+    if kind in ("ivf_flat", "ivf_pq"):
+        ivf = faiss.extract_index_ivf(index)
+        ivf.nprobe = max(1, min(spec.nprobe, ivf.nlist))
+    elif kind == "hnsw":
+        index.hnsw.efSearch = spec.ef_search
+
+
+def reconstruct_all(index):
+    """
+    取出索引中的全部向量（按 FAISS 下标顺序）；IVF-PQ 为有损重建
+    """
+    import faiss
+
+    kind = index_kind(index)
+    if kind in ("ivf_flat", "ivf_pq"):
+        if kind == "ivf_pq":
+            logger.warning("从 IVF-PQ 索引重建向量是有损的，建议重新向量化以获得精确向量")
+        faiss.extract_index_ivf(index).make_direct_map()
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def build_index(vectors, kind, spec, seed=0):
+    """
+    按目标类型构建索引：IVF 系列在随机样本上训练，再按原顺序写入全部向量
+
+    Args:
+        vectors (np.ndarray): (n, d) float32 向量
+        kind (str): 目标索引类型
+        spec (IndexSpec): 索引配置
+
+    Returns:
+        faiss.Index
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = create_index(vectors.shape[1], kind, spec, len(vectors))
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(vectors), spec.train_size)
+        sample = vectors[np.sort(rng.choice(len(vectors), size=sample_size, replace=False))]
+        start = time.time()
+        index.train(sample)
+        logger.info(f"FAISS {kind} 训练完成: 样本 {sample_size}，耗时 {time.time() - start:.2f}s")
+    index.add(vectors)
+    apply_search_params(index, spec)
+    return index
+
+
+def ensure_index(vectordb, spec):
+    """
+    把向量库的索引转换为配置的类型（类型已一致时只设置查询参数）
+
+    Args:
+        vectordb: LangChain FAISS 实例（就地替换 vectordb.index）
+        spec (IndexSpec): 索引配置
+
+    Returns:
+        bool: 是否发生了转换
+    """
+    index = vectordb.index
+    target = spec.effective_type(index.ntotal)
+    current = index_kind(index)
+    if current == target:
+        apply_search_params(index, spec)
+        return False
+    start = time.time()
+    vectordb.index = build_index(reconstruct_all(index), target, spec)
+    logger.info(f"FAISS 索引已由 {current} 转换为 {target}: {index.ntotal} 个向量，耗时 {time.time() - start:.2f}s")
+    return True
+
+
+def merge_vectordb(vectordb, new_vectordb):
+    """
+    把新构建的（Flat）向量库追加到现有向量库末尾，等价于 FAISS.merge_from，
+    但现有索引为 IVF / HNSW 时直接写入已训练的索引
+
+    Args:
+        vectordb: 现有 LangChain FAISS 实例
+        new_vectordb: 新分块的 LangChain FAISS 实例
+    """
+    if index_kind(vectordb.index) == "flat" and index_kind(new_vectordb.index) == "flat":
+        vectordb.merge_from(new_vectordb)
+        return
+    if set(vectordb.index_to_docstore_id.values()) & set(new_vectordb.index_to_docstore_id.values()):
+        raise ValueError("Cannot merge with overlapping ids")
+    start_pos = len(vectordb.index_to_docstore_id)
+    vectordb.index.add(np.ascontiguousarray(reconstruct_all(new_vectordb.index), dtype=np.float32))
+    new_items = sorted(new_vectordb.index_to_docstore_id.items())
+    vectordb.docstore.add({doc_id: new_vectordb.docstore.search(doc_id) for _, doc_id in new_items})
+    vectordb.index_to_docstore_id.update({start_pos + pos: doc_id for pos, doc_id in new_items})
+
+
+def _renumber_ivf_ids(index, removed_positions):
+    """
+    IVF 的 remove_ids 不会像 Flat 那样前移后续下标，这里把倒排表中的 id 减去其前面被删除的数量，
+    使下标与 LangChain 重排后的 index_to_docstore_id 一致
+    """
+    import faiss
+
+    removed = np.sort(np.asarray(removed_positions, dtype=np.int64))
+    invlists = faiss.extract_index_ivf(index).invlists
+    for list_no in range(invlists.nlist):
+        size = invlists.list_size(list_no)
+        if size == 0:
+            continue
+        ids = faiss.rev_swig_ptr(invlists.get_ids(list_no), size).copy()
+        codes = faiss.rev_swig_ptr(invlists.get_codes(list_no), size * invlists.code_size).copy()
+        ids -= np.searchsorted(removed, ids)
+        invlists.update_entries(list_no, 0, size, faiss.swig_ptr(ids), faiss.swig_ptr(codes))
+
+
+def delete_vectors(vectordb, ids, spec):
+    """
+    按 docstore id 删除向量，语义与 FAISS.delete 一致（其余向量下标按原顺序前移）
+
+    Flat 直接调用 FAISS.delete；IVF 删除后重新编号倒排表中的 id；
+    HNSW 不支持删除，用剩余向量重建图（不需要训练）。
+
+    Args:
+        vectordb: LangChain FAISS 实例
+        ids (list): 要删除的 docstore id
+        spec (IndexSpec): 索引配置（HNSW 重建时使用）
+    """
+    kind = index_kind(vectordb.index)
+    if kind == "flat":
+        return vectordb.delete(ids=ids)
+    id_set = set(ids)
+    missing = id_set - set(vectordb.index_to_docstore_id.values())
+    if missing:
+        raise ValueError(f"Some specified ids do not exist in the current store. Ids not found: {missing}")
+
+    items = sorted(vectordb.index_to_docstore_id.items())
+    removed_positions = [pos for pos, doc_id in items if doc_id in id_set]
+    if kind == "hnsw":
+        keep = np.array([pos for pos, doc_id in items if doc_id not in id_set], dtype=np.int64)
+        vectors = reconstruct_all(vectordb.index)[keep]
+        vectordb.index = build_index(vectors, "hnsw", spec)
+    else:
+        vectordb.index.remove_ids(np.asarray(removed_positions, dtype=np.int64))
+        _renumber_ivf_ids(vectordb.index, removed_positions)
+
+    vectordb.docstore.delete(list(id_set))
+    remaining = [doc_id for _, doc_id in items if doc_id not in id_set]
+    vectordb.index_to_docstore_id = {i: doc_id for i, doc_id in enumerate(remaining)}
+    return True
+
+
+def index_memory_bytes(index):
+    """
+    估算索引常驻内存（字节）
+    """
+    import faiss
+
+    kind = index_kind(index)
+    ntotal, dim = int(index.ntotal), int(index.d)
+    if kind == "flat":
+        return ntotal * dim * 4
+    if kind == "hnsw":
+        # 向量 + 第 0 层 2M 个邻居 + 上层约 M/(M-1) 的摊销
+        return ntotal * (dim * 4 + index.hnsw.nb_neighbors(0) * 4 + index.hnsw.nb_neighbors(1) * 4)
+    ivf = faiss.extract_index_ivf(index)
+    return ntotal * (ivf.code_size + 8) + ivf.nlist * dim * 4
+
+
+def current_dir(faiss_index_path):
+    """
+    faiss_index 当前代目录；没有 CURRENT 指针（旧布局）时返回 faiss_index_path 本身
+
+    Args:
+        faiss_index_path (str): faiss_index 目录
+
+    Returns:
+        str: 实际存放 index.faiss / docstore.sqlite 的目录
+    """
+    pointer = os.path.join(faiss_index_path, CURRENT_FILE)
+    if not os.path.exists(pointer):
+        return faiss_index_path
+    with open(pointer, "r", encoding="utf-8") as f:
+        return os.path.join(faiss_index_path, f.read().strip())
+
+
+def save_params(faiss_index_path, index, spec):
+    """
+    把索引构建参数写入 index_params.json
+
+    Args:
+        faiss_index_path (str): 目标目录（save_local 传入新的代目录）
+        index: FAISS 索引
+        spec (IndexSpec): 索引配置
+    """
+    import faiss
+
+    params = {
+        "index_type": index_kind(index),
+        "configured_type": spec.index_type,
+        "dim": int(index.d),
+        "ntotal": int(index.ntotal),
+        "metric": "l2",
+        "faiss_version": faiss.__version__,
+        "saved_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "spec": spec.to_dict(),
+    }
+    if params["index_type"] in ("ivf_flat", "ivf_pq"):
+        params["nlist"] = int(faiss.extract_index_ivf(index).nlist)
+    if params["index_type"] == "ivf_pq":
+        params["pq_m"] = int(index.pq.M)
+    os.makedirs(faiss_index_path, exist_ok=True)
+    with open(os.path.join(faiss_index_path, PARAMS_FILE), "w", encoding="utf-8") as f:
+        json.dump(params, f, ensure_ascii=False, indent=2)
+
+
+def load_params(faiss_index_path):
+    """
+    读取 index_params.json，不存在时返回 None（旧知识库均为 Flat）
+
+    Args:
+        faiss_index_path (str): faiss_index 目录或其中的代目录
+    """
+    path = os.path.join(current_dir(faiss_index_path), PARAMS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _mmap_flags(kind):
+    import faiss
+
+    if kind in ("ivf_flat", "ivf_pq"):
+        # 倒排表以只读 OnDiskInvertedLists 映射
+        return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    # Flat / HNSW 的向量存储（IndexFlatCodes）需要 IO_FLAG_MMAP_IFC（faiss >= 1.10），旧版本退化为普通读取
+    return getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def load_local(faiss_index_path, embeddings, mmap=True, docstore_cache_size=2048, migrate=True):
+    """
+    加载 faiss_index 目录（CURRENT 指向的代目录，旧布局时为目录本身）
+
+    存在 docstore.sqlite 时：mmap=True 以内存映射方式只读打开索引，分块按需从 SQLite 读取，
+    打开耗时与分块数基本无关；mmap=False 时完整读入内存，得到可增删的副本（上传/删除文件前使用）。
+    只有 LangChain 的 index.pkl 时按原方式加载，migrate=True 时顺带写出 docstore.sqlite。
+
+    Args:
+        faiss_index_path (str): faiss_index 目录
+        embeddings: 嵌入模型
+        mmap (bool): 是否以只读内存映射方式打开
+        docstore_cache_size (int): SQLite 分块存储的 LRU 条数
+        migrate (bool): 旧格式是否转换为 docstore.sqlite
+
+    Returns:
+        tuple: (LangChain FAISS 实例, 是否为只读内存映射)
+    """
+    for _ in range(3):
+        index_dir = current_dir(faiss_index_path)
+        try:
+            return _load_dir(index_dir, embeddings, mmap, docstore_cache_size, migrate)
+        except (OSError, RuntimeError, sqlite3.Error):
+            # 读取指针后其他进程完成了保存并清理了旧代目录：指针已变化时按新指针重试
+            if current_dir(faiss_index_path) == index_dir:
+                raise
+            time.sleep(0.05)
+    raise RuntimeError(f"FAISS 索引在加载期间被反复替换: {faiss_index_path}")
+
+
+def _load_dir(index_dir, embeddings, mmap, docstore_cache_size, migrate):
+    import faiss
+    from langchain_community.vectorstores import FAISS
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from core.docstore import DOCSTORE_FILE, SQLiteDocstore, read_meta, write_docstore
+
+    docstore_file = os.path.join(index_dir, DOCSTORE_FILE)
+    if not os.path.exists(docstore_file):
+        vectordb = FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
+        if not migrate:
+            return vectordb, False
+        logger.info(f"正在把 index.pkl 转换为 {DOCSTORE_FILE}: {index_dir}")
+        write_docstore(docstore_file, vectordb.docstore._dict.items(), vectordb.index_to_docstore_id)
+        if not mmap:
+            return vectordb, False
+        return _load_dir(index_dir, embeddings, True, docstore_cache_size, False)
+
+    kind = (load_params(index_dir) or {}).get("index_type", "flat")
+    index = faiss.read_index(os.path.join(index_dir, "index.faiss"), _mmap_flags(kind) if mmap else 0)
+    expected = int(read_meta(docstore_file).get("ntotal", -1))
+    if index.ntotal != expected:
+        raise RuntimeError(f"FAISS 索引与 {DOCSTORE_FILE} 的向量数不一致: {index_dir}")
+
+    docstore = SQLiteDocstore(docstore_file, cache_size=docstore_cache_size)
+    index_to_docstore_id = docstore.index_to_docstore_id()
+    if not mmap:
+        # 可写副本：分块全部读入 InMemoryDocstore，与 LangChain 原有的增删逻辑一致
+        in_memory = InMemoryDocstore(dict(docstore._dict.items()))
+        docstore.close()
+        docstore = in_memory
+    return FAISS(embeddings, index, docstore, index_to_docstore_id), mmap
+
+
+def save_local(vectordb, faiss_index_path, docstore_format="sqlite", spec=None):
+    """
+    保存 faiss_index 目录
+
+    写入新的代目录后再原子更新 CURRENT 指针，资源池或其他进程已映射、已打开的旧文件不会被覆盖
+    （Windows 下无法替换这些文件）；旧代目录与旧布局文件尽力清理，仍被占用时留到下次保存。
+    docstore_format 为 "pickle" 时代目录中使用 LangChain 的 index.pkl。
+
+    Args:
+        vectordb: LangChain FAISS 实例
+        faiss_index_path (str): faiss_index 目录
+        docstore_format (str): "sqlite" 或 "pickle"
+        spec (IndexSpec): 索引配置，非空时把构建参数一并写入代目录
+    """
+    import faiss
+    from core.docstore import DOCSTORE_FILE, write_docstore
+
+    generation = str(time.time_ns())
+    index_dir = os.path.join(faiss_index_path, generation)
+    os.makedirs(index_dir)
+    if docstore_format == "pickle":
+        vectordb.save_local(index_dir)
+    else:
+        write_docstore(os.path.join(index_dir, DOCSTORE_FILE), vectordb.docstore._dict.items(),
+                       vectordb.index_to_docstore_id)
+        faiss.write_index(vectordb.index, os.path.join(index_dir, "index.faiss"))
+    if spec is not None:
+        save_params(index_dir, vectordb.index, spec)
+    tmp_pointer = os.path.join(faiss_index_path, f"{CURRENT_FILE}.tmp")
+    with open(tmp_pointer, "w", encoding="utf-8") as f:
+        f.write(generation)
+    os.replace(tmp_pointer, os.path.join(faiss_index_path, CURRENT_FILE))
+    for name in os.listdir(faiss_index_path):
+        path = os.path.join(faiss_index_path, name)
+        if name != generation and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif name in _LEGACY_FILES:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
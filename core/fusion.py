@@ -0,0 +1,123 @@
+"""
+检索结果融合与自适应重排预算
+
+向量检索与 BM25 各自返回带分数的有序结果。这里先把两路结果按分块去重合并，保留各路的
+名次与分数，再计算：
+  - RRF（reciprocal rank fusion）：sum(w / (k + rank))，只看名次，不受分数量纲影响；
+  - 归一化分数融合：每一路分数做 min-max 归一化后加权求和，保留"领先多少"的信息。
+两者按 alpha 加权得到融合分，并据此决定需要送入交叉编码器的候选数量：
+两路检索的第一名一致且明显领先时只重排第一名（用于得到与阈值可比的相关分），
+各路第一名都不被其他路命中时扩大重排范围，其余情况沿用默认数量。
+"""
+
+
+def doc_key(doc):
+    """
+    分块去重键：(file_path, 内容前 100 字符)，与原先的去重规则一致（重叠分块取更长者）
+    """
+    content = doc.page_content or ''
+    return (doc.metadata.get('file_path', ''), content[:100])
+
+
+def _min_max(values):
+    lo, hi = min(values), max(values)
+    if hi - lo <= 1e-12:
+        return [1.0 for _ in values]
+    return [(v - lo) / (hi - lo) for v in values]
+
+
+class FusedCandidate:
+    __slots__ = ("doc", "ranks", "scores", "norm_scores", "rrf", "score")
+
+    def __init__(self, doc):
+        self.doc = doc
+        # 检索路名 -> 名次(从 0 开始) / 原始分数 / 归一化分数
+        self.ranks = {}
+        self.scores = {}
+        self.norm_scores = {}
+        self.rrf = 0.0
+        self.score = 0.0
+
+    def __repr__(self):
+        return f"FusedCandidate(score={self.score:.4f}, ranks={self.ranks})"
+
+
+def fuse(ranked_lists, weights=None, rrf_k=60, alpha=0.5):
+    """
+    融合多路检索结果
+
+    Args:
+        ranked_lists (dict): 检索路名 -> [(Document, score)]，每一路已按相关性降序排列，
+                             score 越大越相关（向量检索的距离需先取负）
+        weights (dict): 各路权重，默认均为 1
+        rrf_k (int): RRF 平滑常数
+        alpha (float): 融合分中 RRF 所占比例，其余为归一化分数
+
+    Returns:
+        list[FusedCandidate]: 按融合分降序排列的候选
+    """
+    weights = weights or {}
+    candidates = {}
+    for name, hits in ranked_lists.items():
+        if not hits:
+            continue
+        norm = _min_max([score for _, score in hits])
+        for rank, ((doc, score), norm_score) in enumerate(zip(hits, norm)):
+            key = doc_key(doc)
+            cand = candidates.get(key)
+            if cand is None:
+                cand = candidates[key] = FusedCandidate(doc)
+            elif len(doc.page_content) > len(cand.doc.page_content):
+                cand.doc = doc
+            # 同一路内的重复分块只记最好的一次
+            if name in cand.ranks:
+                continue
+            cand.ranks[name] = rank
+            cand.scores[name] = score
+            cand.norm_scores[name] = norm_score
+
+    total_weight = sum(weights.get(name, 1.0) for name in ranked_lists) or 1.0
+    for cand in candidates.values():
+        cand.rrf = sum(weights.get(name, 1.0) / (rrf_k + rank + 1) for name, rank in cand.ranks.items())
+        cand.score = sum(weights.get(name, 1.0) * s for name, s in cand.norm_scores.items()) / total_weight
+
+    fused = list(candidates.values())
+    if fused:
+        # RRF 的取值范围很小，先缩放到 [0, 1] 再与归一化分数混合
+        rrf_norm = _min_max([cand.rrf for cand in fused])
+        for cand, r in zip(fused, rrf_norm):
+            cand.score = alpha * r + (1 - alpha) * cand.score
+    fused.sort(key=lambda cand: cand.score, reverse=True)
+    return fused
+
+
+def rerank_budget(fused, num_lists, default=6, agree=1, widen=12, margin=0.2):
+    """
+    根据各路检索的一致程度决定重排候选数量
+
+    Args:
+        fused (list[FusedCandidate]): fuse() 的结果
+        num_lists (int): 参与融合且有结果的检索路数
+        default (int): 默认重排数量
+        agree (int): 各路第一名一致且领先明显时的重排数量
+        widen (int): 各路第一名都未被其他路命中（没有共识）时的重排数量
+        margin (float): 判定"明显领先"所需的融合分差
+
+    Returns:
+        tuple: (重排数量, 决策原因: "agree" / "disagree" / "default")
+    """
+    if not fused:
+        return 0, "default"
+    if num_lists < 2:
+        return min(default, len(fused)), "default"
+
+    top = fused[0]
+    top_everywhere = len(top.ranks) == num_lists and all(rank == 0 for rank in top.ranks.values())
+    lead = top.score - (fused[1].score if len(fused) > 1 else 0.0)
+    if top_everywhere and lead >= margin:
+        return min(agree, len(fused)), "agree"
+
+    firsts = [cand for cand in fused if 0 in cand.ranks.values()]
+    if all(len(cand.ranks) == 1 for cand in firsts):
+        return min(widen, len(fused)), "disagree"
+    return min(default, len(fused)), "default"
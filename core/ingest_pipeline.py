@@ -0,0 +1,230 @@
+"""
+流式入库流水线：解析（含分块） -> 组批 -> 向量化 -> 写入索引
+
+各阶段以有界队列相连：某个文件解析完成后其分块立即进入向量化，向量化完成的批次立即写入 FAISS，
+编码器不必等所有文件解析完，解析进程也不必等向量化结束；下游变慢时队列写满，上游暂停（背压），
+内存中只保留队列容量内的分块与向量，而不是整批上传的全部分块及其 Python 浮点列表。
+"""
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from collections import deque
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+logger = logging.getLogger("docqa.kb")
+
+_STAGES = ("parse", "embed", "index")
+
+
+class IngestMetrics:
+    """
+    各阶段的吞吐计数：最近一次入库任务与进程启动以来的累计值
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.jobs = 0
+        self.totals = {stage: {"items": 0, "chunks": 0, "busy_seconds": 0.0} for stage in _STAGES}
+        self.last_job = None
+
+    def record(self, job_stats):
+        with self._lock:
+            self.jobs += 1
+            for stage in _STAGES:
+                for key in ("items", "chunks", "busy_seconds"):
+                    self.totals[stage][key] += job_stats["stages"][stage][key]
+            self.last_job = job_stats
+
+    def stats(self):
+        with self._lock:
+            totals = {stage: dict(counter, busy_seconds=round(counter["busy_seconds"], 2))
+                      for stage, counter in self.totals.items()}
+            return {"jobs": self.jobs, "totals": totals, "last_job": self.last_job}
+
+
+class _StageCounter:
+    """
+    busy_seconds 为该阶段至少有一个条目在处理中的时间（解析阶段多个文件并行，重叠部分只计一次）；
+    chunks_per_second 按该阶段从第一个条目开始到最后一个条目结束的墙钟时间计算，即实际产出速率
+    """
+
+    def __init__(self):
+        self.items = 0
+        self.chunks = 0
+        self.busy_seconds = 0.0
+        self.first_start = None
+        self.last_end = None
+
+    def add(self, chunks, start, end):
+        # 各阶段按开始时间的先后登记条目，与已登记区间的并集只需和最后的结束时间比较
+        self.items += 1
+        self.chunks += chunks
+        if self.first_start is None:
+            self.first_start = start
+        if self.last_end is None or start >= self.last_end:
+            self.busy_seconds += end - start
+            self.last_end = end
+        elif end > self.last_end:
+            self.busy_seconds += end - self.last_end
+            self.last_end = end
+
+    def to_dict(self):
+        span = (self.last_end - self.first_start) if self.items else 0.0
+        return {
+            "items": self.items,
+            "chunks": self.chunks,
+            "busy_seconds": round(self.busy_seconds, 2),
+            "active_seconds": round(span, 2),
+            "chunks_per_second": round(self.chunks / span, 1) if span else 0.0,
+        }
+
+
+class _BoundedQueue(asyncio.Queue):
+    # 记录队列的最高水位，用于判断哪个阶段是瓶颈
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self.high_watermark = 0
+
+    async def put(self, item):
+        await super().put(item)
+        self.high_watermark = max(self.high_watermark, self.qsize())
+
+
+class IngestPipeline:
+    """
+    一次入库任务的流水线（每次上传新建一个实例）
+    """
+
+    def __init__(self, parse, embeddings, query_embeddings=None, batch_size=100, queue_size=4,
+                 parse_window=8, after_batch=None, metrics=None):
+        """
+        Args:
+            parse: 协程函数 parse(ext, file) -> [Document]，解析并分块单个文件
+            embeddings: 入库用的嵌入模型（可带分块向量缓存）
+            query_embeddings: 写入向量库、供查询使用的嵌入模型，默认同 embeddings
+            batch_size (int): 每个向量化批次的分块数
+            queue_size (int): 阶段之间的队列容量（解析 -> 向量化按文件计，向量化 -> 写索引按批次计）
+            parse_window (int): 同时在解析中的文件数上限
+            after_batch: 每个批次向量化后的回调（如清理 GPU 缓存）
+            metrics (IngestMetrics): 累计统计，任务结束后写入
+        """
+        self.parse = parse
+        self.embeddings = embeddings
+        self.query_embeddings = query_embeddings or embeddings
+        self.batch_size = max(1, int(batch_size))
+        self.queue_size = max(1, int(queue_size))
+        self.parse_window = max(1, int(parse_window))
+        self.after_batch = after_batch
+        self.metrics = metrics
+        self.counters = {stage: _StageCounter() for stage in _STAGES}
+        self.vectordb = None
+        self._parsed = _BoundedQueue(self.queue_size)
+        self._embedded = _BoundedQueue(self.queue_size)
+        self.wall_seconds = 0.0
+
+    async def run(self, jobs):
+        """
+        执行流水线
+
+        Args:
+            jobs (list): (文件类型, 文件路径)，按合并顺序排列（见 kb_manager.ordered_parse_jobs）
+
+        Returns:
+            FAISS 或 None: 本次新增分块构成的（Flat）向量库，没有产生任何分块时为 None
+        """
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(self._parse_stage(jobs)),
+                 asyncio.create_task(self._embed_stage()),
+                 asyncio.create_task(self._index_stage())]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            self.wall_seconds = time.perf_counter() - start
+        stats = self.stats()
+        logger.info(f"入库流水线完成: {stats}")
+        if self.metrics is not None:
+            self.metrics.record(stats)
+        return self.vectordb
+
+    async def _parse_stage(self, jobs):
+        # 按顺序启动解析任务（最多 parse_window 个同时进行），按同样的顺序取结果送入下游，
+        # 结果顺序与 parse_files 一致；下游队列写满时停止启动新的解析
+        pending = deque()
+        jobs = iter(jobs)
+        try:
+            while True:
+                while len(pending) < self.parse_window:
+                    job = next(jobs, None)
+                    if job is None:
+                        break
+                    pending.append((time.perf_counter(), asyncio.create_task(self.parse(*job))))
+                if not pending:
+                    break
+                started, task = pending.popleft()
+                docs = await task
+                self.counters["parse"].add(len(docs), started, time.perf_counter())
+                if docs:
+                    await self._parsed.put(docs)
+        finally:
+            for _, task in pending:
+                task.cancel()
+        await self._parsed.put(None)
+
+    async def _embed_stage(self):
+        batch = []
+        while True:
+            docs = await self._parsed.get()
+            if docs is not None:
+                batch.extend(docs)
+            while len(batch) >= self.batch_size or (docs is None and batch):
+                current, batch = batch[:self.batch_size], batch[self.batch_size:]
+                await self._embed_batch(current)
+            if docs is None:
+                break
+        await self._embedded.put(None)
+
+    async def _embed_batch(self, docs):
+        start = time.perf_counter()
+        vectors = await self.embeddings.aembed_documents([doc.page_content for doc in docs])
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.after_batch is not None:
+            self.after_batch()
+        self.counters["embed"].add(len(docs), start, time.perf_counter())
+        await self._embedded.put((docs, vectors))
+
+    async def _index_stage(self):
+        while True:
+            item = await self._embedded.get()
+            if item is None:
+                break
+            docs, vectors = item
+            start = time.perf_counter()
+            await asyncio.to_thread(self._write, docs, vectors)
+            self.counters["index"].add(len(docs), start, time.perf_counter())
+
+    def _write(self, docs, vectors):
+        texts = [doc.page_content for doc in docs]
+        metadatas = [doc.metadata for doc in docs]
+        ids = [str(uuid.uuid4()) for _ in docs]
+        # 向量以 float32 ndarray 写入（FAISS 内部同样转换为 float32），不经过 Python 浮点列表
+        text_embeddings = list(zip(texts, vectors))
+        if self.vectordb is None:
+            self.vectordb = FAISS.from_embeddings(text_embeddings, self.query_embeddings, metadatas=metadatas, ids=ids)
+        else:
+            self.vectordb.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+
+    def stats(self):
+        return {
+            "wall_seconds": round(self.wall_seconds, 2),
+            "stages": {stage: counter.to_dict() for stage, counter in self.counters.items()},
+            "queue_high_watermark": {"parse->embed": self._parsed.high_watermark,
+                                     "embed->index": self._embedded.high_watermark},
+        }
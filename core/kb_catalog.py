@@ -0,0 +1,151 @@
+import os
+import bisect
+import threading
+
+# 与检索/问答逻辑保持一致的 Excel 类文件后缀
+EXCEL_EXTENSIONS = ('.xlsx', '.xls', '.xlsm', '.csv')
+
+
+class KBCatalog:
+    """
+    知识库元数据目录
+
+    在加载知识库时遍历一次 docstore 建立，之后随上传/删除增量维护。
+    记录每个文件的分块数量、文件类型、docstore id 以及在 FAISS 中的下标范围，
+    并维护 Excel 分块计数，使检索策略判断与诊断日志不再需要扫描 docstore。
+    """
+
+    def __init__(self):
+        # file_name -> {"file_type", "is_excel", "chunk_ids", "pos_range"}
+        self.files = {}
+        # docstore id -> file_name
+        self._id_to_file = {}
+        self.total_chunks = 0
+        self.excel_chunks = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_vectordb(cls, vectordb):
+        """
+        由 FAISS 向量库构建目录（O(分块数)，仅在加载知识库时执行一次）
+
+        Args:
+            vectordb: LangChain FAISS 实例
+
+        Returns:
+            KBCatalog: 目录实例
+        """
+        catalog = cls()
+        if vectordb is None:
+            return catalog
+        if hasattr(vectordb.docstore, "catalog_rows"):
+            # SQLite 分块存储：只读取 file_path 列，不解码分块内容
+            catalog.add_paths(vectordb.docstore.catalog_rows())
+        else:
+            docstore = vectordb.docstore._dict
+            catalog.add((pos, doc_id, docstore[doc_id])
+                        for pos, doc_id in sorted(vectordb.index_to_docstore_id.items())
+                        if doc_id in docstore)
+        return catalog
+
+    def add(self, entries):
+        """
+        登记新增分块
+
+        Args:
+            entries (iterable): (faiss 下标, docstore id, Document) 三元组
+        """
+        self.add_paths((pos, doc_id, doc.metadata.get('file_path', '')) for pos, doc_id, doc in entries)
+
+    def add_paths(self, entries):
+        """
+        登记新增分块
+
+        Args:
+            entries (iterable): (faiss 下标, docstore id, file_path) 三元组
+        """
+        with self._lock:
+            for pos, doc_id, file_path in entries:
+                file_path = file_path or ''
+                file_name = os.path.basename(file_path)
+                entry = self.files.get(file_name)
+                if entry is None:
+                    entry = self.files[file_name] = {
+                        "file_type": os.path.splitext(file_name)[1].lower().lstrip('.'),
+                        "is_excel": file_path.endswith(EXCEL_EXTENSIONS),
+                        "chunk_ids": [],
+                        "pos_range": [pos, pos],
+                    }
+                entry["chunk_ids"].append(doc_id)
+                entry["pos_range"][0] = min(entry["pos_range"][0], pos)
+                entry["pos_range"][1] = max(entry["pos_range"][1], pos)
+                self._id_to_file[doc_id] = file_name
+                self.total_chunks += 1
+                if entry["is_excel"]:
+                    self.excel_chunks += 1
+
+    def remove_ids(self, doc_ids, removed_positions=None):
+        """
+        注销被删除的分块
+
+        Args:
+            doc_ids (list): 被删除分块的 docstore id
+            removed_positions (list): 被删除分块原来的 FAISS 下标；提供时据此平移其余文件的下标范围
+                                     （FAISS.delete 会把后续向量的下标前移）
+        """
+        with self._lock:
+            removed = set(doc_ids)
+            touched = set()
+            for doc_id in removed:
+                file_name = self._id_to_file.pop(doc_id, None)
+                if file_name is None:
+                    continue
+                touched.add(file_name)
+                self.total_chunks -= 1
+                if self.files[file_name]["is_excel"]:
+                    self.excel_chunks -= 1
+            for file_name in touched:
+                entry = self.files[file_name]
+                entry["chunk_ids"] = [doc_id for doc_id in entry["chunk_ids"] if doc_id not in removed]
+                if not entry["chunk_ids"]:
+                    del self.files[file_name]
+            if removed_positions:
+                shifts = sorted(removed_positions)
+                for entry in self.files.values():
+                    lo, hi = entry["pos_range"]
+                    entry["pos_range"] = [lo - bisect.bisect_left(shifts, lo), hi - bisect.bisect_left(shifts, hi)]
+
+    def chunk_ids(self, file_name):
+        """
+        返回文件对应的 docstore id 列表
+        """
+        entry = self.files.get(file_name)
+        return list(entry["chunk_ids"]) if entry else []
+
+    def file_names(self):
+        """
+        已登记的文件名集合（忽略缺少 file_path 的分块）
+        """
+        return {file_name for file_name in self.files if file_name}
+
+    @property
+    def has_excel(self):
+        return self.excel_chunks > 0
+
+    @property
+    def all_excel(self):
+        """
+        知识库是否只包含 Excel 类分块（空库视为 False）
+        """
+        return self.total_chunks > 0 and self.excel_chunks == self.total_chunks
+
+    def summary(self):
+        """
+        诊断信息摘要（文件数、分块数、Excel 分块数）
+        """
+        return {
+            "files": len(self.files),
+            "chunks": self.total_chunks,
+            "excel_chunks": self.excel_chunks,
+            "excel_files": sum(1 for entry in self.files.values() if entry["is_excel"]),
+        }
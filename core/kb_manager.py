@@ -1,14 +1,20 @@
 import asyncio
-from concurrent.futures import ProcessPoolExecutor
 from parsers.main_parser import process_doc_file, process_md_file, process_txt_file, process_pdf
 from langchain_community.embeddings import HuggingFaceBgeEmbeddings
 from langchain_openai import OpenAIEmbeddings
 from core.search_bm25 import BM25Search
+from core.kb_catalog import KBCatalog
+from core.faiss_index import IndexSpec, apply_search_params, ensure_index, merge_vectordb, delete_vectors, load_local, save_local
+from core.docstore import SQLiteDocstore
+from core.qa_index import QAIndex, QA_INDEX_FILE
+from core.kb_manifest import KBManifest
+from core.chunk_embedding_store import ChunkEmbeddingJob, ChunkCachedEmbeddings
+from core.parse_pool import ParsePool
+from core.ingest_pipeline import IngestPipeline, IngestMetrics
 from langchain_community.vectorstores import FAISS
 import shutil
 import os
 import time
-from tqdm import tqdm
 import gc
 import traceback
 import torch
@@ -28,37 +34,164 @@ logger = logging.getLogger("docqa.kb")
 
 # 从配置文件中获取最大工作进程数，设置默认值为4
 MAX_WORKERS = config['system'].get('max_workers', 4)
+# BM25 墓碑占比超过该值时后台合并索引
+BM25_COMPACT_RATIO = config['settings'].get('bm25_compact_ratio', 0.2)
+# 问答加载知识库时以只读内存映射方式打开 FAISS 索引，分块存储格式 sqlite / pickle
+FAISS_MMAP = config['settings'].get('faiss_mmap', True)
+DOCSTORE_FORMAT = config['settings'].get('docstore_format', 'sqlite')
+DOCSTORE_CACHE_SIZE = config['settings'].get('docstore_cache_size', 2048)
+# QA 问题索引的近似重复阈值（字符二元组 Jaccard）
+QA_INDEX_MIN_SIMILARITY = config['settings'].get('qa_index_min_similarity', 0.8)
+
+# 解析进程池：所有知识库共用，避免每个知识库各自持有一组工作进程
+parse_pool = ParsePool(
+    max_workers=MAX_WORKERS,
+    timeout=config['system'].get('parse_timeout_secs', 600),
+    memory_mb=config['system'].get('parse_memory_mb', 4096),
+    io_concurrency=config['system'].get('parse_io_concurrency', 8),
+)
+
+# 入库流水线各阶段的吞吐统计（/stats 接口展示）
+ingest_metrics = IngestMetrics()
+# 流水线阶段之间的队列容量：解析 -> 向量化按文件计，向量化 -> 写索引按批次计
+INGEST_QUEUE_SIZE = config['settings'].get('ingest_queue_size', 4)
+
+# 文件类型 -> (解析函数, 是否需要图片目录, 执行方式)；字典顺序即合并结果时的文件类型顺序
+# cpu：在解析进程池中执行；io：OCR HTTP / LlamaParse，以协程并发执行
+PARSERS = {
+    'docx': (process_doc_file, True, 'cpu'),
+    'doc': (process_doc2_file, False, 'cpu'),
+    'pdf': (process_pdf, True, 'cpu'),
+    'md': (process_md_file, False, 'cpu'),
+    'txt': (process_txt_file, False, 'cpu'),
+    'pptx': (process_ppt_file, True, 'cpu'),
+    'html': (process_html_file, False, 'cpu'),
+    'xlsx': (process_excel_file, False, 'io'),
+    'csv': (process_excel_file, False, 'io'),
+    'jpg': (process_pic_file, False, 'io'),
+    'png': (process_pic_file, False, 'io'),
+}
+
+
+def ordered_parse_jobs(files):
+    """
+    按 PARSERS 的文件类型顺序、同类型内按上传顺序排列待解析文件（不支持的类型被忽略）
+
+    Returns:
+        list: (文件类型, 文件路径)
+    """
+    kinds = list(PARSERS)
+    jobs = []
+    for position, file in enumerate(files):
+        ext = os.path.splitext(file)[1].lower().lstrip('.')
+        if ext in PARSERS:
+            jobs.append((kinds.index(ext), position, ext, file))
+    return [(ext, file) for _, _, ext, file in sorted(jobs)]
+
+
+async def parse_file(ext, file, image_directory, markdown_directory, pool=None):
+    """
+    解析单个文件；解析失败（异常、超时、超出内存上限）时记录错误并返回空列表
+
+    Returns:
+        list: 文档分块列表
+    """
+    pool = pool or parse_pool
+    func, needs_image_dir, mode = PARSERS[ext]
+    args = (file, image_directory, markdown_directory) if needs_image_dir else (file, markdown_directory)
+    try:
+        if mode == 'cpu':
+            return await pool.run_cpu(func, *args)
+        return await pool.run_io(func, *args)
+    except Exception as e:
+        print(f"处理文件 {file} 时出错: {e}")
+        return []
+
+
+async def parse_files(files, image_directory, markdown_directory, pool=None):
+    """
+    并行解析一批文件，结果顺序与文件类型顺序、上传顺序一致（与解析完成的先后无关）
+
+    Args:
+        files (list): 文件路径列表
+        image_directory (str): 图片输出目录
+        markdown_directory (str): Markdown 输出目录
+        pool (ParsePool): 解析执行器，默认使用模块级 parse_pool
+
+    Returns:
+        list: 文档分块列表
+    """
+    jobs = ordered_parse_jobs(files)
+    results = await asyncio.gather(*(parse_file(ext, file, image_directory, markdown_directory, pool)
+                                     for ext, file in jobs))
+    return [doc for docs in results for doc in docs]
+
 
 class KnowledgeBase:
     """
     知识库管理类，负责处理文档解析、向量化、索引构建和管理等功能
     """
-    def __init__(self, kb_name, embeddings):
+    def __init__(self, kb_name, embeddings, chunk_embedding_store=None, embedding_fingerprint=None):
         """
         初始化知识库
         
         Args:
             kb_name (str): 知识库名称
             embeddings: 嵌入模型实例
+            chunk_embedding_store (ChunkEmbeddingStore): 分块向量缓存，为空时入库不查缓存
+            embedding_fingerprint (str): 嵌入模型指纹（分块向量缓存的键前缀）
         """
         self.kb_name = kb_name
         self.embeddings = embeddings
+        self.chunk_embedding_store = chunk_embedding_store
+        self.embedding_fingerprint = embedding_fingerprint
         KB_DIR = config['paths']['kb_dir']
         # 为与其他方法一致，设置 base_directory 指向配置中的知识库根目录
         self.base_directory = KB_DIR
         self.kb_dir = os.path.join(KB_DIR, kb_name)
         self.vectordb = None
+        # 当前 vectordb 是否为只读内存映射（增删前需 load_vectordb_and_files(mmap=False) 换成可写副本）
+        self.mmap = FAISS_MMAP and DOCSTORE_FORMAT == 'sqlite'
+        self.vectordb_mmapped = False
+        # BM25 检索器，与 faiss_index 同级持久化在 bm25_index 目录
+        self.bm25 = None
+        self.bm25_index_path = os.path.join(self.kb_dir, "bm25_index")
+        # 元数据目录（文件 -> 分块统计），加载时构建一次，随增删增量维护
+        self.catalog = None
+        # QA 格式分块的问题索引，保存向量库时重建，持久化在 qa_index.json
+        self.qa_index = None
+        self.qa_index_path = os.path.join(self.kb_dir, QA_INDEX_FILE)
+        # FAISS 索引类型与参数（settings.faiss_*，可按知识库覆盖）
+        self.index_spec = IndexSpec.from_settings(config['settings'], kb_name)
         self.uploaded_files = set()
         self.image_directory = os.path.join(self.kb_dir, "images")
         self.markdown_directory = os.path.join(self.kb_dir, "markdown_directory")
         os.makedirs(self.image_directory, exist_ok=True)
         os.makedirs(self.markdown_directory, exist_ok=True)
-        # 使用配置中的最大工作进程数
-        self.executor = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+        # 最近一次入库流水线的各阶段统计
+        self.last_ingest_stats = None
+
+    async def _load_faiss(self, faiss_index_path, mmap=None):
+        """
+        加载 faiss_index 目录，mmap 为空时按配置决定是否以只读内存映射方式打开
+        """
+        mmap = self.mmap if mmap is None else mmap
+        previous = self.vectordb
+        self.vectordb, self.vectordb_mmapped = await asyncio.to_thread(
+            load_local, faiss_index_path, self.embeddings, mmap=mmap,
+            docstore_cache_size=DOCSTORE_CACHE_SIZE, migrate=DOCSTORE_FORMAT == 'sqlite')
+        # 重新加载（如改为可写副本）时关闭旧的只读连接，旧代目录随后才能被清理
+        if previous is not None and isinstance(previous.docstore, SQLiteDocstore):
+            previous.docstore.close()
+        apply_search_params(self.vectordb.index, self.index_spec)
+        return self.vectordb
 
-    async def load_vectordb(self):
+    async def load_vectordb(self, mmap=None):
         """
         异步加载向量数据库
+
+        Args:
+            mmap (bool): 是否以只读内存映射方式打开，默认按 settings.faiss_mmap
         
         Returns:
             向量数据库实例或None（如果加载失败）
@@ -68,16 +201,42 @@ class KnowledgeBase:
             if os.path.exists(faiss_index_path):
                 try:
                     logger.info("正在加载 FAISS 索引...")
-                    self.vectordb = await asyncio.to_thread(FAISS.load_local, faiss_index_path, self.embeddings, allow_dangerous_deserialization=True)
+                    await self._load_faiss(faiss_index_path, mmap)
+                    self.catalog = await asyncio.to_thread(KBCatalog.from_vectordb, self.vectordb)
                     logger.info(f"Loaded vectordb for {self.kb_name}")
                 except Exception as e:
                     logger.exception(f"加载向量库失败: {str(e)}")
                     self.vectordb = None
         return self.vectordb
 
+    def release_vectordb(self):
+        """
+        释放向量库句柄（内存映射的索引与 SQLite 连接），删除知识库目录前调用
+        """
+        if self.vectordb is not None and isinstance(self.vectordb.docstore, SQLiteDocstore):
+            self.vectordb.docstore.close()
+        self.vectordb = None
+        self.bm25 = None
+        self.qa_index = None
+        self.vectordb_mmapped = False
+
+    async def clear_vectordb_files(self):
+        """
+        知识库已没有任何分块时删除磁盘上的 faiss_index、BM25 与问题索引，资源池刷新时不会再加载旧内容
+        """
+        self.release_vectordb()
+        self.catalog = None
+        for path in (os.path.join(self.base_directory, self.kb_name, "faiss_index"), self.bm25_index_path):
+            if os.path.exists(path):
+                await asyncio.to_thread(shutil.rmtree, path)
+        if os.path.exists(self.qa_index_path):
+            await asyncio.to_thread(os.remove, self.qa_index_path)
+
     async def process_files(self, files):
         """
         异步处理上传的文件，将其解析为文档分块
+
+        CPU 型解析在共享的解析进程池中并行执行，OCR / LlamaParse 以协程并发，结果按文件类型与上传顺序合并
         
         Args:
             files (list): 文件路径列表
@@ -87,135 +246,23 @@ class KnowledgeBase:
         """
         logger.info("正在解析并分块上传文件...")
         start = time.time()
-
-        # 文件分类
-        file_groups = {
-            'docx': [], 'doc': [], 'pdf': [], 'md': [], 'txt': [],
-            'pptx': [], 'html': [], 'xlsx': [], 'csv': [], 'jpg': [], 'png': []
-        }
-
-        supported_extensions = set(file_groups.keys())
-
-        for file in files:
-            # 使用 os.path.splitext() 来正确处理文件扩展名
-            _, ext = os.path.splitext(file)
-            ext = ext.lower().lstrip('.')
-            
-            # 特殊处理 .doc 和 .docx
-            if ext == 'doc' or ext == 'docx':
-                if file.lower().endswith('.doc'):
-                    ext = 'doc'
-                elif file.lower().endswith('.docx'):
-                    ext = 'docx'
-            
-            if ext in supported_extensions:
-                file_groups[ext].append(file)
-
-        all_md_header_splits = []
-
-        # 顺序处理文件组，避免并行处理导致的内存问题
-        for file in tqdm(file_groups['docx'], desc="Processing DOCX files"):
-            try:
-                md_header_splits = process_doc_file(file, self.image_directory, self.markdown_directory)
-                all_md_header_splits.extend(md_header_splits)
-            except Exception as e:
-                print(f"处理文件 {file} 时出错: {e}")
-                continue
-
-        for file in tqdm(file_groups['doc'], desc="Processing DOC files"):
-            try:
-                md_header_splits = process_doc2_file(file, self.markdown_directory)
-                all_md_header_splits.extend(md_header_splits)
-            except Exception as e:
-                print(f"处理文件 {file} 时出错: {e}")
-                continue
-
-        for file in tqdm(file_groups['pdf'], desc="Processing PDF files"):
-            try:
-                md_header_splits = process_pdf(file, self.image_directory, self.markdown_directory)
-                all_md_header_splits.extend(md_header_splits)
-            except Exception as e:
-                print(f"处理文件 {file} 时出错: {e}")
-                continue
-
-        for file in tqdm(file_groups['md'], desc="Processing Markdown files"):
-            try:
-                md_header_splits = process_md_file(file, self.markdown_directory)
-                all_md_header_splits.extend(md_header_splits)
-            except Exception as e:
-                print(f"处理文件 {file} 时出错: {e}")
-                continue
-
-        for file in tqdm(file_groups['txt'], desc="Processing TXT files"):
-            try:
-                md_header_splits = process_txt_file(file, self.markdown_directory)
-                all_md_header_splits.extend(md_header_splits)
-            except Exception as e:
-                print(f"处理文件 {file} 时出错: {e}")
-                continue
-
-        for file in tqdm(file_groups['pptx'], desc="Processing PPT files"):
-            try:
-                md_header_splits = process_ppt_file(file, self.image_directory, self.markdown_directory)
-                all_md_header_splits.extend(md_header_splits)
-            except Exception as e:
-                print(f"处理文件 {file} 时出错: {e}")
-                continue
-
-        for file in tqdm(file_groups['html'], desc="Processing HTML files"):
-            try:
-                md_header_splits = process_html_file(file, self.markdown_directory)
-                all_md_header_splits.extend(md_header_splits)
-            except Exception as e:
-                print(f"处理文件 {file} 时出错: {e}")
-                continue
-
-        for file in tqdm(file_groups['xlsx'], desc="Processing XLSX files"):
-            try:
-                md_header_splits = await process_excel_file(file, self.markdown_directory)
-                all_md_header_splits.extend(md_header_splits)
-            except Exception as e:
-                print(f"处理文件 {file} 时出错: {e}")
-                continue
-
-        for file in tqdm(file_groups['csv'], desc="Processing CSV files"):
-            try:
-                md_header_splits = await process_excel_file(file, self.markdown_directory)
-                all_md_header_splits.extend(md_header_splits)
-            except Exception as e:
-                print(f"处理文件 {file} 时出错: {e}")
-                continue
-
-        for file in tqdm(file_groups['jpg'], desc="Processing JPG files"):
-            try:
-                md_header_splits = process_pic_file(file, self.markdown_directory)
-                all_md_header_splits.extend(md_header_splits)
-            except Exception as e:
-                print(f"处理文件 {file} 时出错: {e}")
-                continue
-
-        for file in tqdm(file_groups['png'], desc="Processing PNG files"):
-            try:
-                md_header_splits = process_pic_file(file, self.markdown_directory)
-                all_md_header_splits.extend(md_header_splits)
-            except Exception as e:
-                print(f"处理文件 {file} 时出错: {e}")
-                continue
-
+        all_md_header_splits = await parse_files(files, self.image_directory, self.markdown_directory)
         end = time.time()
         print(f"解析文档总共耗时: {end - start:.2f} 秒")
         return all_md_header_splits
 
-    async def vectorize_documents(self, documents):
+    async def vectorize_documents(self, documents, embeddings=None):
         """
         异步将文档向量化并构建FAISS索引
         
         Args:
             documents (list): 文档列表
+            embeddings: 入库用的嵌入模型（带分块向量缓存），默认使用 self.embeddings
             
         Returns:
             FAISS向量数据库实例
         """
+        embeddings = embeddings or self.embeddings
         logger.info("正在构建向量索引（FAISS）...")
         start = time.time()
         # 每批处理的文档数（可通过 config.yaml 的 settings.vector_batch_size 调整）
@@ -229,7 +276,7 @@ class KnowledgeBase:
             batch_start = time.time()
 
             # 异步创建FAISS向量数据库
-            batch_vectordb = await FAISS.afrom_documents(batch, self.embeddings)
+            batch_vectordb = await FAISS.afrom_documents(batch, embeddings)
             if vectordb is None:
                 vectordb = batch_vectordb
             else:
@@ -244,6 +291,14 @@ class KnowledgeBase:
         logger.info(f"向量化文档总共耗时: {end - start:.2f} 秒")
         return vectordb
 
+    def _chunk_embedding_job(self):
+        """
+        一次入库任务的分块向量缓存查询（未启用缓存时为 None），用于统计本次任务的命中率
+        """
+        if self.chunk_embedding_store is None or not self.embedding_fingerprint:
+            return None
+        return ChunkEmbeddingJob(self.chunk_embedding_store, self.embedding_fingerprint)
+
     def clean_gpu_cache(self):
         """
         清理GPU缓存，释放内存
@@ -257,32 +312,138 @@ class KnowledgeBase:
     async def save_vectordb(self, vectordb):
         """
         异步保存向量数据库到磁盘
+
+        保存前按 index_spec 把 Flat 索引转换为配置的类型（IVF 系列在样本上训练），
+        向量、分块与构建参数写入 faiss_index 下新的代目录（见 core/faiss_index.save_local）。
         
         Args:
             vectordb: 向量数据库实例
         """
+        await asyncio.to_thread(ensure_index, vectordb, self.index_spec)
         logger.info("正在保存向量索引到磁盘...")
         faiss_index_path = os.path.join(self.base_directory, self.kb_name, "faiss_index")
-        await asyncio.to_thread(vectordb.save_local, faiss_index_path)
+        await asyncio.to_thread(save_local, vectordb, faiss_index_path, DOCSTORE_FORMAT, self.index_spec)
+        await self.save_bm25(vectordb)
+        await self.save_qa_index(vectordb)
+
+    async def save_bm25(self, vectordb):
+        """
+        异步持久化 BM25 索引
+
+        内存中的 BM25 已通过增量增删与 docstore 保持同步时直接写出；
+        否则加载已有产物（docstore 未变化时不重复分词）或重新构建。
+
+        Args:
+            vectordb: 向量数据库实例
+        """
+        doc_ids = list(vectordb.docstore._dict.keys())
+        if self.bm25 is not None and self.bm25.live_doc_ids() == doc_ids:
+            await asyncio.to_thread(self.bm25.save, self.bm25_index_path)
+        else:
+            await self.load_bm25(vectordb)
+
+    async def save_qa_index(self, vectordb):
+        """
+        由 docstore 中的 QA 分块重建问题索引并写入 qa_index.json
+
+        Args:
+            vectordb: 向量数据库实例
+        """
+        self.qa_index = await asyncio.to_thread(QAIndex.from_documents, vectordb.docstore._dict.items(),
+                                                min_similarity=QA_INDEX_MIN_SIMILARITY)
+        await asyncio.to_thread(self.qa_index.save, self.qa_index_path)
+        logger.info(f"问题索引已更新: {len(self.qa_index)} 条 QA")
+
+    async def load_qa_index(self, vectordb=None):
+        """
+        异步加载问题索引
+
+        优先读取 qa_index.json；文件缺失（旧知识库）或其中的分块已不在 docstore 中时重新构建。
+
+        Args:
+            vectordb: 向量数据库实例，默认使用 self.vectordb
+
+        Returns:
+            QAIndex实例或None（向量库不存在时）
+        """
+        vectordb = vectordb if vectordb is not None else self.vectordb
+        if vectordb is None:
+            self.qa_index = None
+            return None
+        qa_index = await asyncio.to_thread(QAIndex.load, self.qa_index_path, min_similarity=QA_INDEX_MIN_SIMILARITY)
+        docstore = vectordb.docstore._dict
+        if qa_index is None or not all(doc_id in docstore for doc_id in qa_index.doc_ids()):
+            await self.save_qa_index(vectordb)
+        else:
+            self.qa_index = qa_index
+        return self.qa_index
+
+    async def load_bm25(self, vectordb=None):
+        """
+        异步加载 BM25 检索器
+
+        优先以内存映射方式加载 bm25_index 中的持久化索引；仅当分词器指纹或
+        docstore 发生变化时才重新分词构建，并写回磁盘。
+
+        Args:
+            vectordb: 向量数据库实例，默认使用 self.vectordb
+
+        Returns:
+            BM25Search实例或None（向量库不存在时）
+        """
+        vectordb = vectordb if vectordb is not None else self.vectordb
+        if vectordb is None:
+            self.bm25 = None
+            return None
+        if isinstance(vectordb.docstore, SQLiteDocstore):
+            # 只读映射的知识库：分块在 BM25 命中时才从 SQLite 读取
+            doc_ids = vectordb.docstore.doc_ids()
+            docs = vectordb.docstore.documents(doc_ids)
+        else:
+            doc_ids = list(vectordb.docstore._dict.keys())
+            docs = [vectordb.docstore._dict[doc_id] for doc_id in doc_ids]
+        self.bm25 = await asyncio.to_thread(BM25Search.load_or_build, self.bm25_index_path, docs, doc_ids,
+                                            compact_threshold=BM25_COMPACT_RATIO)
+        return self.bm25
 
-    async def get_faiss_vectordb(self, files):
+    async def get_faiss_vectordb(self, files, embeddings=None):
         """
         异步处理文件并构建FAISS向量数据库
+
+        解析、向量化、写索引以流水线方式重叠执行（见 core/ingest_pipeline.py）：
+        先解析完的文件先向量化，不必等整批上传全部解析完，也不在内存中同时保留全部分块
         
         Args:
             files (list): 文件路径列表
+            embeddings: 入库用的嵌入模型，默认使用 self.embeddings
             
         Returns:
-            FAISS向量数据库实例
+            FAISS向量数据库实例，没有产生任何分块时为 None
         """
-        documents = await self.process_files(files)
-        vectordb = await self.vectorize_documents(documents)
+        logger.info("正在解析、向量化并构建向量索引（流水线）...")
+        pipeline = IngestPipeline(
+            parse=lambda ext, file: parse_file(ext, file, self.image_directory, self.markdown_directory),
+            embeddings=embeddings or self.embeddings,
+            query_embeddings=self.embeddings,
+            batch_size=config['settings'].get('vector_batch_size', 100),
+            queue_size=INGEST_QUEUE_SIZE,
+            # 同时解析的文件数：解析进程数 + IO 型解析并发数，两类解析器都能占满
+            parse_window=parse_pool.max_workers + parse_pool.io_concurrency,
+            after_batch=self.clean_gpu_cache,
+            metrics=ingest_metrics,
+        )
+        vectordb = await pipeline.run(ordered_parse_jobs(files))
+        self.last_ingest_stats = pipeline.stats()
         return vectordb
 
 
-    async def load_vectordb_and_files(self):
+    async def load_vectordb_and_files(self, mmap=None):
         """
         异步加载向量数据库和已上传文件列表
+
+        Args:
+            mmap (bool): 是否以只读内存映射方式打开，默认按 settings.faiss_mmap；
+                         随后要增删分块时传 False，得到可写的内存副本
         """
         try:
             faiss_index_path = os.path.join(self.base_directory, self.kb_name, "faiss_index")
@@ -293,13 +454,12 @@ class KnowledgeBase:
             if not os.path.exists(faiss_index_path):
                 raise FileNotFoundError(f"FAISS index not found at {faiss_index_path}")
             
-            self.vectordb = await asyncio.to_thread(FAISS.load_local, faiss_index_path, self.embeddings, allow_dangerous_deserialization=True)
+            await self._load_faiss(faiss_index_path, mmap)
+
+            self.catalog = await asyncio.to_thread(KBCatalog.from_vectordb, self.vectordb)
 
             self.uploaded_files.clear()
-            for doc_id, doc in self.vectordb.docstore._dict.items():
-                source = os.path.basename(doc.metadata.get('file_path', ''))
-                if source:
-                    self.uploaded_files.add(source)
+            self.uploaded_files.update(self.catalog.file_names())
 
             print(f"知识库 {self.kb_name} 的向量数据库和已上传文件加载成功")
         except Exception as e:
@@ -308,31 +468,70 @@ class KnowledgeBase:
             print(f"错误堆栈: {traceback.format_exc()}")
             raise  # 重新抛出异常，以便调用者可以处理它
         
-    async def update_vectordb(self, files):
+    async def update_vectordb(self, files, fresh_names=None):
         """
         异步更新向量数据库，支持首次构建和增量更新
+
+        按文件清单（manifest.json）中的内容哈希分类：未变化的文件跳过，内容变化的文件
+        先删除旧分块再重新入库，新文件直接入库。
         
         Args:
-            files (list): 新文件路径列表
+            files (list): 待入库的文件路径列表（通常为 uploads 目录下的全部文件）
+            fresh_names (set): 本次请求刚上传的文件名，用于清单建立前入库的旧知识库：
+                               不在其中的已入库文件视为未变化；为 None 时一律重新入库
             
         Returns:
-            str: 更新结果信息
+            dict: {"message", "added", "replaced", "skipped", "failed"}，后四项为文件名列表；
+                  failed 为未产生分块的文件（内容变化的文件保留旧内容）
         """
-        # 将传入的文件列表赋值给 new_files
-        new_files = files
-        # 获取新文件的文件名列表
-        new_files_names = [os.path.basename(file) for file in new_files]
         # 加载现有的向量数据库
         self.vectordb = await self.load_vectordb()
         
         # 如果没有选择任何文件，返回提示信息
+        if not files:
+            return {"message": "没有选择任何文件", "added": [], "replaced": [], "skipped": [], "failed": []}
+
+        # 按内容哈希区分新增 / 内容变化 / 未变化的文件
+        manifest = await asyncio.to_thread(KBManifest.load, self.kb_dir)
+        fingerprints = await asyncio.to_thread(lambda: {file: manifest.fingerprint(file) for file in files})
+        known_files = self.catalog.file_names() if self.vectordb is not None and self.catalog is not None else set()
+        added, changed, unchanged = manifest.classify(fingerprints, known_files, fresh_names)
+        for file in unchanged:
+            file_name = os.path.basename(file)
+            # 刷新大小与修改时间（同内容重新上传）；旧知识库首次登记时分块 id 取自目录
+            manifest.record(file_name, fingerprints[file],
+                            manifest.chunk_ids(file_name) or self.catalog.chunk_ids(file_name))
+        skipped_names = [os.path.basename(file) for file in unchanged]
+        changed_names = [os.path.basename(file) for file in changed]
+        added_names = [os.path.basename(file) for file in added]
+        logger.info(f"文件清单: 新增 {len(added)}，内容变化 {len(changed)}，未变化跳过 {len(unchanged)}")
+
+        # 只解析、向量化新增与内容变化的文件
+        new_files = added + changed
+        new_files_names = added_names + changed_names
+        result = {
+            "message": f"已更新 {len(new_files)} 个文件{new_files_names}到知识库 {self.kb_name} 的向量数据库，"
+                       f"跳过 {len(unchanged)} 个未变化的文件",
+            "added": added_names,
+            "replaced": changed_names,
+            "skipped": skipped_names,
+            "failed": [],
+        }
         if not new_files:
-            return "没有选择任何文件"
+            await asyncio.to_thread(manifest.save)
+            return result
+
+        # 已编码过的分块（重新上传、多个知识库导入同一文档等）直接取缓存向量
+        embedding_job = self._chunk_embedding_job()
+        embeddings = ChunkCachedEmbeddings(self.embeddings, embedding_job) if embedding_job else self.embeddings
+        self.last_ingest_stats = None
 
         # 如果向量数据库不存在，则创建一个新的
         if self.vectordb is None:
             logger.info("正在首次构建向量库...")
-            self.vectordb = await self.get_faiss_vectordb(new_files)
+            self.vectordb = await self.get_faiss_vectordb(new_files, embeddings)
+            self.catalog = KBCatalog.from_vectordb(self.vectordb)
+            parsed_names = self.catalog.file_names()
             # 保存新创建的向量库到磁盘，以便后续可以加载
             if self.vectordb is not None:
                 try:
@@ -343,73 +542,97 @@ class KnowledgeBase:
             for file in new_files:
                 self.uploaded_files.add(os.path.basename(file))
         else:
-            # 如果向量数据库存在，加载现有的向量数据库和文件
-            await self.load_vectordb_and_files()
-            # 初始化一个列表，用于存储需要删除的文件
-            files_to_delete = []
-            # 获取文件所在的目录
-            directories = os.path.dirname(files[0]) if files else ""
-            
-            # 检查已上传的文件，如果在新文件列表中，则添加到待删除列表
-            for i in self.uploaded_files:
-                if i in new_files_names:
-                    files_to_delete.append(i)
-
-            # 删除向量数据库中已存在的文件
-            if files_to_delete:
-                # 创建一个新的列表，包含不在待删除列表中的文档ID
-                remaining_docs = [doc_id for doc_id, doc in self.vectordb.docstore._dict.items() 
-                                if os.path.basename(doc.metadata.get('file_path', '')) not in files_to_delete]
-                
-                # 检查是否有剩余文档
-                if remaining_docs:
-                    # 创建一个新的向量数据库，只包含剩余的文档
-                    remaining_vectordb = await asyncio.to_thread(
-                        FAISS.from_documents, 
-                        [self.vectordb.docstore._dict[doc_id] for doc_id in remaining_docs], 
-                        self.embeddings
-                    )
-                    # 更新当前的向量数据库
-                    self.vectordb = remaining_vectordb
-                else:
-                    # 如果没有剩余文档，则设置向量数据库为None
-                    self.vectordb = None
-                    # 清空已上传文件列表
-                    self.uploaded_files.clear()
-
-            # 处理新文件
+            # 如果向量数据库存在，加载现有的向量数据库和文件（可写副本）
+            await self.load_vectordb_and_files(mmap=False)
+            # 加载持久化的 BM25 索引，后续按增删增量维护
+            await self.load_bm25()
             try:
-                new_documents = await self.process_files(new_files)
-                if new_documents:
+                # 先解析、向量化新版本，再删除旧分块：解析失败（异常、超时、超出内存上限）或内容为空的文件
+                # 保留旧内容，不会因为一次失败的重新上传而从知识库中消失
+                new_vectordb = await self.get_faiss_vectordb(new_files, embeddings)
+                parsed_names = KBCatalog.from_vectordb(new_vectordb).file_names() if new_vectordb is not None else set()
+                kept_names = [file_name for file_name in changed_names if file_name not in parsed_names]
+                if kept_names:
+                    logger.warning(f"以下文件的新版本未产生分块，保留旧内容: {kept_names}")
+
+                # 删除向量数据库中已存在的文件：与 remove_file 相同，只删除这些文件的向量与分块，
+                # 其余分块的向量保持不变，不重新向量化
+                files_to_delete = [file_name for file_name in changed_names
+                                   if file_name in self.uploaded_files and file_name in parsed_names]
+                if files_to_delete:
+                    removed_ids = [doc_id for file_name in files_to_delete for doc_id in self.catalog.chunk_ids(file_name)]
+                    if len(removed_ids) < len(self.vectordb.index_to_docstore_id):
+                        removed = set(removed_ids)
+                        removed_positions = [pos for pos, doc_id in self.vectordb.index_to_docstore_id.items() if doc_id in removed]
+                        await asyncio.to_thread(delete_vectors, self.vectordb, removed_ids, self.index_spec)
+                        self.catalog.remove_ids(removed_ids, removed_positions)
+                        # BM25 按 docstore id 打墓碑，不重新分词
+                        if self.bm25 is not None:
+                            await asyncio.to_thread(self.bm25.delete, removed_ids)
+                    else:
+                        # 旧分块全部被替换：直接使用新建的向量库，BM25 在保存时重建
+                        self.vectordb = None
+                        self.bm25 = None
+                        self.catalog = None
+
+                if new_vectordb is not None:
                     # 如果有新文档，将它们添加到向量数据库
                     if self.vectordb is not None:
-                        # 如果向量数据库存在，添加新文档
-                        logger.info("正在增量向量化并合并索引...")
-                        new_vectordb = await FAISS.afrom_documents(new_documents, self.embeddings)
-                        self.vectordb.merge_from(new_vectordb)
+                        # 如果向量数据库存在，合并新文档的向量
+                        logger.info("正在合并增量索引...")
+                        start_pos = len(self.vectordb.index_to_docstore_id)
+                        await asyncio.to_thread(merge_vectordb, self.vectordb, new_vectordb)
+                        # merge_from 将新向量追加在末尾，按偏移登记到目录
+                        self.catalog.add((start_pos + pos, doc_id, new_vectordb.docstore._dict[doc_id])
+                                         for pos, doc_id in sorted(new_vectordb.index_to_docstore_id.items()))
+                        # BM25 只对新增分块分词并追加到增量段
+                        if self.bm25 is not None:
+                            new_ids = list(new_vectordb.docstore._dict.keys())
+                            await asyncio.to_thread(self.bm25.add_documents,
+                                                    [new_vectordb.docstore._dict[doc_id] for doc_id in new_ids], new_ids)
                     else:
-                        # 如果向量数据库不存在，创建新的
-                        logger.info("正在首次构建向量库...")
-                        self.vectordb = await FAISS.afrom_documents(new_documents, self.embeddings)
-                
-                # 更新已上传文件列表
-                for file in new_files:
-                    self.uploaded_files.add(os.path.basename(file))
-                
-                # 保存向量数据库
+                        self.vectordb = new_vectordb
+                        self.catalog = KBCatalog.from_vectordb(self.vectordb)
+
+                # 已上传文件列表与目录保持一致（未产生分块的新文件不计入）
+                self.uploaded_files.clear()
+                if self.catalog is not None:
+                    self.uploaded_files.update(self.catalog.file_names())
+
+                # 保存向量数据库；知识库确实变空时删除磁盘上的旧索引，避免资源池刷新时重新加载
                 if self.vectordb is not None:
                     await self.save_vectordb(self.vectordb)
-                
-                # 返回处理结果
-                return f"已更新 {len(new_files)} 个文件{new_files_names}到知识库 {self.kb_name} 的向量数据库"
+                else:
+                    await self.clear_vectordb_files()
             except Exception as e:
                 error_msg = f"处理文件时出错: {str(e)}"
                 print(error_msg)
                 raise Exception(error_msg)
-    
+
+        # 登记本次入库文件的哈希与分块 id；未产生分块的新文件（解析失败或内容为空）不登记，
+        # 新版本未产生分块、保留了旧内容的文件沿用旧的登记，下次上传时都会重试
+        for file in new_files:
+            file_name = os.path.basename(file)
+            chunk_ids = self.catalog.chunk_ids(file_name) if self.catalog is not None else []
+            if not chunk_ids:
+                manifest.remove(file_name)
+            elif file_name in parsed_names:
+                manifest.record(file_name, fingerprints[file], chunk_ids)
+        await asyncio.to_thread(manifest.save)
+        result["failed"] = [file_name for file_name in new_files_names if file_name not in parsed_names]
+
+        if self.last_ingest_stats is not None:
+            result["pipeline"] = self.last_ingest_stats
+        if embedding_job is not None:
+            result["embedding_cache"] = embedding_job.stats()
+            logger.info(f"分块向量缓存: {result['embedding_cache']}")
+        if self.vectordb is not None:
+            # 查询仍直接使用 self.embeddings，不经过入库任务的缓存包装
+            self.vectordb.embedding_function = self.embeddings
+
         gc.collect()
         self.clean_gpu_cache()
-        return f"已更新 {len(new_files)} 个文件{new_files_names}到知识库 {self.kb_name} 的向量数据库"
+        return result
     
     async def remove_file(self, file_name):
         """
@@ -421,23 +644,33 @@ class KnowledgeBase:
         Returns:
             dict: 删除结果信息
         """
-        await self.load_vectordb_and_files()
+        await self.load_vectordb_and_files(mmap=False)
         if file_name not in self.uploaded_files:
             return {"message": f"文件 {file_name} 不在知识库 {self.kb_name} 中"}
         
         try:
             print(f"开始删除文件 {file_name}...")
             
-            doc_ids = [doc_id for doc_id, doc in self.vectordb.docstore._dict.items() if os.path.basename(doc.metadata.get('file_path', '')) == file_name]
+            doc_ids = self.catalog.chunk_ids(file_name)
             if doc_ids:
                 print(f"正在从 faiss_index 中删除与文件 {file_name} 相关的向量...")
-                await asyncio.to_thread(self.vectordb.delete, ids=doc_ids)
-                faiss_index_path = os.path.join(self.base_directory, self.kb_name, "faiss_index")
-                await asyncio.to_thread(self.vectordb.save_local, faiss_index_path)
+                removed = set(doc_ids)
+                removed_positions = [pos for pos, doc_id in self.vectordb.index_to_docstore_id.items() if doc_id in removed]
+                # 与 update_vectordb 相同，在 docstore 变化前加载持久化的 BM25 索引（指纹一致，不重新分词），
+                # 删除向量后再按 docstore id 打墓碑
+                bm25 = await self.load_bm25()
+                await asyncio.to_thread(delete_vectors, self.vectordb, doc_ids, self.index_spec)
+                self.catalog.remove_ids(doc_ids, removed_positions)
+                if bm25 is not None:
+                    await asyncio.to_thread(bm25.delete, doc_ids)
+                await self.save_vectordb(self.vectordb)
                 print(f"已从 faiss_index 中删除与文件 {file_name} 相关的向量")
             
             self.uploaded_files.remove(file_name)
             print(f"已从已上传文件集合中移除文件 {file_name}")
+            manifest = await asyncio.to_thread(KBManifest.load, self.kb_dir)
+            manifest.remove(file_name)
+            await asyncio.to_thread(manifest.save)
             
             markdown_file = os.path.join(self.markdown_directory, os.path.splitext(file_name)[0] + ".md")
             if os.path.exists(markdown_file):
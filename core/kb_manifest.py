@@ -0,0 +1,125 @@
+"""
+知识库文件清单：文件名 -> 内容哈希 -> 分块 id
+
+/update_vectordb 每次都会把 uploads/ 下的全部文件交给 update_vectordb。清单记录每个文件
+上次入库时的内容哈希（SHA-256）与对应的 docstore id，入库前按哈希把文件分为新增 / 内容变化 / 未变化，
+只解析、向量化前两类。清单持久化在 <kb_dir>/manifest.json。
+"""
+import os
+import json
+import hashlib
+import logging
+
+logger = logging.getLogger("docqa.kb")
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_FORMAT_VERSION = 1
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    """
+    分块读取文件计算 SHA-256（大文件不整体读入内存）
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class KBManifest:
+    """
+    单个知识库的文件清单
+    """
+
+    def __init__(self, path, files=None):
+        """
+        Args:
+            path (str): manifest.json 路径
+            files (dict): file_name -> {"sha256", "size", "mtime_ns", "chunk_ids"}
+        """
+        self.path = path
+        self.files = files or {}
+
+    @classmethod
+    def load(cls, kb_dir):
+        """
+        读取 <kb_dir>/manifest.json，文件不存在、损坏或版本不符时返回空清单
+        """
+        path = os.path.join(kb_dir, MANIFEST_FILE)
+        if not os.path.exists(path):
+            return cls(path)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"文件清单读取失败，将按未知文件处理: {e}")
+            return cls(path)
+        if data.get("format_version") != MANIFEST_FORMAT_VERSION:
+            return cls(path)
+        return cls(path, data.get("files", {}))
+
+    def save(self):
+        """
+        写出 manifest.json（先写临时文件再原子替换）
+        """
+        tmp_path = f"{self.path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"format_version": MANIFEST_FORMAT_VERSION, "files": self.files}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def fingerprint(self, path):
+        """
+        文件的内容哈希；大小与修改时间都与清单一致时沿用清单中的哈希，不再读取文件
+
+        Returns:
+            tuple: (sha256, size, mtime_ns)
+        """
+        stat = os.stat(path)
+        entry = self.files.get(os.path.basename(path))
+        if entry is not None and entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+            return entry["sha256"], stat.st_size, stat.st_mtime_ns
+        return file_sha256(path), stat.st_size, stat.st_mtime_ns
+
+    def classify(self, fingerprints, known_files=(), fresh_names=None):
+        """
+        按内容哈希把待入库文件分为新增、内容变化、未变化三类
+
+        Args:
+            fingerprints (dict): file_path -> (sha256, size, mtime_ns)
+            known_files (iterable): 已在向量库中的文件名（目录中登记的文件）
+            fresh_names (set): 本次请求刚写入的文件名。清单建立前入库的文件没有哈希记录：
+                               不在该集合中的视为未变化并直接登记当前哈希；为 None 时一律视为内容变化
+
+        Returns:
+            tuple: (新增文件路径列表, 内容变化文件路径列表, 未变化文件路径列表)
+        """
+        known_files = set(known_files)
+        added, changed, unchanged = [], [], []
+        for path, (sha256, size, mtime_ns) in fingerprints.items():
+            file_name = os.path.basename(path)
+            entry = self.files.get(file_name)
+            if file_name not in known_files:
+                added.append(path)
+            elif entry is not None:
+                (unchanged if entry["sha256"] == sha256 else changed).append(path)
+            elif fresh_names is not None and file_name not in fresh_names:
+                unchanged.append(path)
+            else:
+                changed.append(path)
+        return added, changed, unchanged
+
+    def record(self, file_name, fingerprint, chunk_ids):
+        """
+        登记（或覆盖）一个文件的哈希与分块 id
+        """
+        sha256, size, mtime_ns = fingerprint
+        self.files[file_name] = {"sha256": sha256, "size": size, "mtime_ns": mtime_ns, "chunk_ids": list(chunk_ids)}
+
+    def remove(self, file_name):
+        self.files.pop(file_name, None)
+
+    def chunk_ids(self, file_name):
+        entry = self.files.get(file_name)
+        return list(entry["chunk_ids"]) if entry else []
@@ -0,0 +1,325 @@
+import asyncio
+import time
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from core.faiss_index import index_memory_bytes
+
+logger = logging.getLogger("docqa.kb")
+
+
+class RWLock:
+    """
+    协程读写锁：多个问答请求可并发读取同一知识库，更新/删除时独占
+    """
+
+    def __init__(self):
+        self._cond = asyncio.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @property
+    def busy(self):
+        return self._readers > 0 or self._writer or self._waiting_writers > 0
+
+    @asynccontextmanager
+    async def read(self):
+        async with self._cond:
+            # 有写者等待时新读者让行，避免写者饥饿
+            await self._cond.wait_for(lambda: not self._writer and self._waiting_writers == 0)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._readers -= 1
+                self._cond.notify_all()
+
+    @asynccontextmanager
+    async def write(self):
+        async with self._cond:
+            self._waiting_writers += 1
+            try:
+                await self._cond.wait_for(lambda: not self._writer and self._readers == 0)
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class KBState:
+    def __init__(self, kb_name=None):
+        # 当前知识库对象（封装加载/更新向量库等）
+        self.kb = None
+        # FAISS 向量库句柄（为空表示尚未构建或加载失败）
+        self.kb_vectordb = None
+        # 当前选中的知识库名称
+        self.current_kb_name = kb_name
+        # 简易对话历史（用于拼接到提示词或检索改写）
+        self.history = []
+        # 未过滤的上下文集合（历史字段，BM25 已改为从持久化索引加载）
+        self.unfilter_context = []
+        # 基于未过滤上下文的 BM25 检索器
+        self.searcher_from_target_doc = None
+        # 知识库元数据目录（文件/分块统计），用于 O(1) 的策略判断与诊断
+        self.catalog = None
+        # QA 问题索引：问题精确/近似命中时直接作答，跳过检索与重排
+        self.qa_index = None
+        # 重排器句柄（DocumentReranker），重排模型加载失败时为 None
+        self.reranker = None
+        # 读写锁：问答持读锁，更新/删除持写锁
+        self.lock = RWLock()
+        # 已从资源池取出、尚未拿到读写锁的请求数（KBPool.get(pin=True)），大于 0 时不会被淘汰
+        self.pins = 0
+        # 估算的常驻内存（字节），用于资源池的淘汰
+        self.memory_bytes = 0
+        self.last_used = time.time()
+        # 内容版本：加载或刷新时更新，用于使依赖知识库内容的缓存失效
+        self.version = time.time_ns()
+
+
+def estimate_memory(state):
+    """
+    估算一个已加载知识库的常驻内存：FAISS 向量 + 分块文本 + BM25 数组 + QA 问题索引
+
+    Args:
+        state (KBState): 知识库状态
+
+    Returns:
+        int: 字节数（估算值）
+    """
+    total = 0
+    vectordb = state.kb_vectordb
+    if vectordb is not None:
+        # 只读内存映射的索引与分块在页缓存中，可被多个进程共享、由系统回收，不计入预算
+        if not getattr(state.kb, 'vectordb_mmapped', False):
+            total += index_memory_bytes(vectordb.index)
+        if hasattr(vectordb.docstore, 'memory_bytes'):
+            total += vectordb.docstore.memory_bytes()
+        else:
+            # Python 字符串按每字符约 2 字节粗略估算（中文为主）
+            total += sum(len(doc.page_content) * 2 for doc in vectordb.docstore._dict.values())
+    if state.qa_index is not None:
+        total += state.qa_index.memory_bytes()
+    searcher = state.searcher_from_target_doc
+    if searcher is not None:
+        index = searcher.bm25
+        for name in index._ARRAYS:
+            total += int(getattr(index, name).nbytes)
+    return total
+
+
+class KBPool:
+    """
+    多知识库常驻资源池
+
+    同时保留多个已加载的知识库（向量库、BM25、元数据目录、重排器句柄），
+    按 LRU 与内存预算淘汰；每个知识库有独立的读写锁，请求按 kb_name 解析各自的状态，
+    不同知识库的请求可并发处理，也不会在请求进行中被其他请求切换掉知识库。
+    """
+
+    def __init__(self, loader, memory_budget_mb=2048, max_kbs=8, on_change=None):
+        """
+        Args:
+            loader: 协程函数 loader(kb_name) -> KBState，负责加载单个知识库
+            memory_budget_mb (int): 常驻知识库的内存预算（MB）
+            max_kbs (int): 最多常驻的知识库数量
+            on_change: 回调 on_change(kb_name)，知识库内容变化（refresh）或被删除（invalidate）时调用，
+                       用于清理依赖知识库内容的缓存
+        """
+        self._loader = loader
+        self._on_change = on_change
+        self.memory_budget = int(memory_budget_mb) * 1024 * 1024
+        self.max_kbs = max_kbs
+        self._entries = OrderedDict()
+        self._load_locks = {}
+        self._current = None
+
+    async def get(self, kb_name, pin=False):
+        """
+        获取知识库状态；未加载时加载并放入池中
+
+        Args:
+            kb_name (str): 知识库名称
+            pin (bool): 是否钉住该条目，直到调用方通过 locked() 拿到读写锁（或调用 unpin）；
+                        避免在取出与加锁之间被其他请求的加载淘汰
+
+        Returns:
+            KBState: 知识库状态
+        """
+        state = self._entries.get(kb_name)
+        if state is None:
+            lock = self._load_locks.setdefault(kb_name, asyncio.Lock())
+            async with lock:
+                state = self._entries.get(kb_name)
+                if state is None:
+                    start = time.time()
+                    state = await self._loader(kb_name)
+                    state.memory_bytes = estimate_memory(state)
+                    self._entries[kb_name] = state
+                    logger.info(f"KB pool loaded '{kb_name}' in {time.time() - start:.2f}s "
+                                f"(~{state.memory_bytes / 1024 / 1024:.1f} MB)")
+                    self._evict(keep=kb_name)
+        if pin:
+            state.pins += 1
+        self._touch(kb_name, state)
+        return state
+
+    def unpin(self, state):
+        state.pins = max(0, state.pins - 1)
+
+    def pin_releaser(self, state):
+        """
+        只生效一次的解除钉住函数
+
+        流式响应在返回后才开始迭代响应体，客户端提前断开时响应体可能从未执行；
+        把同一个函数交给 locked(unpin=...) 与响应结束的清理路径，无论哪条路径先执行都只解除一次。
+
+        Args:
+            state (KBState): get(pin=True) 取出的知识库状态
+
+        Returns:
+            callable: 无参数的解除函数，重复调用无副作用
+        """
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.unpin(state)
+        return release
+
+    @asynccontextmanager
+    async def locked(self, state, write=False, unpin=None):
+        """
+        对 get(pin=True) 取出的知识库加读锁（write=True 时加写锁），拿到锁后解除钉住；
+        持锁期间 lock.busy 为真，同样不会被淘汰
+
+        Args:
+            unpin (callable): 解除钉住的函数（如 pin_releaser 的返回值），默认直接 unpin(state)
+        """
+        unpin = unpin or (lambda: self.unpin(state))
+        pinned = True
+        try:
+            async with (state.lock.write() if write else state.lock.read()):
+                unpin()
+                pinned = False
+                yield state
+        finally:
+            if pinned:
+                unpin()
+
+    def peek(self, kb_name):
+        return self._entries.get(kb_name)
+
+    def current(self, pin=False):
+        """
+        最近一次被请求的知识库状态（用于未携带 kb_name 的接口）；池为空时返回空状态
+
+        Args:
+            pin (bool): 同 get
+        """
+        state = self._entries.get(self._current) if self._current else None
+        state = state if state is not None else KBState()
+        if pin:
+            state.pins += 1
+        return state
+
+    async def refresh(self, state):
+        """
+        知识库内容变化后（上传/删除文件）刷新池中条目的句柄与内存估算；需在写锁内调用
+
+        Args:
+            state (KBState): 要刷新的知识库状态
+        """
+        kb = state.kb
+        if getattr(kb, 'mmap', False) and kb.vectordb is not None and not kb.vectordb_mmapped:
+            # 写操作在可写的内存副本上完成并已落盘，重新以内存映射方式打开以释放常驻内存
+            kb.vectordb = None
+            kb.bm25 = None
+        state.kb_vectordb = await kb.load_vectordb()
+        if state.kb_vectordb is None:
+            state.searcher_from_target_doc = None
+            state.qa_index = None
+        else:
+            # update_vectordb/remove_file 已增量维护 kb.bm25，直接复用，避免重新加载
+            state.searcher_from_target_doc = kb.bm25 if kb.bm25 is not None else await kb.load_bm25(state.kb_vectordb)
+            # save_vectordb 已重建问题索引，同样直接复用
+            state.qa_index = kb.qa_index if kb.qa_index is not None else await kb.load_qa_index(state.kb_vectordb)
+        state.catalog = kb.catalog if state.kb_vectordb is not None else None
+        state.history = []
+        state.version = time.time_ns()
+        # 内容已变化，清除该知识库的重排得分缓存
+        if state.reranker is not None:
+            state.reranker.clear_cache()
+        if self._on_change is not None:
+            self._on_change(state.current_kb_name)
+        state.memory_bytes = estimate_memory(state)
+        self._touch(state.current_kb_name, state)
+        self._evict(keep=state.current_kb_name)
+
+    def invalidate(self, kb_name):
+        """
+        从池中移除知识库（删除知识库时调用）
+        """
+        state = self._entries.pop(kb_name, None)
+        self._load_locks.pop(kb_name, None)
+        if state is not None:
+            self._release(state)
+        if self._on_change is not None:
+            self._on_change(kb_name)
+        if self._current == kb_name:
+            self._current = None
+
+    @staticmethod
+    def _release(state):
+        """
+        释放移出资源池的知识库：清除重排得分缓存，关闭内存映射与 SQLite 连接（Windows 下被映射的文件无法删除或替换）
+        """
+        if state.reranker is not None:
+            state.reranker.clear_cache()
+        if state.kb is not None:
+            state.kb.release_vectordb()
+        state.kb_vectordb = None
+        state.searcher_from_target_doc = None
+        state.qa_index = None
+
+    def _touch(self, kb_name, state):
+        state.last_used = time.time()
+        if kb_name in self._entries:
+            self._entries.move_to_end(kb_name)
+        self._current = kb_name
+
+    def _evict(self, keep=None):
+        """
+        超出数量或内存预算时按 LRU 淘汰；正在被读写或已被请求取出（钉住）的知识库不淘汰
+        """
+        for kb_name in list(self._entries.keys()):
+            if len(self._entries) <= 1:
+                break
+            if len(self._entries) <= self.max_kbs and self.memory_used() <= self.memory_budget:
+                break
+            state = self._entries[kb_name]
+            if kb_name == keep or state.lock.busy or state.pins:
+                continue
+            del self._entries[kb_name]
+            self._release(state)
+            logger.info(f"KB pool evicted '{kb_name}' (~{state.memory_bytes / 1024 / 1024:.1f} MB)")
+
+    def memory_used(self):
+        return sum(state.memory_bytes for state in self._entries.values())
+
+    def stats(self):
+        return {
+            "loaded": list(self._entries.keys()),
+            "memory_mb": round(self.memory_used() / 1024 / 1024, 1),
+            "memory_budget_mb": round(self.memory_budget / 1024 / 1024, 1),
+            "max_kbs": self.max_kbs,
+        }
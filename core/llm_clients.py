@@ -0,0 +1,162 @@
+"""
+LLM 客户端池：按 (模型, temperature, streaming) 复用 ChatOpenAI，所有客户端共享同一个 httpx 连接池
+
+每次问答都新建 ChatOpenAI 会重新构造 openai 客户端并与 LLM 服务重新握手（TCP/TLS）。
+这里的客户端常驻进程，同步与异步调用各使用一个 httpx 连接池（keep-alive，可选 HTTP/2），
+并通过 httpcore 的 trace 回调统计新建连接与复用次数，供 /stats 查看。
+"""
+import threading
+import logging
+import importlib.util
+from collections import OrderedDict
+import httpx
+from langchain_openai import ChatOpenAI
+
+logger = logging.getLogger("docqa.llm")
+
+
+class LLMClientPool:
+    """
+    ChatOpenAI 客户端工厂
+
+    客户端按 (model, temperature, streaming) 缓存（LRU，temperature 来自请求参数，数量有上限）；
+    同步 / 异步 httpx 客户端在所有 ChatOpenAI 实例之间共享。
+    """
+
+    def __init__(self, api_key, base_url, model, max_connections=100, max_keepalive=20,
+                 keepalive_expiry=60.0, timeout=120.0, connect_timeout=10.0, http2=True, max_clients=32):
+        """
+        Args:
+            api_key (str): LLM 服务密钥
+            base_url (str): LLM 服务地址
+            model (str): 默认模型名
+            max_connections (int): 连接池最大连接数
+            max_keepalive (int): 保持空闲的最大连接数
+            keepalive_expiry (float): 空闲连接保留秒数
+            timeout (float): 读写超时（秒），流式回答时为两个片段之间的最长间隔
+            connect_timeout (float): 建立连接超时（秒）
+            http2 (bool): 是否启用 HTTP/2（需要安装 h2，未安装时回退 HTTP/1.1）
+            max_clients (int): 缓存的 ChatOpenAI 实例上限
+        """
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.max_clients = max_clients
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("h2 未安装，LLM 连接池使用 HTTP/1.1（pip install h2 后启用 HTTP/2）")
+            http2 = False
+        self.http2 = http2
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                                    keepalive_expiry=keepalive_expiry)
+        self._timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._http_client = None
+        self._http_async_client = None
+        self.client_hits = 0
+        self.client_misses = 0
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+
+    # ---- 连接统计（httpcore trace 回调） ----
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def _on_trace(self, event_name):
+        if event_name == "connection.connect_tcp.complete":
+            self._count("new_connections")
+        elif event_name == "connection.start_tls.complete":
+            self._count("tls_handshakes")
+
+    def _trace(self, event_name, info):
+        self._on_trace(event_name)
+
+    async def _atrace(self, event_name, info):
+        self._on_trace(event_name)
+
+    def _on_request(self, request):
+        self._count("requests")
+        request.extensions["trace"] = self._trace
+
+    async def _on_request_async(self, request):
+        self._count("requests")
+        request.extensions["trace"] = self._atrace
+
+    # ---- 共享 httpx 客户端 ----
+
+    def _shared_http_clients(self):
+        # 调用方已持有 self._lock
+        if self._http_client is None:
+            self._http_client = httpx.Client(http2=self.http2, limits=self._limits, timeout=self._timeout,
+                                             event_hooks={"request": [self._on_request]})
+            self._http_async_client = httpx.AsyncClient(http2=self.http2, limits=self._limits, timeout=self._timeout,
+                                                        event_hooks={"request": [self._on_request_async]})
+        return self._http_client, self._http_async_client
+
+    def get(self, temperature, streaming=True, model=None):
+        """
+        获取（或创建）ChatOpenAI 客户端
+
+        Args:
+            temperature (float): 采样温度
+            streaming (bool): 是否流式
+            model (str): 模型名，默认使用构造时的模型
+
+        Returns:
+            ChatOpenAI: 共享连接池的客户端实例
+        """
+        key = (model or self.model, round(float(temperature), 3), bool(streaming))
+        with self._lock:
+            llm = self._clients.get(key)
+            if llm is not None:
+                self._clients.move_to_end(key)
+                self.client_hits += 1
+                return llm
+            http_client, http_async_client = self._shared_http_clients()
+            llm = ChatOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                model=key[0],
+                temperature=key[1],
+                streaming=key[2],
+                http_client=http_client,
+                http_async_client=http_async_client,
+            )
+            self._clients[key] = llm
+            if len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+            self.client_misses += 1
+            return llm
+
+    def stats(self):
+        with self._stats_lock:
+            requests, new_connections, tls_handshakes = self.requests, self.new_connections, self.tls_handshakes
+        reused = max(0, requests - new_connections)
+        return {
+            "clients": len(self._clients),
+            "client_hits": self.client_hits,
+            "client_misses": self.client_misses,
+            "http2": self.http2,
+            "requests": requests,
+            "new_connections": new_connections,
+            "tls_handshakes": tls_handshakes,
+            "reused_connections": reused,
+            "connection_reuse_rate": round(reused / requests, 4) if requests else 0.0,
+        }
+
+    async def aclose(self):
+        """
+        关闭共享连接池（服务停止时调用）
+        """
+        with self._lock:
+            http_client, http_async_client = self._http_client, self._http_async_client
+            self._http_client = self._http_async_client = None
+            self._clients.clear()
+        if http_client is not None:
+            http_client.close()
+            await http_async_client.aclose()
+
@@ -0,0 +1,269 @@
+import os
+import asyncio
+import hashlib
+import logging
+import threading
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger("docqa.models")
+
+# bge 检索查询指令（与 langchain HuggingFaceBgeEmbeddings 的默认值一致）
+BGE_QUERY_INSTRUCTION_EN = "Represent this question for searching relevant passages: "
+BGE_QUERY_INSTRUCTION_ZH = "为这个句子生成表示以用于检索相关文章："
+
+
+def bge_query_instruction(model_name):
+    """
+    按模型名选择查询指令：与 HuggingFaceBgeEmbeddings 相同，名称含 "-zh" 时用中文指令，否则用英文指令
+
+    Args:
+        model_name (str): 模型名或模型目录
+
+    Returns:
+        str: 查询指令
+    """
+    return BGE_QUERY_INSTRUCTION_ZH if "-zh" in model_name else BGE_QUERY_INSTRUCTION_EN
+
+
+class TorchEncoder:
+    """
+    基于 sentence-transformers 的句向量编码器（与 HuggingFaceBgeEmbeddings / HuggingFaceEmbedding 内部使用的模型一致）
+    """
+
+    def __init__(self, model_dir, device="cpu", batch_size=32):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_dir, device=device)
+        self.model_dir = model_dir
+        self.batch_size = batch_size
+        logger.info(f"PyTorch 嵌入模型已加载: {model_dir} ({device})")
+
+    def encode(self, texts, normalize=True):
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self.model.encode(list(texts), batch_size=self.batch_size, normalize_embeddings=normalize,
+                                 convert_to_numpy=True, show_progress_bar=False)
+
+    def memory_bytes(self):
+        return sum(p.numel() * p.element_size() for p in self.model.parameters()) + \
+            sum(b.numel() * b.element_size() for b in self.model.buffers())
+
+
+class EncoderEmbeddings(Embeddings):
+    """
+    LangChain Embeddings 适配器，行为与 HuggingFaceBgeEmbeddings 对齐：
+    文本中的换行替换为空格，查询前加 bge 检索指令，输出按 normalize 做 L2 归一化
+    """
+
+    def __init__(self, encoder, normalize=True, query_instruction=BGE_QUERY_INSTRUCTION_EN):
+        self.encoder = encoder
+        self.normalize = normalize
+        self.query_instruction = query_instruction
+
+    def embed_documents(self, texts):
+        texts = [text.replace("\n", " ") for text in texts]
+        return self.encoder.encode(texts, normalize=self.normalize).tolist()
+
+    def embed_query(self, text):
+        text = text.replace("\n", " ")
+        return self.encoder.encode([self.query_instruction + text], normalize=self.normalize)[0].tolist()
+
+    async def aembed_documents(self, texts):
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text):
+        return await asyncio.to_thread(self.embed_query, text)
+
+
+def make_llamaindex_embedding(encoder, normalize=True, chunk_job=None):
+    """
+    构造 LlamaIndex BaseEmbedding 适配器（与 HuggingFaceEmbedding(normalize=True) 一致，不加查询指令）
+
+    llama_index 为可选依赖，仅在调用本函数时导入。
+
+    Args:
+        encoder: TorchEncoder / OnnxEncoder 实例（任何提供 encode(texts, normalize) 的编码器）
+        normalize (bool): 是否做 L2 归一化
+        chunk_job (ChunkEmbeddingJob): 构建索引时批量编码节点文本先查分块向量缓存，为空时直接编码
+
+    Returns:
+        llama_index.core.base.embeddings.base.BaseEmbedding 的实例
+    """
+    from llama_index.core.base.embeddings.base import BaseEmbedding
+    from pydantic import PrivateAttr
+
+    class _LlamaIndexEmbedding(BaseEmbedding):
+        _encoder = PrivateAttr()
+        _normalize = PrivateAttr()
+        _chunk_job = PrivateAttr()
+
+        def __init__(self, encoder, normalize=True, chunk_job=None, **kwargs):
+            super().__init__(model_name=getattr(encoder, "model_dir", "encoder"), **kwargs)
+            self._encoder = encoder
+            self._normalize = normalize
+            self._chunk_job = chunk_job
+
+        @classmethod
+        def class_name(cls):
+            return "DocQAEncoderEmbedding"
+
+        def _get_query_embedding(self, query):
+            return self._encoder.encode([query], normalize=self._normalize)[0].tolist()
+
+        def _get_text_embedding(self, text):
+            return self._encoder.encode([text], normalize=self._normalize)[0].tolist()
+
+        def _encode_texts(self, texts):
+            return self._encoder.encode(list(texts), normalize=self._normalize).tolist()
+
+        def _get_text_embeddings(self, texts):
+            if self._chunk_job is not None:
+                return self._chunk_job.embed(list(texts), self._encode_texts)
+            return self._encode_texts(texts)
+
+        async def _aget_query_embedding(self, query):
+            return await asyncio.to_thread(self._get_query_embedding, query)
+
+        async def _aget_text_embedding(self, text):
+            return await asyncio.to_thread(self._get_text_embedding, text)
+
+    return _LlamaIndexEmbedding(encoder, normalize=normalize, chunk_job=chunk_job)
+
+
+def _process_rss_bytes():
+    # 仅 Linux 可用；其他平台返回 None
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class ModelRegistry:
+    """
+    进程内嵌入模型注册表：同一 (后端, 模型目录) 只加载一份权重，
+    FAISS 检索（LangChain）与 Excel 索引（LlamaIndex）拿到的是同一编码器上的不同适配器。
+    """
+
+    def __init__(self):
+        self._encoders = {}
+        self._adapters = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _key(model_dir, settings):
+        backend = settings.get("embedding_backend", "torch")
+        if backend == "onnx":
+            backend = "onnx-int8" if settings.get("onnx_int8", True) else "onnx"
+        return backend, os.path.normcase(os.path.abspath(model_dir))
+
+    def get_encoder(self, model_dir, settings, onnx_dir=None):
+        """
+        获取（必要时加载）共享编码器
+
+        Args:
+            model_dir (str): 嵌入模型目录
+            settings (dict): config.yaml 中的 settings（embedding_backend / device / onnx_* 等）
+            onnx_dir (str): ONNX 模型目录，embedding_backend 为 onnx 时使用
+
+        Returns:
+            TorchEncoder 或 OnnxEncoder
+        """
+        key = self._key(model_dir, settings)
+        with self._lock:
+            encoder = self._encoders.get(key)
+            if encoder is not None:
+                return encoder
+            if key[0].startswith("onnx"):
+                try:
+                    from core.onnx_models import OnnxEncoder
+                    encoder = OnnxEncoder(
+                        model_dir,
+                        onnx_dir=onnx_dir or "./model/onnx/bge-large-zh-v1.5",
+                        int8=settings.get("onnx_int8", True),
+                        intra_op_threads=settings.get("onnx_intra_op_threads", 0),
+                    )
+                except Exception as e:
+                    logger.warning(f"ONNX 嵌入模型加载失败，回退到 PyTorch: {e}")
+                    # 回退结果也记在 onnx 键下，避免每次调用都重试导出
+                    encoder = self.get_encoder(model_dir, {**settings, "embedding_backend": "torch"})
+            else:
+                encoder = TorchEncoder(model_dir, device=settings.get("device", "cpu"),
+                                       batch_size=int(settings.get("batch_size", 32)))
+            self._encoders[key] = encoder
+            return encoder
+
+    def langchain_embeddings(self, model_dir, settings, onnx_dir=None):
+        """
+        共享编码器上的 LangChain Embeddings（FAISS 用），查询指令按模型名选择（见 bge_query_instruction）
+        """
+        encoder = self.get_encoder(model_dir, settings, onnx_dir)
+        self._count_adapter("langchain")
+        return EncoderEmbeddings(encoder, normalize=settings.get("normalize_embeddings", True),
+                                 query_instruction=bge_query_instruction(model_dir))
+
+    def llamaindex_embedding(self, model_dir, settings, onnx_dir=None, chunk_job=None):
+        """
+        共享编码器上的 LlamaIndex 嵌入模型（Excel ChromaDB 索引用）
+        """
+        encoder = self.get_encoder(model_dir, settings, onnx_dir)
+        self._count_adapter("llamaindex")
+        return make_llamaindex_embedding(encoder, normalize=True, chunk_job=chunk_job)
+
+    def fingerprint(self, model_dir, settings, onnx_dir=None, normalize=True):
+        """
+        模型指纹：实际加载的后端（ONNX 加载失败回退 PyTorch 时按 PyTorch 计）、ONNX 文件、
+        模型目录中权重与配置文件的大小和修改时间，以及是否归一化。用作分块向量缓存的键前缀，
+        替换模型文件或切换后端后旧向量不会被命中。
+
+        Returns:
+            str: 16 位十六进制指纹
+        """
+        encoder = self.get_encoder(model_dir, settings, onnx_dir)
+        parts = [type(encoder).__name__, getattr(encoder, "onnx_file", ""), str(bool(normalize)),
+                 os.path.normcase(os.path.abspath(model_dir))]
+        weight_files = [getattr(encoder, "onnx_file", None)]
+        if os.path.isdir(model_dir):
+            weight_files += [os.path.join(model_dir, name) for name in sorted(os.listdir(model_dir))
+                             if name.endswith((".bin", ".safetensors", ".json", ".txt"))]
+        for path in weight_files:
+            if path and os.path.isfile(path):
+                stat = os.stat(path)
+                parts.append(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}")
+        return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+    def _count_adapter(self, kind):
+        with self._lock:
+            self._adapters[kind] = self._adapters.get(kind, 0) + 1
+
+    def _unique_encoders(self):
+        # ONNX 回退到 PyTorch 时两个键指向同一实例，按对象去重
+        unique = {}
+        for key, encoder in self._encoders.items():
+            unique.setdefault(id(encoder), (key, encoder))
+        return list(unique.values())
+
+    def memory_used(self):
+        with self._lock:
+            return sum(encoder.memory_bytes() for _, encoder in self._unique_encoders())
+
+    def stats(self):
+        rss = _process_rss_bytes()
+        with self._lock:
+            encoders = [{
+                "backend": type(encoder).__name__,
+                "model_dir": model_dir,
+                "weights_mb": round(encoder.memory_bytes() / 1024 / 1024, 1),
+            } for (_, model_dir), encoder in self._unique_encoders()]
+            adapters = dict(self._adapters)
+        return {
+            "encoders": encoders,
+            "loaded_copies": len(encoders),
+            "adapters": adapters,
+            "weights_mb": round(sum(e["weights_mb"] for e in encoders), 1),
+            "process_rss_mb": round(rss / 1024 / 1024, 1) if rss is not None else None,
+        }
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,222 @@
+"""
+文档解析进程池
+
+CPU 密集的解析器（pdfplumber 抽取、deepdoc PPT 分块、HTML/Word 解析等）在进程池中执行，不占用事件循环，
+可按 system.max_workers 横向扩展；每个文件有超时与内存上限，单个文件卡死或内存失控不会拖垮整个上传。
+IO 密集的解析器（OCR HTTP、LlamaParse）作为并发的 asyncio 任务执行。
+"""
+import os
+import time
+import signal
+import asyncio
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger("docqa.kb")
+
+# 工作进程内的超时（SIGALRM）未能及时生效时（阻塞在 C 扩展中），主进程多等这么久后终止工作进程
+_TIMEOUT_GRACE_SECS = 10
+
+
+class ParseTimeoutError(TimeoutError):
+    pass
+
+
+def _on_alarm(signum, frame):
+    raise ParseTimeoutError("解析超时")
+
+
+def _limit_memory(memory_mb):
+    """
+    把工作进程的地址空间上限设为当前用量 + memory_mb（工作进程由主进程 fork 而来，
+    继承的映射不计入本文件的额度），返回原来的限制以便恢复
+    """
+    if resource is None or not memory_mb:
+        return None
+    try:
+        with open("/proc/self/statm", "r") as f:
+            current = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = current + int(memory_mb) * 1024 * 1024
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    return soft, hard
+
+
+def _run_in_worker(func, args, timeout, memory_mb):
+    """
+    在工作进程中执行解析函数（带超时与内存上限），返回 (结果, 耗时秒数)
+    """
+    use_alarm = hasattr(signal, "SIGALRM") and timeout
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_alarm)
+        signal.alarm(int(timeout))
+    previous_limit = _limit_memory(memory_mb)
+    start = time.perf_counter()
+    try:
+        return func(*args), time.perf_counter() - start
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+        if previous_limit is not None:
+            resource.setrlimit(resource.RLIMIT_AS, previous_limit)
+
+
+class ParsePool:
+    """
+    进程内共享的解析执行器：CPU 任务走进程池，IO 任务走协程并发
+    """
+
+    def __init__(self, max_workers=4, timeout=600, memory_mb=4096, io_concurrency=8):
+        """
+        Args:
+            max_workers (int): 解析进程数
+            timeout (float): 单个文件的解析超时（秒），0 表示不限
+            memory_mb (int): 单个文件解析可额外占用的内存（MB，地址空间），0 表示不限；仅 Linux/Unix 生效
+            io_concurrency (int): 同时进行的 IO 型解析（OCR、LlamaParse）数量
+        """
+        self.max_workers = max(1, int(max_workers))
+        self.timeout = timeout or None
+        self.memory_mb = memory_mb
+        self.io_concurrency = max(1, int(io_concurrency))
+        self._executor = None
+        self._lock = threading.Lock()
+        # 信号量在首次使用时创建，绑定到服务的事件循环
+        self._cpu_slots = None
+        self._io_slots = None
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.restarts = 0
+        self.cpu_seconds = 0.0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def _discard(self, executor):
+        """
+        终止并丢弃进程池（工作进程卡死或异常退出后调用）；共享进程池在下次提交时重新创建
+        """
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self.restarts += 1
+        processes = list((getattr(executor, "_processes", None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    def _slots(self):
+        if self._cpu_slots is None:
+            self._cpu_slots = asyncio.Semaphore(self.max_workers)
+            self._io_slots = asyncio.Semaphore(self.io_concurrency)
+        return self._cpu_slots, self._io_slots
+
+    async def run_cpu(self, func, *args):
+        """
+        在进程池中执行 CPU 型解析函数
+
+        Args:
+            func: 模块级函数（需可被 pickle）
+            *args: 参数
+
+        Returns:
+            func 的返回值
+        """
+        cpu_slots, _ = self._slots()
+        # 占用一个进程槽位后再提交，超时只计算实际解析时间，不含排队
+        async with cpu_slots:
+            try:
+                result, seconds = await self._run_once(self._get_executor(), func, args)
+            except BrokenProcessPool:
+                # 工作进程异常退出（段错误、被 OOM killer 结束等）时，同一进程池中正在解析的文件都会失败：
+                # 各自在独立的单进程池中重试一次，真正出问题的文件不会再连累其他文件
+                logger.warning(f"解析进程异常退出，单独重试: {args[0] if args else func.__name__}")
+                isolated = ProcessPoolExecutor(max_workers=1)
+                try:
+                    result, seconds = await self._run_once(isolated, func, args)
+                except BrokenProcessPool:
+                    self.failed += 1
+                    raise
+                finally:
+                    isolated.shutdown(wait=False, cancel_futures=True)
+            self.completed += 1
+            self.cpu_seconds += seconds
+            return result
+
+    async def _run_once(self, executor, func, args):
+        future = executor.submit(_run_in_worker, func, args, self.timeout, self.memory_mb)
+        wait = self.timeout + _TIMEOUT_GRACE_SECS if self.timeout else None
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), wait)
+        except ParseTimeoutError:
+            # 工作进程内的 SIGALRM 超时，进程本身可继续使用（需先于 asyncio.TimeoutError 捕获，二者在 3.11+ 同属 TimeoutError）
+            self.timeouts += 1
+            self.failed += 1
+            raise
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.failed += 1
+            self._discard(executor)
+            raise ParseTimeoutError(f"解析超过 {self.timeout} 秒，已终止工作进程")
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+        except BaseException:
+            self.failed += 1
+            raise
+
+    async def run_io(self, func, *args):
+        """
+        以协程并发执行 IO 型解析函数（协程函数直接等待，普通函数放到线程中）
+        """
+        _, io_slots = self._slots()
+        async with io_slots:
+            if asyncio.iscoroutinefunction(func):
+                call = func(*args)
+            else:
+                call = asyncio.to_thread(func, *args)
+            try:
+                result = await asyncio.wait_for(call, self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                self.failed += 1
+                raise ParseTimeoutError(f"解析超过 {self.timeout} 秒")
+            except BaseException:
+                self.failed += 1
+                raise
+            self.completed += 1
+            return result
+
+    def stats(self):
+        return {
+            "max_workers": self.max_workers,
+            "io_concurrency": self.io_concurrency,
+            "timeout_secs": self.timeout,
+            "memory_mb": self.memory_mb,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "restarts": self.restarts,
+            "cpu_seconds": round(self.cpu_seconds, 2),
+        }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
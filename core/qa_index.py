@@ -0,0 +1,188 @@
+"""
+问题索引：QA 格式 Markdown（process_md_file 按 #### 切分、isQA=1 的分块）的问题 -> 答案
+
+保存知识库时由 docstore 中的 QA 分块重建并写入 <kb_dir>/qa_index.json。
+问答时先查本索引：归一化后的问题完全一致（哈希表）时直接使用库中的答案，不再走向量检索、BM25 与重排；
+MinHash-LSH 找到的候选与问题的字符二元组 Jaccard 相似度达到阈值、且数字与实体词完全一致时为近似重复，
+由调用方用重排模型确认后才直接作答（见 engine._qa_fast_path）。
+"""
+import os
+import re
+import json
+import hashlib
+import logging
+import numpy as np
+from core.reranker import normalize_query
+
+logger = logging.getLogger("docqa.kb")
+
+QA_INDEX_FILE = "qa_index.json"
+QA_INDEX_FORMAT_VERSION = 1
+# MinHash 签名 30 个哈希，分成 10 段、每段 3 个：Jaccard 0.8 的问题成为候选的概率约 0.999，
+# 0.6 约 0.91，互不相关的问题（约 0.05）约 0.001
+_NUM_HASHES = 30
+_ROWS = 3
+_HASH_A = np.random.default_rng(20240601).integers(1, 2 ** 63, size=_NUM_HASHES, dtype=np.uint64) | np.uint64(1)
+_HASH_B = np.random.default_rng(20240602).integers(0, 2 ** 63, size=_NUM_HASHES, dtype=np.uint64)
+# 否定词：“可以报销吗”与“不可以报销吗”的二元组相似度仍有 0.8，否定词不一致时不视为近似重复
+_NEGATIONS = frozenset("不没无非未别否")
+# 数字（含中文数字）与英文/型号词：“2024年度…”与“2023年度…”的二元组相似度可达 0.84，
+# 这类词不一致的问题答案通常不同，不视为近似重复
+_KEY_TOKEN = re.compile(r"[0-9]+|[零〇一二三四五六七八九十百千万亿两]+|[a-z]+")
+
+
+def normalize_question(text):
+    """
+    问题归一化：NFKC、小写，去掉空白与标点（“怎么办？”与“怎么办”视为同一问题）
+    """
+    return re.sub(r"[\W_]+", "", normalize_query(text))
+
+
+def key_tokens(normalized):
+    """
+    归一化问题中的数字与实体词（按出现顺序）
+    """
+    return tuple(_KEY_TOKEN.findall(normalized))
+
+
+def _shingles(normalized):
+    if len(normalized) < 2:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + 2] for i in range(len(normalized) - 1)}
+
+
+def minhash(shingles):
+    """
+    字符二元组集合的 MinHash 签名（multiply-shift 哈希族，uint64 运算自然取模 2^64）
+    """
+    base = np.fromiter((int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+                        for s in shingles), dtype=np.uint64, count=len(shingles))
+    with np.errstate(over="ignore"):
+        return ((base[:, None] * _HASH_A + _HASH_B) >> np.uint64(32)).min(axis=0)
+
+
+def _bands(signature):
+    return [(band, signature[band * _ROWS:(band + 1) * _ROWS].tobytes()) for band in range(_NUM_HASHES // _ROWS)]
+
+
+class QAIndex:
+    """
+    单个知识库的问题索引（精确匹配 + MinHash-LSH 近似重复）
+    """
+
+    def __init__(self, entries=None, min_similarity=0.8):
+        """
+        Args:
+            entries (list): [{"doc_id", "question", "page_content", "metadata"}]
+            min_similarity (float): 近似重复的字符二元组 Jaccard 相似度下限，大于 1 时只做精确匹配
+        """
+        self.entries = []
+        self.min_similarity = min_similarity
+        self._exact = {}
+        self._bands = {}
+        self._shingles = []
+        self._negations = []
+        self._key_tokens = []
+        for entry in entries or []:
+            self._add(entry)
+
+    def _add(self, entry):
+        key = normalize_question(entry["question"])
+        if not key:
+            return
+        idx = len(self.entries)
+        self.entries.append(entry)
+        # 同一问题出现在多个文件中时以后上传的为准
+        self._exact[key] = idx
+        shingles = _shingles(key)
+        self._shingles.append(shingles)
+        self._negations.append(_NEGATIONS.intersection(key))
+        self._key_tokens.append(key_tokens(key))
+        for band in _bands(minhash(shingles)):
+            self._bands.setdefault(band, []).append(idx)
+
+    @classmethod
+    def from_documents(cls, items, **kwargs):
+        """
+        由 docstore 的 (docstore id, Document) 构建，只收录 isQA 分块（第一行为问题）
+
+        Args:
+            items (iterable): (docstore id, Document)，按插入顺序
+        """
+        entries = []
+        for doc_id, doc in items:
+            if not doc.metadata.get("isQA"):
+                continue
+            question = doc.page_content.split("\n", 1)[0].strip()
+            if question:
+                entries.append({"doc_id": doc_id, "question": question,
+                                "page_content": doc.page_content, "metadata": dict(doc.metadata)})
+        return cls(entries, **kwargs)
+
+    def lookup(self, query):
+        """
+        查找与问题精确或近似一致的 QA 条目
+
+        近似一致要求否定词、数字与实体词完全相同；"near" 结果只是候选，调用方需经重排确认后才可直接作答
+
+        Returns:
+            tuple: (entry, "exact" | "near", 相似度) 或 None
+        """
+        key = normalize_question(query)
+        if not key or not self.entries:
+            return None
+        idx = self._exact.get(key)
+        if idx is not None:
+            return self.entries[idx], "exact", 1.0
+        if self.min_similarity > 1:
+            return None
+        shingles = _shingles(key)
+        negations = _NEGATIONS.intersection(key)
+        tokens = key_tokens(key)
+        best, best_sim = None, self.min_similarity
+        candidates = {idx for band in _bands(minhash(shingles)) for idx in self._bands.get(band, ())}
+        for idx in candidates:
+            if self._negations[idx] != negations or self._key_tokens[idx] != tokens:
+                continue
+            other = self._shingles[idx]
+            sim = len(shingles & other) / len(shingles | other)
+            if sim >= best_sim:
+                best, best_sim = idx, sim
+        return (self.entries[best], "near", best_sim) if best is not None else None
+
+    def doc_ids(self):
+        return [entry["doc_id"] for entry in self.entries]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def memory_bytes(self):
+        # 按每字符约 2 字节粗略估算（中文为主），另加每条约 200 字节的哈希与集合开销
+        return sum(len(entry["page_content"]) * 2 + 200 for entry in self.entries)
+
+    def save(self, path):
+        """
+        写出 qa_index.json（先写临时文件再原子替换）
+        """
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"format_version": QA_INDEX_FORMAT_VERSION, "entries": self.entries}, f,
+                      ensure_ascii=False, default=str)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """
+        读取 qa_index.json，文件不存在或版本不符时返回 None
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"问题索引读取失败，将重新构建: {e}")
+            return None
+        if data.get("format_version") != QA_INDEX_FORMAT_VERSION:
+            return None
+        return cls(data.get("entries", []), **kwargs)
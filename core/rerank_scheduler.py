@@ -0,0 +1,177 @@
+import math
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger("docqa.rerank")
+
+
+class RerankDeadlineExceeded(TimeoutError):
+    """
+    请求在截止时间内未能得到重排结果
+    """
+
+
+class _Pending:
+    __slots__ = ("pairs", "future", "deadline")
+
+    def __init__(self, pairs, deadline):
+        self.pairs = pairs
+        self.future = Future()
+        self.deadline = deadline
+
+
+class RerankScheduler:
+    """
+    跨请求动态批处理的重排调度器
+
+    包装 FlagReranker，对外提供相同的 compute_score 接口。并发请求提交的 (查询, 文档) 对
+    先进入队列，后台线程最多等待 max_wait_ms 或凑满 max_batch 对后，把它们按长度排序
+    合成一个批次送入模型（长度相近的文本放在一起，减少 padding），再把得分分发回各请求。
+    CPU 上可把多次小批量调用的固定开销合并为一次，提高矩阵运算利用率。
+    设置了截止时间时，后台线程按实测的每对耗时估算批次完成时间，已超时或注定赶不上截止时间的请求
+    不再送入模型，直接以 RerankDeadlineExceeded 结束。
+    """
+
+    def __init__(self, model, max_wait_ms=5, max_batch=64, deadline_ms=0):
+        """
+        Args:
+            model: 重排模型（需提供 compute_score(sentence_pairs, normalize=..., batch_size=...)）
+            max_wait_ms (float): 收到第一个请求后最多等待多少毫秒以凑批
+            max_batch (int): 单个批次最多包含的文档对数量
+            deadline_ms (float): 单个请求从提交到拿到结果的最长等待时间，超时抛出 RerankDeadlineExceeded；
+                                 0 表示不设上限
+        """
+        self.model = model
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch = max(1, int(max_batch))
+        self.deadline = deadline_ms / 1000.0 if deadline_ms and deadline_ms > 0 else None
+        # 每个文档对的实测打分耗时（秒，指数滑动平均），用于估算批次完成时间
+        self.pair_seconds = None
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.pairs = 0
+        self.requests = 0
+        self.expired = 0
+        self._worker = threading.Thread(target=self._run, name="rerank-scheduler", daemon=True)
+        self._worker.start()
+
+    def compute_score(self, sentence_pairs, normalize=True, **kwargs):
+        """
+        与 FlagReranker.compute_score 相同的调用方式；在调用线程中阻塞等待批处理结果
+
+        Args:
+            sentence_pairs (list): (查询, 文档) 对列表
+            normalize (bool): 是否对得分做 sigmoid 归一化（调度器内统一按 normalize=True 计算）
+
+        Returns:
+            list: 与 sentence_pairs 对应的得分
+        """
+        pairs = [tuple(pair) for pair in sentence_pairs]
+        if not pairs:
+            return []
+        if not normalize:
+            # 批次内统一使用归一化得分；需要原始 logits 时直接调用模型
+            return self.model.compute_score(pairs, normalize=False, **kwargs)
+        pending = _Pending(pairs, time.monotonic() + self.deadline if self.deadline else math.inf)
+        self._queue.put(pending)
+        try:
+            return pending.future.result(timeout=self.deadline)
+        except FutureTimeoutError as e:
+            pending.future.cancel()
+            raise RerankDeadlineExceeded(f"rerank not finished within {self.deadline * 1000:.0f}ms") from e
+
+    def _collect(self):
+        """
+        取出一个批次：阻塞等待第一个请求，随后在 max_wait 内继续收集，直到凑满 max_batch
+        """
+        batch = [self._queue.get()]
+        size = len(batch[0].pairs)
+        flush_at = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            remaining = flush_at - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(pending)
+            size += len(pending.pairs)
+        return batch
+
+    def _expire(self, pending):
+        # 不再计算的请求：调用方仍在等待时立即以超时结束，不必等到截止时间
+        with self._stats_lock:
+            self.expired += 1
+        if pending.future.set_running_or_notify_cancel():
+            pending.future.set_exception(RerankDeadlineExceeded("rerank deadline cannot be met"))
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            now = time.monotonic()
+            # 已超时或已被调用方放弃的请求不再计算
+            live = []
+            for pending in batch:
+                if pending.future.cancelled() or now >= pending.deadline:
+                    self._expire(pending)
+                else:
+                    live.append(pending)
+            if self.pair_seconds is not None:
+                # 按实测耗时估算本批完成时间，注定超时的请求同样不送入模型
+                finish = now + self.pair_seconds * sum(len(pending.pairs) for pending in live)
+                for pending in [pending for pending in live if pending.deadline < finish]:
+                    live.remove(pending)
+                    self._expire(pending)
+            live = [pending for pending in live if pending.future.set_running_or_notify_cancel()]
+            if not live:
+                continue
+            try:
+                self._score(live)
+            except Exception as e:
+                logger.exception(f"重排批处理失败: {e}")
+                for pending in live:
+                    if not pending.future.done():
+                        pending.future.set_exception(e)
+
+    def _score(self, live):
+        flat = [pair for pending in live for pair in pending.pairs]
+        # 按文本长度排序组批，模型内部按 batch_size 切分时每段的 padding 最少
+        order = sorted(range(len(flat)), key=lambda i: len(flat[i][0]) + len(flat[i][1]), reverse=True)
+        start = time.monotonic()
+        scores = self.model.compute_score([flat[i] for i in order], normalize=True, batch_size=self.max_batch)
+        elapsed = (time.monotonic() - start) / len(flat)
+        self.pair_seconds = elapsed if self.pair_seconds is None else 0.8 * self.pair_seconds + 0.2 * elapsed
+        if not isinstance(scores, (list, tuple)):
+            scores = scores.tolist() if hasattr(scores, "tolist") else [scores]
+        if not isinstance(scores, (list, tuple)):
+            scores = [scores]
+        restored = [0.0] * len(flat)
+        for rank, i in enumerate(order):
+            restored[i] = float(scores[rank])
+        offset = 0
+        for pending in live:
+            n = len(pending.pairs)
+            pending.future.set_result(restored[offset:offset + n])
+            offset += n
+        with self._stats_lock:
+            self.batches += 1
+            self.pairs += len(flat)
+            self.requests += len(live)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "batches": self.batches,
+                "requests": self.requests,
+                "pairs": self.pairs,
+                "expired": self.expired,
+                "deadline_ms": round(self.deadline * 1000) if self.deadline else 0,
+                "ms_per_pair": round(self.pair_seconds * 1000, 2) if self.pair_seconds is not None else None,
+                "avg_pairs_per_batch": round(self.pairs / self.batches, 2) if self.batches else 0.0,
+                "queued": self._queue.qsize(),
+            }
@@ -1,7 +1,106 @@
 from typing import List, Tuple
+from collections import OrderedDict
+import hashlib
+import logging
+import re
+import threading
+import unicodedata
 from langchain_core.documents import Document
 import numpy as np
 
+logger = logging.getLogger("docqa.rerank")
+
+
+def normalize_query(query: str) -> str:
+    """
+    归一化查询语句，使仅在大小写、全半角或空白上不同的问题命中同一缓存项
+    """
+    text = unicodedata.normalize("NFKC", str(query)).lower()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class RerankScoreCache:
+    """
+    重排得分 LRU 缓存
+
+    键为 (知识库名, 归一化查询, 分块内容哈希)，值为重排模型给出的归一化得分。
+    重复/近似重复的问题，以及流式问答与 /final_response 对同一查询的两次检索，
+    都可以直接复用得分而不必再次运行交叉编码器。
+    """
+
+    def __init__(self, max_size=20000):
+        """
+        Args:
+            max_size (int): 最多缓存的 (查询, 分块) 得分条数
+        """
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys):
+        """
+        批量查询缓存
+
+        Args:
+            keys (list): 缓存键列表
+
+        Returns:
+            list: 与 keys 对应的得分，未命中为 None
+        """
+        results = []
+        with self._lock:
+            for key in keys:
+                score = self._entries.get(key)
+                if score is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                results.append(score)
+        return results
+
+    def put_many(self, items):
+        """
+        批量写入缓存
+
+        Args:
+            items (iterable): (缓存键, 得分) 二元组
+        """
+        with self._lock:
+            for key, score in items:
+                self._entries[key] = score
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, kb_name):
+        """
+        清除某个知识库的全部缓存项（知识库内容变化或被删除时调用）
+        """
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == kb_name]
+            for key in stale:
+                del self._entries[key]
+        if stale:
+            logger.info(f"Rerank cache invalidated {len(stale)} entries for KB '{kb_name}'")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
 class DocumentReranker:
     """
     文档重排序器类，使用重排模型对文档进行重新排序
@@ -10,14 +109,74 @@ class DocumentReranker:
     以提高最终排序结果的相关性。重排模型通常比简单的向量相似度计算更准确。
     """
     
-    def __init__(self, reranker_model):
+    def __init__(self, reranker_model, cache=None, kb_name=None):
         """
         初始化DocumentReranker。
 
         参数:
             reranker_model: 重排模型的实例。
+            cache (RerankScoreCache): 可选的得分缓存，命中的 (查询, 分块) 不再送入模型。
+            kb_name (str): 所属知识库名称，作为缓存键的一部分。
         """
         self.reranker = reranker_model
+        self.cache = cache
+        self.kb_name = kb_name
+
+    def clear_cache(self):
+        """
+        清除本知识库的得分缓存
+        """
+        if self.cache is not None:
+            self.cache.invalidate(self.kb_name)
+
+    def compute_scores(self, check_item: str, documents: List[Document]) -> List[float]:
+        """
+        计算查询与各文档的重排得分；启用缓存时仅把未命中的文档作为一个批次送入模型。
+
+        参数:
+            check_item (str): 查询语句或检查项。
+            documents (List[Document]): Document对象列表。
+
+        返回:
+            List[float]: 与 documents 一一对应的得分。
+        """
+        if self.cache is None:
+            return self._model_scores([(check_item, doc.page_content) for doc in documents])
+
+        query_key = normalize_query(check_item)
+        keys = [(self.kb_name, query_key, content_hash(doc.page_content)) for doc in documents]
+        scores = self.cache.get_many(keys)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            fresh = self._model_scores([(check_item, documents[i].page_content) for i in missing])
+            for i, score in zip(missing, fresh):
+                scores[i] = score
+            self.cache.put_many((keys[i], scores[i]) for i in missing)
+        logger.debug(f"重排缓存: 命中 {len(documents) - len(missing)}/{len(documents)}")
+        return scores
+
+    def _model_scores(self, sentence_pairs) -> List[float]:
+        """
+        使用重排模型计算 (查询, 文档) 对的得分，并统一为 float 列表
+        """
+        if not sentence_pairs:
+            return []
+        scores = self.reranker.compute_score(sentence_pairs, normalize=True)
+
+        # 调试：记录输出信息
+        logger.debug(f"重排得分原始值: {scores}")
+
+        # 确保 scores 是一个列表
+        if isinstance(scores, (float, np.floating)):
+            scores = [scores]
+        elif isinstance(scores, np.ndarray):
+            scores = scores.tolist()
+        scores = [float(score) for score in scores]
+
+        # 确保 scores 的长度与 sentence_pairs 相同
+        if len(scores) != len(sentence_pairs):
+            raise ValueError(f"Scores length ({len(scores)}) does not match documents length ({len(sentence_pairs)})")
+        return scores
 
     def rerank_documents(self, check_item: str, documents: List[Document], top_n: int = 1) -> List[Tuple[Document, float]]:
         """
@@ -37,34 +196,17 @@ class DocumentReranker:
         返回:
             List[Tuple[Document, float]]: 得分最高的前N个Document对象及其分数的列表。
         """
-        # 构造查询-文档对，用于重排模型计算相似度
-        sentence_pairs = [(check_item, doc.page_content) for doc in documents]
-        
         # 调试：记录输入信息
-        import logging
-        logger = logging.getLogger(__name__)
         logger.debug(f"重排查询: {check_item}")
         logger.debug(f"重排文档数量: {len(documents)}")
-        for i, (query, content) in enumerate(sentence_pairs[:2]):
-            logger.debug(f"重排对 {i}: query_len={len(query)}, content_len={len(content)}, content_preview={content[:100]}")
-        
-        # 使用重排模型计算相似度得分
-        scores = self.reranker.compute_score(sentence_pairs, normalize=True)
-        
-        # 调试：记录输出信息
-        logger.debug(f"重排得分原始值: {scores}")
-        if isinstance(scores, (list, np.ndarray)):
-            logger.debug(f"重排得分范围: min={min(scores) if len(scores) > 0 else 'N/A'}, max={max(scores) if len(scores) > 0 else 'N/A'}")
-        
-        # 确保 scores 是一个列表
-        if isinstance(scores, (float, np.float64)):
-            scores = [scores]
-        elif isinstance(scores, np.ndarray):
-            scores = scores.tolist()
-        
-        # 确保 scores 的长度与 documents 相同
-        if len(scores) != len(documents):
-            raise ValueError(f"Scores length ({len(scores)}) does not match documents length ({len(documents)})")
+        for i, doc in enumerate(documents[:2]):
+            content = doc.page_content
+            logger.debug(f"重排对 {i}: query_len={len(check_item)}, content_len={len(content)}, content_preview={content[:100]}")
+
+        # 使用重排模型计算相似度得分（命中缓存的文档对直接复用）
+        scores = self.compute_scores(check_item, documents)
+        if scores:
+            logger.debug(f"重排得分范围: min={min(scores)}, max={max(scores)}")
         
         # 将文档和得分组合成元组列表
         documents_with_scores = list(zip(documents, scores))
@@ -74,4 +216,4 @@ class DocumentReranker:
         # 返回前N个结果
         top_documents_with_scores = sorted_documents_with_scores[:top_n]
         
-        return top_documents_with_scores
\ No newline at end of file
+        return top_documents_with_scores
@@ -0,0 +1,106 @@
+import time
+import threading
+from collections import OrderedDict
+from core.reranker import normalize_query
+
+
+class RetrievalCache:
+    """
+    检索结果 TTL 缓存
+
+    流式问答结束后前端会立刻调用 /final_response，对同一问题重新执行向量检索、BM25 与重排。
+    arun_llm_MulitDocQA 把 top_documents_with_score 写入本缓存，同时以请求 id 与
+    (知识库, 归一化查询, 知识库版本) 两种键索引；/final_response 命中任一键即可直接复用。
+    知识库更新后版本号变化，旧结果不会再被命中，并随 TTL 过期。
+    """
+
+    def __init__(self, ttl_seconds=300, max_entries=1024):
+        """
+        Args:
+            ttl_seconds (float): 结果的有效期（秒）
+            max_entries (int): 最多保留的结果条数（按键计）
+        """
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _keys(req_id, kb_name, query, version):
+        keys = []
+        if req_id:
+            keys.append(("req", req_id))
+        if query is not None:
+            keys.append(("query", kb_name, normalize_query(query), version))
+        return keys
+
+    def put(self, top_documents_with_score, req_id=None, kb_name=None, query=None, version=None):
+        """
+        写入检索结果
+
+        Args:
+            top_documents_with_score (list): [(Document, score)]
+            req_id (str): 请求 id
+            kb_name (str): 知识库名称
+            query (str): 用户问题
+            version: 知识库版本（KBState.version）
+        """
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for key in self._keys(req_id, kb_name, query, version):
+                self._entries[key] = (expires, kb_name, version, list(top_documents_with_score))
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, req_id=None, kb_name=None, query=None, version=None):
+        """
+        读取检索结果；先按请求 id，再按 (知识库, 查询, 版本) 查找
+
+        Returns:
+            list 或 None: 命中时返回 [(Document, score)]
+        """
+        now = time.monotonic()
+        with self._lock:
+            for key in self._keys(req_id, kb_name, query, version):
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                expires, entry_kb, entry_version, result = entry
+                if expires < now:
+                    del self._entries[key]
+                    continue
+                # 请求 id 命中时仍需确认属于同一知识库的同一版本
+                if (entry_kb, entry_version) != (kb_name, version):
+                    continue
+                self.hits += 1
+                return list(result)
+            self.misses += 1
+        return None
+
+    def kb_name_for(self, req_id):
+        """
+        按请求 id 查找产生该检索结果的知识库名称（/final_response 未携带 kb_name 时使用）
+
+        Returns:
+            str 或 None
+        """
+        if not req_id:
+            return None
+        with self._lock:
+            entry = self._entries.get(("req", req_id))
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            return entry[1]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
@@ -1,5 +1,13 @@
+import os
+import json
+import math
+import shutil
+import time
 import string
-from rank_bm25 import BM25Okapi
+import threading
+import hashlib
+import logging
+import numpy as np
 
 # 尝试导入jieba分词，如果失败则使用备用方案
 try:
@@ -10,34 +18,412 @@ except ImportError:
     jieba_initialized = False
     print("Warning: jieba not found. Using simple tokenization.")
 
+logger = logging.getLogger("docqa.bm25")
+
+# 持久化格式版本；格式变化时递增，旧产物会被自动重建
+BM25_FORMAT_VERSION = 1
+
+
+class BM25Index:
+    """
+    基于倒排索引的 BM25 打分引擎（与 rank_bm25.BM25Okapi 打分公式一致）
+
+    索引以 CSR 形式存放：term -> postings(doc_id, tf)。查询时只遍历查询词的
+    postings，用 NumPy 向量化累加得分，避免对全量语料逐篇计算。
+
+    支持增量维护：新增文档写入独立的增量段（delta），删除文档只打墓碑标记；
+    df / 文档总长等统计量随增删即时更新，IDF 与 avgdl 按存活文档重新计算。
+    compacted() 可将增量段与墓碑合并为新的紧凑索引（无需重新分词）。
+    """
+
+    def __init__(self, k1=1.5, b=0.75, epsilon=0.25):
+        """
+        初始化空索引
+
+        Args:
+            k1 (float): 词频饱和参数
+            b (float): 文档长度归一化参数
+            epsilon (float): 负 IDF 的下限系数（与 BM25Okapi 保持一致）
+        """
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.vocab = {}
+        self.corpus_size = 0
+        self.avgdl = 0.0
+        self.doc_len = np.zeros(0, dtype=np.int32)
+        self.idf = np.zeros(0, dtype=np.float64)
+        # 按文档存放的 token id 序列（CSR），用于持久化与增量维护
+        self.doc_indptr = np.zeros(1, dtype=np.int64)
+        self.doc_terms = np.zeros(0, dtype=np.int32)
+        # 按词存放的 postings（CSR）
+        self.term_indptr = np.zeros(1, dtype=np.int64)
+        self.post_docs = np.zeros(0, dtype=np.int32)
+        self.post_tf = np.zeros(0, dtype=np.int32)
+        self._init_live_stats()
+
+    def _init_live_stats(self):
+        """
+        以当前基础段初始化增量维护所需的状态
+        """
+        self.base_size = self.corpus_size
+        # 墓碑掩码；None 表示没有被删除的文档
+        self.live = None
+        self.num_live = self.corpus_size
+        self.total_len = int(np.asarray(self.doc_len, dtype=np.int64).sum())
+        self.df = np.diff(self.term_indptr).astype(np.int64)
+        # 增量段：追加文档的 token id 序列及其 postings（doc 为全局下标）
+        self.delta_docs = []
+        self.delta_term_indptr = np.zeros(1, dtype=np.int64)
+        self.delta_post_docs = np.zeros(0, dtype=np.int32)
+        self.delta_post_tf = np.zeros(0, dtype=np.int32)
+
+    @classmethod
+    def from_tokenized(cls, tokenized_corpus, k1=1.5, b=0.75, epsilon=0.25):
+        """
+        由分词后的语料构建索引
+
+        Args:
+            tokenized_corpus (list): 每个元素是一个文档的分词结果
+
+        Returns:
+            BM25Index: 构建好的索引
+        """
+        index = cls(k1=k1, b=b, epsilon=epsilon)
+        vocab = index.vocab
+        doc_lens = np.empty(len(tokenized_corpus), dtype=np.int64)
+        flat_ids = []
+        for i, tokens in enumerate(tokenized_corpus):
+            doc_lens[i] = len(tokens)
+            for token in tokens:
+                term_id = vocab.get(token)
+                if term_id is None:
+                    term_id = vocab[token] = len(vocab)
+                flat_ids.append(term_id)
+        term_ids = np.asarray(flat_ids, dtype=np.int64)
+        index._build(term_ids, doc_lens)
+        return index
+
+    @staticmethod
+    def _postings(doc_ids, term_ids, num_terms):
+        """
+        由 (doc_id, term_id) 序列生成 term 主序的 CSR postings
+
+        Returns:
+            tuple: (term_indptr, post_docs, post_tf, df)
+        """
+        # 按 (doc, term) 合并重复词得到词频；np.unique 的结果先按 doc 再按 term 有序
+        width = max(num_terms, 1)
+        keys = doc_ids.astype(np.int64) * width + term_ids
+        uniq, counts = np.unique(keys, return_counts=True)
+        pair_docs = uniq // width
+        pair_terms = uniq % width
+        # 稳定排序到 term 主序，保证同一 term 内 doc 递增
+        order = np.argsort(pair_terms, kind="stable")
+        df = np.bincount(pair_terms, minlength=num_terms).astype(np.int64)
+        indptr = np.zeros(num_terms + 1, dtype=np.int64)
+        np.cumsum(df, out=indptr[1:])
+        return indptr, pair_docs[order].astype(np.int32), counts[order].astype(np.int32), df
+
+    def _build(self, term_ids, doc_lens):
+        """
+        由按文档拼接的 term id 序列构建 CSR postings 与 IDF 表
+        """
+        self.corpus_size = len(doc_lens)
+        self.doc_len = doc_lens.astype(np.int32)
+        self.doc_indptr = np.zeros(self.corpus_size + 1, dtype=np.int64)
+        np.cumsum(doc_lens, out=self.doc_indptr[1:])
+        self.doc_terms = term_ids.astype(np.int32)
+        doc_ids = np.repeat(np.arange(self.corpus_size, dtype=np.int64), doc_lens)
+        self.term_indptr, self.post_docs, self.post_tf, _ = self._postings(doc_ids, term_ids, len(self.vocab))
+        self._init_live_stats()
+        self._refresh_stats()
+
+    def _refresh_stats(self):
+        """
+        按存活文档重新计算 avgdl 与 IDF（O(词表)，与语料规模无关）
+        """
+        self.avgdl = self.total_len / self.num_live if self.num_live else 0.0
+        self.idf = self._calc_idf(self.df)
+
+    def _calc_idf(self, df):
+        """
+        计算 IDF；负值按 epsilon * 平均IDF 截断（同 BM25Okapi）
+
+        平均 IDF 只统计仍出现在存活文档中的词，保证与“按存活文档重建”的结果一致。
+        """
+        if len(df) == 0:
+            return np.zeros(0, dtype=np.float64)
+        df = df.astype(np.float64)
+        idf = np.log(self.num_live - df + 0.5) - np.log(df + 0.5)
+        present = df > 0
+        average_idf = math.fsum(idf[present]) / max(int(present.sum()), 1)
+        idf[(idf < 0) & present] = self.epsilon * average_idf
+        return idf
+
+    def doc_tokens(self, pos):
+        """
+        返回指定文档的 term id 序列
+        """
+        if pos < self.base_size:
+            return self.doc_terms[self.doc_indptr[pos]:self.doc_indptr[pos + 1]]
+        return self.delta_docs[pos - self.base_size]
+
+    def add(self, tokenized_docs):
+        """
+        追加文档到增量段
+
+        只对新增文档建 postings，耗时与新增文档量成正比。
+
+        Args:
+            tokenized_docs (list): 新增文档的分词结果
+
+        Returns:
+            range: 新文档在索引中的下标
+        """
+        start = self.corpus_size
+        vocab = self.vocab
+        new_docs = []
+        for tokens in tokenized_docs:
+            ids = []
+            for token in tokens:
+                term_id = vocab.get(token)
+                if term_id is None:
+                    term_id = vocab[token] = len(vocab)
+                ids.append(term_id)
+            new_docs.append(np.asarray(ids, dtype=np.int32))
+        lens = np.asarray([len(ids) for ids in new_docs], dtype=np.int32)
+
+        self.doc_len = np.concatenate([self.doc_len, lens])
+        self.delta_docs.extend(new_docs)
+        self.corpus_size += len(new_docs)
+        if self.live is not None:
+            self.live = np.concatenate([self.live, np.ones(len(new_docs), dtype=bool)])
+        self.num_live += len(new_docs)
+        self.total_len += int(lens.sum())
+        if len(self.df) < len(vocab):
+            self.df = np.concatenate([self.df, np.zeros(len(vocab) - len(self.df), dtype=np.int64)])
+        for ids in new_docs:
+            self.df[np.unique(ids)] += 1
+        self._rebuild_delta()
+        self._refresh_stats()
+        return range(start, self.corpus_size)
+
+    def _rebuild_delta(self):
+        """
+        重建增量段 postings（规模只取决于增量段文档数）
+        """
+        if not self.delta_docs:
+            return
+        lens = np.asarray([len(ids) for ids in self.delta_docs], dtype=np.int64)
+        doc_ids = np.repeat(np.arange(self.base_size, self.corpus_size, dtype=np.int64), lens)
+        term_ids = np.concatenate(self.delta_docs).astype(np.int64)
+        self.delta_term_indptr, self.delta_post_docs, self.delta_post_tf, _ = self._postings(
+            doc_ids, term_ids, len(self.vocab))
+
+    def delete(self, positions):
+        """
+        删除文档：打墓碑标记并从 df / 文档总长中扣除
+
+        Args:
+            positions (list): 待删除文档的下标
+        """
+        if self.live is None:
+            self.live = np.ones(self.corpus_size, dtype=bool)
+        for pos in positions:
+            if not self.live[pos]:
+                continue
+            self.live[pos] = False
+            self.df[np.unique(self.doc_tokens(pos))] -= 1
+            self.total_len -= int(self.doc_len[pos])
+            self.num_live -= 1
+        self._refresh_stats()
+
+    @property
+    def tombstones(self):
+        return self.corpus_size - self.num_live
+
+    def is_compact(self):
+        return not self.delta_docs and self.tombstones == 0
+
+    def live_positions(self):
+        if self.live is None:
+            return np.arange(self.corpus_size)
+        return np.flatnonzero(self.live)
+
+    def compacted(self, positions=None, vocab=None):
+        """
+        合并增量段并清除墓碑，生成新的紧凑索引（不需要重新分词）
+
+        Args:
+            positions (np.ndarray): 要保留的文档下标，默认全部存活文档
+            vocab (dict): 词表快照，默认复制当前词表
+
+        Returns:
+            BM25Index: 新索引，文档下标按 positions 的顺序重新编号
+        """
+        if positions is None:
+            positions = self.live_positions()
+        docs = [self.doc_tokens(pos) for pos in positions]
+        index = BM25Index(k1=self.k1, b=self.b, epsilon=self.epsilon)
+        index.vocab = dict(self.vocab) if vocab is None else vocab
+        doc_lens = np.asarray([len(ids) for ids in docs], dtype=np.int64)
+        term_ids = np.concatenate(docs).astype(np.int64) if docs else np.zeros(0, dtype=np.int64)
+        index._build(term_ids, doc_lens)
+        return index
+
+    _ARRAYS = ("doc_len", "idf", "doc_indptr", "doc_terms", "term_indptr", "post_docs", "post_tf")
+
+    def save(self, index_dir):
+        """
+        将索引写入目录（每个数组一个 .npy 文件，词表与参数写入 json）
+
+        Args:
+            index_dir (str): 目标目录
+        """
+        if not self.is_compact():
+            raise ValueError("BM25Index.save requires a compacted index")
+        os.makedirs(index_dir, exist_ok=True)
+        for name in self._ARRAYS:
+            np.save(os.path.join(index_dir, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        terms = [None] * len(self.vocab)
+        for term, term_id in self.vocab.items():
+            terms[term_id] = term
+        with open(os.path.join(index_dir, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False)
+        with open(os.path.join(index_dir, "params.json"), "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "epsilon": self.epsilon,
+                       "corpus_size": self.corpus_size, "avgdl": self.avgdl}, f)
+
+    @classmethod
+    def load(cls, index_dir, mmap=True):
+        """
+        从目录加载索引；数组默认以内存映射方式打开，不读入全部数据
+
+        Args:
+            index_dir (str): 索引目录
+            mmap (bool): 是否使用内存映射
+
+        Returns:
+            BM25Index: 加载的索引
+        """
+        with open(os.path.join(index_dir, "params.json"), "r", encoding="utf-8") as f:
+            params = json.load(f)
+        index = cls(k1=params["k1"], b=params["b"], epsilon=params["epsilon"])
+        index.corpus_size = params["corpus_size"]
+        for name in cls._ARRAYS:
+            setattr(index, name, np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r" if mmap else None))
+        with open(os.path.join(index_dir, "vocab.json"), "r", encoding="utf-8") as f:
+            index.vocab = {term: i for i, term in enumerate(json.load(f))}
+        index._init_live_stats()
+        index.avgdl = params["avgdl"]
+        return index
+
+    def get_scores(self, query_tokens):
+        """
+        计算查询对全部文档的 BM25 得分
+
+        Args:
+            query_tokens (list): 查询分词结果（重复词按重复次数计分，与 BM25Okapi 一致）
+
+        Returns:
+            np.ndarray: 长度为 corpus_size 的得分数组（已删除文档为 -inf）
+        """
+        if self.num_live == 0:
+            return np.full(self.corpus_size, -np.inf)
+        scores = np.zeros(self.corpus_size, dtype=np.float64)
+        k1, b, avgdl = self.k1, self.b, self.avgdl
+        segments = [(self.term_indptr, self.post_docs, self.post_tf)]
+        if self.delta_docs:
+            segments.append((self.delta_term_indptr, self.delta_post_docs, self.delta_post_tf))
+        for token in query_tokens:
+            term_id = self.vocab.get(token)
+            if term_id is None:
+                continue
+            idf = self.idf[term_id]
+            for indptr, post_docs, post_tf in segments:
+                if term_id + 1 >= len(indptr):
+                    continue
+                start, end = indptr[term_id], indptr[term_id + 1]
+                if start == end:
+                    continue
+                docs = post_docs[start:end]
+                q_freq = post_tf[start:end]
+                doc_len = self.doc_len[docs]
+                scores[docs] += idf * (q_freq * (k1 + 1) /
+                                       (q_freq + k1 * (1 - b + b * doc_len / avgdl)))
+        if self.live is not None:
+            scores[~self.live] = -np.inf
+        return scores
+
+    @staticmethod
+    def select(scores, threshold, top_k=None):
+        """
+        按阈值过滤并取得分最高的文档下标
+
+        排序规则与 sorted(..., reverse=True) 一致：得分降序，同分按下标升序。
+
+        Args:
+            scores (np.ndarray): 得分数组
+            threshold (float): 得分阈值（>= 阈值保留）
+            top_k (int): 最多返回的数量，None 表示不限制
+
+        Returns:
+            np.ndarray: 文档下标数组
+        """
+        idx = np.flatnonzero(scores >= threshold)
+        if top_k is not None and len(idx) > top_k:
+            if top_k <= 0:
+                return idx[:0]
+            hit_scores = scores[idx]
+            # argpartition 取第 k 大的分值，再把与之同分的候选一起保留，保证并列时结果稳定
+            kth = hit_scores[np.argpartition(-hit_scores, top_k - 1)[top_k - 1]]
+            idx = idx[hit_scores >= kth]
+        order = np.lexsort((idx, -scores[idx]))
+        idx = idx[order]
+        return idx[:top_k] if top_k is not None else idx
+
+
 class BM25Search:
     """
     BM25搜索类，用于基于关键词的文档检索
-    
+
     BM25是一种基于概率检索模型的排名函数，常用于信息检索。
     它基于词频、逆文档频率和文档长度等因素来评估查询与文档的相关性。
     """
-    
-    def __init__(self, docs, stopwords_file='stopwords.txt'):
+
+    def __init__(self, docs, stopwords_file='stopwords.txt', doc_ids=None, index=None, compact_threshold=0.2):
         """
         初始化BM25搜索器
-        
+
         Args:
             docs (list): 文档列表，每个文档应有page_content属性
             stopwords_file (str): 停用词文件路径
+            doc_ids (list): 与 docs 一一对应的 docstore id，用于持久化校验与增量增删
+            index (BM25Index): 已构建（或从磁盘加载）的索引；为空时对 docs 分词构建
+            compact_threshold (float): 墓碑占比超过该值时在后台合并索引
         """
-        self.docs = docs
+        # 只读映射的知识库传入按需读取的文档序列（core.docstore.LazyDocuments），命中时才读取分块内容
+        self.docs = docs if getattr(docs, "lazy", False) else list(docs)
+        self.doc_ids = list(doc_ids) if doc_ids is not None else None
         self.stop_words = self.load_stopwords(stopwords_file)
-        self.tokenized_corpus = self.tokenize_corpus()
-        self.bm25 = BM25Okapi(self.tokenized_corpus)
+        if index is None:
+            index = BM25Index.from_tokenized(self.tokenize_corpus())
+        self.bm25 = index
+        self.compact_threshold = compact_threshold
+        # 保护 bm25 / docs / doc_ids 的一致性；增删、合并替换与查询都在锁内完成
+        self._lock = threading.RLock()
+        self._version = 0
+        self._compacting = False
+        self._positions = {doc_id: pos for pos, doc_id in enumerate(self.doc_ids)} if self.doc_ids is not None else {}
 
     def load_stopwords(self, stopwords_file):
         """
         加载停用词列表
-        
+
         Args:
             stopwords_file (str): 停用词文件路径
-            
+
         Returns:
             set: 停用词集合
         """
@@ -53,15 +439,15 @@ class BM25Search:
     def bm25_tokenizer(self, text):
         """
         对文本进行BM25分词处理
-        
+
         Args:
             text (str): 待分词的文本
-            
+
         Returns:
             list: 分词结果列表
         """
         tokenized_doc = []
-        
+
         # 使用jieba分词（如果可用）
         if jieba_initialized and jieba is not None:
             tokens = jieba.cut_for_search(text)
@@ -69,7 +455,7 @@ class BM25Search:
             # 备用方案：使用简单的正则表达式分词
             import re
             tokens = re.findall(r'[\w]+', text)
-            
+
         for token in tokens:
             token = token.strip(string.punctuation)
             if len(token) > 0 and token not in self.stop_words:
@@ -79,30 +465,268 @@ class BM25Search:
     def tokenize_corpus(self):
         """
         对整个语料库进行分词处理
-        
+
         Returns:
             list: 分词后的语料库，每个元素是一个文档的分词结果
         """
         # 去除 tqdm 进度条开销，使用列表推导加速初始化
         return [self.bm25_tokenizer(doc.page_content) for doc in self.docs]
 
-    def search(self, query, threshold=0.1):
+    def tokenizer_fingerprint(self):
+        """
+        分词器指纹：分词实现 + 停用词表 + 持久化格式版本，任一变化都需要重新分词
+
+        Returns:
+            str: 指纹字符串
+        """
+        tokenizer = f"jieba-{getattr(jieba, '__version__', '')}" if jieba_initialized and jieba is not None else "regex"
+        h = hashlib.sha1()
+        h.update(f"v{BM25_FORMAT_VERSION}|{tokenizer}|".encode("utf-8"))
+        for word in sorted(self.stop_words):
+            h.update(word.encode("utf-8") + b"\n")
+        return h.hexdigest()
+
+    @staticmethod
+    def docstore_fingerprint(doc_ids):
+        """
+        docstore 指纹：按顺序对 docstore id 取哈希（分块内容变化时 id 必然变化）
+        """
+        h = hashlib.sha1()
+        for doc_id in doc_ids:
+            h.update(str(doc_id).encode("utf-8") + b"\n")
+        return h.hexdigest()
+
+    def save(self, index_root):
+        """
+        将 BM25 索引持久化到 index_root
+
+        每次保存写入新的代目录并更新 CURRENT 指针，避免覆盖正被内存映射的旧文件
+        （Windows 下无法删除已映射的文件），旧代目录尽力清理。
+
+        Args:
+            index_root (str): 索引根目录（通常为 <kb_dir>/bm25_index）
+        """
+        if self.doc_ids is None:
+            raise ValueError("BM25Search.save requires doc_ids")
+        os.makedirs(index_root, exist_ok=True)
+        generation = str(time.time_ns())
+        index_dir = os.path.join(index_root, generation)
+        with self._lock:
+            # 持久化格式只保存紧凑索引：存在增量段或墓碑时先同步合并
+            if not self.bm25.is_compact():
+                self._swap(self.bm25.live_positions(), self.bm25.compacted())
+            self.bm25.save(index_dir)
+            with open(os.path.join(index_dir, "doc_ids.json"), "w", encoding="utf-8") as f:
+                json.dump(self.doc_ids, f)
+            with open(os.path.join(index_dir, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump({
+                    "format_version": BM25_FORMAT_VERSION,
+                    "tokenizer_fingerprint": self.tokenizer_fingerprint(),
+                    "docstore_fingerprint": self.docstore_fingerprint(self.doc_ids),
+                }, f)
+        tmp_pointer = os.path.join(index_root, "CURRENT.tmp")
+        with open(tmp_pointer, "w", encoding="utf-8") as f:
+            f.write(generation)
+        os.replace(tmp_pointer, os.path.join(index_root, "CURRENT"))
+        for name in os.listdir(index_root):
+            path = os.path.join(index_root, name)
+            if name != generation and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+        logger.info(f"BM25 索引已保存: {index_dir} docs={len(self.doc_ids)}")
+
+    @classmethod
+    def load(cls, index_root, docs, doc_ids, stopwords_file='stopwords.txt', mmap=True, compact_threshold=0.2):
+        """
+        加载已持久化的 BM25 索引；指纹与当前分词器或 docstore 不一致时返回 None
+
+        Args:
+            index_root (str): 索引根目录
+            docs (list): 当前 docstore 中的文档（与 doc_ids 顺序一致）
+            doc_ids (list): 当前 docstore id 列表
+
+        Returns:
+            BM25Search | None
+        """
+        pointer = os.path.join(index_root, "CURRENT")
+        if not os.path.exists(pointer):
+            return None
+        with open(pointer, "r", encoding="utf-8") as f:
+            index_dir = os.path.join(index_root, f.read().strip())
+        try:
+            with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # 先以空索引创建搜索器用于指纹校验，校验通过后再挂载磁盘索引
+        searcher = cls(docs, stopwords_file, doc_ids=doc_ids, index=BM25Index(),
+                       compact_threshold=compact_threshold)
+        if meta.get("format_version") != BM25_FORMAT_VERSION:
+            return None
+        if meta.get("tokenizer_fingerprint") != searcher.tokenizer_fingerprint():
+            logger.info("BM25 分词器指纹变化，需要重建索引")
+            return None
+        if meta.get("docstore_fingerprint") != cls.docstore_fingerprint(searcher.doc_ids):
+            logger.info("docstore 已变化，需要重建 BM25 索引")
+            return None
+        searcher.bm25 = BM25Index.load(index_dir, mmap=mmap)
+        return searcher
+
+    @classmethod
+    def load_or_build(cls, index_root, docs, doc_ids, stopwords_file='stopwords.txt', compact_threshold=0.2):
+        """
+        优先加载持久化索引；不可用时重新分词构建并保存
+
+        Args:
+            index_root (str): 索引根目录
+            docs (list): 文档列表
+            doc_ids (list): 与 docs 对应的 docstore id 列表
+
+        Returns:
+            BM25Search: 可用的搜索器
+        """
+        try:
+            searcher = cls.load(index_root, docs, doc_ids, stopwords_file, compact_threshold=compact_threshold)
+        except Exception as e:
+            logger.warning(f"加载 BM25 索引失败，将重新构建: {e}")
+            searcher = None
+        if searcher is not None:
+            logger.info(f"已加载持久化 BM25 索引: {index_root}")
+            return searcher
+        logger.info("正在构建 BM25 索引（分词）...")
+        searcher = cls(docs, stopwords_file, doc_ids=doc_ids, compact_threshold=compact_threshold)
+        try:
+            searcher.save(index_root)
+        except Exception as e:
+            logger.warning(f"保存 BM25 索引失败: {e}")
+        return searcher
+
+    def __len__(self):
+        """
+        存活文档数（O(1)）
+        """
+        return self.bm25.num_live
+
+    def live_doc_ids(self):
+        """
+        当前存活文档的 docstore id（顺序与 docstore 一致）
+        """
+        with self._lock:
+            return [self.doc_ids[pos] for pos in self.bm25.live_positions()]
+
+    def add_documents(self, docs, doc_ids):
+        """
+        增量添加文档：只对新增文档分词并写入增量段
+
+        Args:
+            docs (list): 新增文档
+            doc_ids (list): 新增文档对应的 docstore id
+        """
+        if self.doc_ids is None:
+            raise ValueError("BM25Search.add_documents requires doc_ids")
+        tokenized = [self.bm25_tokenizer(doc.page_content) for doc in docs]
+        with self._lock:
+            positions = self.bm25.add(tokenized)
+            self._materialize_docs()
+            self.docs.extend(docs)
+            self.doc_ids.extend(doc_ids)
+            for pos, doc_id in zip(positions, doc_ids):
+                self._positions[doc_id] = pos
+            self._version += 1
+
+    def delete(self, doc_ids):
+        """
+        增量删除文档：打墓碑标记，墓碑占比超过阈值时触发后台合并
+
+        Args:
+            doc_ids (list): 待删除文档的 docstore id
+        """
+        with self._lock:
+            positions = [self._positions.pop(doc_id) for doc_id in doc_ids if doc_id in self._positions]
+            if not positions:
+                return
+            self.bm25.delete(positions)
+            self._materialize_docs()
+            for pos in positions:
+                self.docs[pos] = None
+            self._version += 1
+        self.maybe_compact()
+
+    def _materialize_docs(self):
+        # 增删前把按需读取的文档序列转换为列表（需持锁调用）
+        if not isinstance(self.docs, list):
+            self.docs = list(self.docs)
+
+    def maybe_compact(self):
+        """
+        墓碑占比超过 compact_threshold 时启动后台合并线程
+        """
+        with self._lock:
+            index = self.bm25
+            if self._compacting or index.corpus_size == 0:
+                return
+            if index.tombstones / index.corpus_size < self.compact_threshold:
+                return
+            self._compacting = True
+        threading.Thread(target=self._compact_in_background, daemon=True).start()
+
+    def _compact_in_background(self):
+        """
+        在后台线程中合并索引；合并期间若有新的增删则放弃本次结果，等待下次触发
+        """
+        try:
+            with self._lock:
+                index = self.bm25
+                version = self._version
+                positions = index.live_positions().copy()
+                vocab = dict(index.vocab)
+            start = time.time()
+            compacted = index.compacted(positions, vocab)
+            with self._lock:
+                if version != self._version or index is not self.bm25:
+                    logger.info("BM25 合并期间索引已变化，放弃本次合并")
+                    return
+                self._swap(positions, compacted)
+            logger.info(f"BM25 索引合并完成: docs={len(positions)} time={time.time() - start:.2f}s")
+        except Exception as e:
+            logger.exception(f"BM25 索引合并失败: {e}")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def _swap(self, positions, index):
+        """
+        用合并后的索引替换当前索引，并按同样的顺序压缩 docs / doc_ids（需持锁调用）
+        """
+        self.docs = [self.docs[pos] for pos in positions]
+        if self.doc_ids is not None:
+            self.doc_ids = [self.doc_ids[pos] for pos in positions]
+            self._positions = {doc_id: pos for pos, doc_id in enumerate(self.doc_ids)}
+        self.bm25 = index
+        self._version += 1
+
+    def search(self, query, threshold=0.1, top_k=None):
         """
         执行BM25搜索
-        
+
         Args:
             query (str): 查询语句
             threshold (float): 相关性得分阈值，低于此值的结果将被过滤
-            
+            top_k (int): 最多返回的文档数，None 表示返回全部命中
+
         Returns:
             list: 搜索结果文档列表，按相关性得分降序排列
         """
-        # 减少不必要的 I/O 输出，提高查询速度
-        bm25_scores = self.bm25.get_scores(self.bm25_tokenizer(query))
-        
-        bm25_hits = [{'corpus_id': idx, 'score': score} for idx, score in enumerate(bm25_scores) if score >= threshold]
-        bm25_hits = sorted(bm25_hits, key=lambda x: x['score'], reverse=True)
+        return [doc for doc, _ in self.search_with_scores(query, threshold, top_k)]
 
-        bm25_hits_res = [self.docs[hit['corpus_id']] for hit in bm25_hits]
+    def search_with_scores(self, query, threshold=0.1, top_k=None):
+        """
+        执行BM25搜索并保留得分（供检索融合使用）
 
-        return bm25_hits_res
\ No newline at end of file
+        Returns:
+            list: [(Document, score)]，按相关性得分降序排列
+        """
+        query_tokens = self.bm25_tokenizer(query)
+        with self._lock:
+            bm25_scores = self.bm25.get_scores(query_tokens)
+            hit_ids = BM25Index.select(bm25_scores, threshold, top_k)
+            return [(self.docs[i], float(bm25_scores[i])) for i in hit_ids]
@@ -8,7 +8,6 @@ from llama_index.core.node_parser import MarkdownElementNodeParser
 from llama_index.core import Settings, VectorStoreIndex, StorageContext
 from llama_parse import LlamaParse
 from llama_index.llms.deepseek import DeepSeek
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.vector_stores.chroma import ChromaVectorStore
 import chromadb
 from dotenv import load_dotenv
@@ -100,6 +99,50 @@ def _get_parser():
     return _parser
 
 
+def _create_embed_model(model_path, config=None, chunk_job=None):
+    """
+    获取 LlamaIndex 嵌入模型
+
+    编码器由 core.model_registry 统一持有，与 FAISS 检索侧的 get_embeddings() 共用同一份权重，
+    按 settings.embedding_backend 选择 "torch" 或 "onnx" 后端。
+
+    Args:
+        model_path (str): 嵌入模型目录
+        config (dict): config.yaml 内容，读取失败时为 None（使用 torch 后端）
+        chunk_job (ChunkEmbeddingJob): 构建索引时使用的分块向量缓存查询，为空时直接编码
+    """
+    from core.model_registry import model_registry
+
+    config = config or {}
+    return model_registry.llamaindex_embedding(
+        model_path,
+        config.get("settings", {}),
+        onnx_dir=config.get("paths", {}).get("embedding_onnx_dir"),
+        chunk_job=chunk_job,
+    )
+
+def _chunk_embedding_job(model_path, config=None):
+    """
+    Excel 索引构建用的分块向量缓存查询（与 FAISS 入库共用 settings.chunk_embedding_cache_path），
+    未配置或打开失败时返回 None
+    """
+    config = config or {}
+    settings = config.get("settings", {})
+    cache_path = settings.get("chunk_embedding_cache_path")
+    if not cache_path:
+        return None
+    try:
+        from core.chunk_embedding_store import ChunkEmbeddingStore, ChunkEmbeddingJob
+        from core.model_registry import model_registry
+
+        store = ChunkEmbeddingStore.shared(cache_path, max_entries=int(settings.get("chunk_embedding_cache_max", 2000000)))
+        fingerprint = model_registry.fingerprint(
+            model_path, settings, onnx_dir=config.get("paths", {}).get("embedding_onnx_dir"), normalize=True)
+        return ChunkEmbeddingJob(store, fingerprint)
+    except Exception as e:
+        logger.warning(f"分块向量缓存不可用，Excel 索引直接编码: {e}")
+        return None
+
 def _extract_excel_images_ocr(file_path: str) -> str:
     """
     从 Excel 中提取内嵌图片并调用 OCR 服务识别文字。
@@ -400,6 +443,7 @@ async def process_excel_file(file_path, markdown_directory):
                 
                 # 从config.yaml读取模型路径
                 model_path = None
+                config = None
                 try:
                     config_path = os.path.join(os.getcwd(), "config.yaml")
                     if os.path.exists(config_path):
@@ -410,11 +454,8 @@ async def process_excel_file(file_path, markdown_directory):
                     logger.warning(f"读取config.yaml失败: {e}")
                     model_path = r"D:\大模型应用开发\RAG\Doc_QA\model\bge-large-zh-v1.5"
                 
-                embed_model = HuggingFaceEmbedding(
-                    model_name=model_path,
-                    device='cpu',
-                    normalize=True
-                )
+                chunk_job = _chunk_embedding_job(model_path, config)
+                embed_model = _create_embed_model(model_path, config, chunk_job=chunk_job)
                 
                 # 初始化ChromaDB（使用知识库特定的路径）
                 db_client = chromadb.PersistentClient(path=chroma_db_path)
@@ -438,6 +479,8 @@ async def process_excel_file(file_path, markdown_directory):
                 
                 print(f"LlamaIndex索引构建成功，已保存到: {chroma_db_path}")
                 logger.info(f"LlamaIndex索引构建成功，已保存到: {chroma_db_path}, 知识库: {kb_name}")
+                if chunk_job is not None:
+                    logger.info(f"Excel 索引分块向量缓存 ({os.path.basename(file_path)}): {chunk_job.stats()}")
         except Exception as e:
             logger.warning(f"构建LlamaIndex索引失败（不影响主流程）: {e}")
             import traceback
@@ -486,6 +529,7 @@ def _get_excel_index_for_kb(kb_name, kb_dir):
         
         # 从config.yaml读取模型路径
         model_path = None
+        config = None
         try:
             config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "config.yaml")
             if os.path.exists(config_path):
@@ -496,11 +540,7 @@ def _get_excel_index_for_kb(kb_name, kb_dir):
             logger.warning(f"读取config.yaml失败: {e}")
             model_path = r"D:\大模型应用开发\RAG\Doc_QA\model\bge-large-zh-v1.5"
         
-        embed_model = HuggingFaceEmbedding(
-            model_name=model_path,
-            device='cpu',
-            normalize=True
-        )
+        embed_model = _create_embed_model(model_path, config)
         
         # 加载ChromaDB（使用与构建时相同的collection名称）
         db_client = chromadb.PersistentClient(path=chroma_db_path)
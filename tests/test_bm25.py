@@ -0,0 +1,130 @@
+"""
+BM25Index 与 rank_bm25.BM25Okapi 的打分一致性（含增量追加、墓碑删除、合并与持久化之后）
+
+语料与查询的构造方式与 benchmarks/bench_bm25.py 相同（Zipf 分布词表），规模缩小到可在单元测试中运行。
+"""
+import numpy as np
+import pytest
+
+from core.search_bm25 import BM25Index
+
+rank_bm25 = pytest.importorskip("rank_bm25")
+
+
+def make_corpus(num_docs, vocab_size=3000, avg_len=30, seed=0):
+    rng = np.random.default_rng(seed)
+    lens = rng.poisson(avg_len, size=num_docs).clip(min=1)
+    term_ids = rng.zipf(1.2, size=int(lens.sum())) % vocab_size
+    corpus = []
+    pos = 0
+    for n in lens:
+        corpus.append([f"w{t}" for t in term_ids[pos:pos + n]])
+        pos += n
+    return corpus
+
+
+def make_queries(corpus, num_queries=40, seed=1):
+    rng = np.random.default_rng(seed)
+    queries = []
+    for i in rng.integers(0, len(corpus), size=num_queries):
+        doc = corpus[i]
+        queries.append([doc[j] for j in rng.choice(len(doc), size=min(len(doc), 6), replace=False)])
+    # 重复词与词表外的词
+    queries.append(queries[0] + queries[0][:2])
+    queries.append(["not-in-vocab", queries[1][0]])
+    return queries
+
+
+def baseline_search(okapi, query, threshold, top_k):
+    # 原 BM25Search.search 的实现：全量打分后按阈值过滤并排序
+    scores = okapi.get_scores(query)
+    hits = [{'corpus_id': idx, 'score': score} for idx, score in enumerate(scores) if score >= threshold]
+    hits = sorted(hits, key=lambda x: x['score'], reverse=True)
+    return [hit['corpus_id'] for hit in hits][:top_k]
+
+
+def assert_matches(index, corpus, positions, queries):
+    """
+    index 中 positions 处的文档与 corpus 一一对应，其余下标均为已删除文档
+    """
+    okapi = rank_bm25.BM25Okapi(corpus)
+    deleted = np.setdiff1d(np.arange(index.corpus_size), positions)
+    for query in queries:
+        scores = index.get_scores(query)
+        np.testing.assert_allclose(scores[positions], okapi.get_scores(query), rtol=1e-9, atol=1e-9)
+        assert np.all(np.isneginf(scores[deleted]))
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    return make_corpus(1500)
+
+
+@pytest.fixture(scope="module")
+def queries(corpus):
+    return make_queries(corpus)
+
+
+def test_scores_match_okapi(corpus, queries):
+    index = BM25Index.from_tokenized(corpus)
+    assert_matches(index, corpus, np.arange(len(corpus)), queries)
+
+
+@pytest.mark.parametrize("threshold,top_k", [(0.2, 8), (0.0, None), (5.0, 3)])
+def test_select_matches_sorted_search(corpus, queries, threshold, top_k):
+    index = BM25Index.from_tokenized(corpus)
+    okapi = rank_bm25.BM25Okapi(corpus)
+    for query in queries:
+        got = BM25Index.select(index.get_scores(query), threshold, top_k)
+        expected = baseline_search(okapi, query, threshold, top_k)
+        # 数学上同分的文档在两种实现中可能只差末位精度，并列时的先后不作要求
+        reference = okapi.get_scores(query)
+        assert len(got) == len(expected)
+        np.testing.assert_allclose(reference[got], reference[expected], rtol=1e-9, atol=1e-9)
+        assert np.all(np.diff(reference[got]) <= 1e-9)
+
+
+def test_add_matches_rebuild(corpus, queries):
+    index = BM25Index.from_tokenized(corpus[:1000])
+    index.add(corpus[1000:1200])
+    index.add(corpus[1200:])
+    assert not index.is_compact()
+    assert_matches(index, corpus, np.arange(len(corpus)), queries)
+
+
+def test_delete_matches_rebuild(corpus, queries):
+    index = BM25Index.from_tokenized(corpus[:1200])
+    index.add(corpus[1200:])
+    deleted = list(range(0, len(corpus), 7)) + [1250, 1499]
+    index.delete(deleted)
+    # 重复删除不再扣减统计量
+    index.delete(deleted[:5])
+    positions = index.live_positions()
+    assert len(positions) == len(corpus) - len(set(deleted))
+    assert_matches(index, [corpus[i] for i in positions], positions, queries)
+
+
+def test_compacted_matches_rebuild(corpus, queries):
+    index = BM25Index.from_tokenized(corpus[:1200])
+    index.add(corpus[1200:])
+    index.delete(range(3, len(corpus), 5))
+    positions = index.live_positions()
+    compact = index.compacted()
+    assert compact.is_compact()
+    live_corpus = [corpus[i] for i in positions]
+    assert_matches(compact, live_corpus, np.arange(len(live_corpus)), queries)
+
+
+def test_save_load_roundtrip(corpus, queries, tmp_path):
+    index = BM25Index.from_tokenized(corpus[:1000])
+    index.add(corpus[1000:])
+    index.delete([1, 2, 1400])
+    compact = index.compacted()
+    compact.save(str(tmp_path))
+    loaded = BM25Index.load(str(tmp_path), mmap=True)
+    live_corpus = [corpus[i] for i in index.live_positions()]
+    assert_matches(loaded, live_corpus, np.arange(len(live_corpus)), queries)
+    # 加载后的索引继续增量维护
+    loaded.add([corpus[1]])
+    loaded.delete([0])
+    assert_matches(loaded, live_corpus[1:] + [corpus[1]], np.arange(1, len(live_corpus) + 1), queries)
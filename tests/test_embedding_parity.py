@@ -0,0 +1,72 @@
+"""
+ONNX 嵌入模型与 PyTorch HuggingFaceBgeEmbeddings 的向量一致性（与 benchmarks/check_embedding_parity.py 的判定一致）
+
+需要本地模型：config.yaml 中 model_dir 的 PyTorch 模型，以及 embedding_onnx_dir 中已导出的
+model.onnx / model.int8.onnx；模型目录或 ONNX 文件缺失、或未安装 sentence-transformers / onnxruntime 时跳过。
+"""
+import os
+import json
+import numpy as np
+import pytest
+import yaml
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+FIXTURE = os.path.join(ROOT, "benchmarks", "data", "parity_fixture.json")
+
+with open(os.path.join(ROOT, "config.yaml"), "r", encoding="utf-8") as config_file:
+    config = yaml.safe_load(config_file)
+MODEL_DIR = os.path.normpath(os.path.join(ROOT, config['paths']['model_dir']))
+ONNX_DIR = os.path.normpath(os.path.join(ROOT, config['paths'].get('embedding_onnx_dir', './model/onnx/bge-large-zh-v1.5')))
+NORMALIZE = config['settings'].get('normalize_embeddings', True)
+
+if not os.path.isdir(MODEL_DIR) or not os.path.isdir(ONNX_DIR):
+    pytest.skip(f"嵌入模型目录不存在: {MODEL_DIR} / {ONNX_DIR}", allow_module_level=True)
+pytest.importorskip("onnxruntime")
+pytest.importorskip("sentence_transformers")
+hf_embeddings = pytest.importorskip("langchain_community.embeddings")
+
+# 段落向量与查询向量允许的最小余弦相似度
+MIN_COSINE = {"int8": 0.99, "fp32": 0.9999}
+
+
+def cosine_rows(a, b):
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    return np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    with open(FIXTURE, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    return [item["query"] for item in items], [passage for item in items for passage in item["passages"]]
+
+
+@pytest.fixture(scope="module")
+def reference(corpus):
+    queries, passages = corpus
+    embeddings = hf_embeddings.HuggingFaceBgeEmbeddings(model_name=MODEL_DIR, model_kwargs={'device': 'cpu'},
+                                                       encode_kwargs={'normalize_embeddings': NORMALIZE})
+    return np.asarray(embeddings.embed_documents(passages)), np.asarray([embeddings.embed_query(q) for q in queries])
+
+
+@pytest.mark.parametrize("variant", ["int8", "fp32"])
+def test_onnx_vectors_match_torch(variant, reference, corpus):
+    from core.onnx_models import OnnxEncoder
+    from core.model_registry import EncoderEmbeddings, bge_query_instruction
+
+    onnx_file = os.path.join(ONNX_DIR, "model.int8.onnx" if variant == "int8" else "model.onnx")
+    if not os.path.exists(onnx_file):
+        pytest.skip(f"ONNX 模型不存在: {onnx_file}")
+    queries, passages = corpus
+    candidate = EncoderEmbeddings(OnnxEncoder(MODEL_DIR, onnx_dir=ONNX_DIR, int8=variant == "int8"),
+                                  normalize=NORMALIZE, query_instruction=bge_query_instruction(MODEL_DIR))
+    ref_docs, ref_queries = reference
+    got_docs = np.asarray(candidate.embed_documents(passages))
+    got_queries = np.asarray([candidate.embed_query(q) for q in queries])
+
+    assert cosine_rows(ref_docs, got_docs).min() >= MIN_COSINE[variant]
+    assert cosine_rows(ref_queries, got_queries).min() >= MIN_COSINE[variant]
+    # 每个查询在全部段落上的检索第一名一致
+    np.testing.assert_array_equal(np.argmax(got_queries @ got_docs.T, axis=1),
+                                  np.argmax(ref_queries @ ref_docs.T, axis=1))
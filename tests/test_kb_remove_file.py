@@ -0,0 +1,59 @@
+"""
+KnowledgeBase.remove_file 的 BM25 增量维护：删除文件只对其分块打墓碑，不重新分词构建索引
+
+需要完整的入库依赖（core.kb_manager 可导入），在项目根目录执行（读取 config.yaml 与 stopwords.txt）。
+"""
+import asyncio
+import pytest
+
+kb_manager = pytest.importorskip("core.kb_manager")
+
+from langchain_core.documents import Document
+from langchain_community.embeddings import FakeEmbeddings
+from langchain_community.vectorstores import FAISS
+from core.search_bm25 import BM25Search
+
+
+def make_docs():
+    return [Document(page_content=f"{name} 文件第{i}段：员工年假申请需提前三个工作日提交，差旅报销需附发票 {name}{i}",
+                     metadata={"file_path": f"/data/{name}.md", "source": name})
+            for name in ("alpha", "beta") for i in range(6)]
+
+
+@pytest.fixture
+def tokenized(monkeypatch):
+    # 记录每次整库分词的文档数；加载持久化索引与增量增删都不应调用 tokenize_corpus
+    calls = []
+    tokenize_corpus = BM25Search.tokenize_corpus
+
+    def spy(self):
+        calls.append(len(self.docs))
+        return tokenize_corpus(self)
+
+    monkeypatch.setattr(BM25Search, "tokenize_corpus", spy)
+    return calls
+
+
+def test_remove_file_does_not_rebuild_bm25(tmp_path, monkeypatch, tokenized):
+    monkeypatch.setitem(kb_manager.config['paths'], 'kb_dir', str(tmp_path))
+    embeddings = FakeEmbeddings(size=16)
+    kb = kb_manager.KnowledgeBase("kb_remove", embeddings)
+    asyncio.run(kb.save_vectordb(FAISS.from_documents(make_docs(), embeddings)))
+    assert tokenized == [12]
+
+    kb = kb_manager.KnowledgeBase("kb_remove", embeddings)
+    result = asyncio.run(kb.remove_file("alpha.md"))
+    assert "error" not in result
+    assert tokenized == [12]
+    remaining = list(kb.vectordb.docstore._dict.keys())
+    assert len(remaining) == 6
+    assert kb.bm25.live_doc_ids() == remaining
+    hits = kb.bm25.search("alpha3 beta3", threshold=0.0)
+    assert hits and {doc.metadata["source"] for doc in hits} == {"beta"}
+
+    # 写回的 BM25 索引与删除后的 docstore 一致，重新打开知识库时直接加载
+    reopened = kb_manager.KnowledgeBase("kb_remove", embeddings)
+    asyncio.run(reopened.load_vectordb())
+    asyncio.run(reopened.load_bm25())
+    assert tokenized == [12]
+    assert reopened.bm25.live_doc_ids() == reopened.vectordb.docstore.doc_ids()
@@ -0,0 +1,54 @@
+"""
+ONNX 重排模型与 PyTorch FlagReranker 的得分一致性（与 benchmarks/check_reranker_parity.py 的判定一致）
+
+需要本地模型：config.yaml 中 reranker_model_dir 的 PyTorch 模型，以及 reranker_onnx_dir 中已导出的
+model.onnx / model.int8.onnx；模型目录或 ONNX 文件缺失、或未安装 FlagEmbedding / onnxruntime 时跳过。
+"""
+import os
+import json
+import numpy as np
+import pytest
+import yaml
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+FIXTURE = os.path.join(ROOT, "benchmarks", "data", "parity_fixture.json")
+
+with open(os.path.join(ROOT, "config.yaml"), "r", encoding="utf-8") as config_file:
+    config = yaml.safe_load(config_file)
+MODEL_DIR = os.path.normpath(os.path.join(ROOT, config['paths']['reranker_model_dir']))
+ONNX_DIR = os.path.normpath(os.path.join(ROOT, config['paths'].get('reranker_onnx_dir', './model/onnx/bge-reranker-large')))
+
+if not os.path.isdir(MODEL_DIR) or not os.path.isdir(ONNX_DIR):
+    pytest.skip(f"重排模型目录不存在: {MODEL_DIR} / {ONNX_DIR}", allow_module_level=True)
+pytest.importorskip("onnxruntime")
+FlagEmbedding = pytest.importorskip("FlagEmbedding")
+
+# 归一化得分允许的最大绝对误差
+TOLERANCE = {"int8": 0.05, "fp32": 0.001}
+
+
+@pytest.fixture(scope="module")
+def fixture_items():
+    with open(FIXTURE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope="module")
+def reference():
+    return FlagEmbedding.FlagReranker(MODEL_DIR, use_fp16=False)
+
+
+@pytest.mark.parametrize("variant", ["int8", "fp32"])
+def test_onnx_scores_match_torch(variant, reference, fixture_items):
+    from core.onnx_models import OnnxReranker
+
+    onnx_file = os.path.join(ONNX_DIR, "model.int8.onnx" if variant == "int8" else "model.onnx")
+    if not os.path.exists(onnx_file):
+        pytest.skip(f"ONNX 模型不存在: {onnx_file}")
+    candidate = OnnxReranker(MODEL_DIR, onnx_dir=ONNX_DIR, int8=variant == "int8")
+    for item in fixture_items:
+        pairs = [(item["query"], passage) for passage in item["passages"]]
+        ref = np.asarray(reference.compute_score(pairs, normalize=True), dtype=np.float64).reshape(-1)
+        got = np.asarray(candidate.compute_score(pairs, normalize=True), dtype=np.float64).reshape(-1)
+        np.testing.assert_allclose(got, ref, rtol=0, atol=TOLERANCE[variant], err_msg=item["query"])
+        assert int(np.argmax(got)) == int(np.argmax(ref)), item["query"]